@@ -26,11 +26,13 @@
 
 THIS_SCRIPT_FRIENDLY_NAME = "Ansible for Spotify"
 
+# Startup is ordered so hotkeys are registered and the info window shown as soon as possible: importing spotipy, creating the authorized API client and everything that needs it (library sync, Liked Songs cache, playback polling) are deferred to a background warm-up thread (see warm_up). STARTUP_TIMES records milliseconds since this point at which startup milestones were reached; benchmark_startup.py reports them.
+import time
+STARTUP_START_TIME = time.perf_counter()
+STARTUP_TIMES = {}
+
 import os
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth
 import threading
-from threading import Thread
 
 # !----------------------------------------------------------------------
 # BEGIN INI PARSER create / read variables from ini into global variables
@@ -46,6 +48,10 @@ if not os.path.exists('Ansible_for_Spotify.ini'):
 # parse file (does nothing if empty file) :
 config.read('Ansible_for_Spotify.ini', encoding='UTF-8')
 
+# All writes of the config go through this, which batches, debounces and atomically writes them (off the hotkey threads); see config_store.py:
+from config_store import ConfigStore
+config_store = ConfigStore(config, 'Ansible_for_Spotify.ini')
+
 # Function to check for options in section and create them if they don't exist. NOTES:
 # - config.read() must be run first.
 # - DESCRIPTIVE_COMMENT is optional, and if passed it will be used as a comment on the field in the .ini. If it not passed (if its value is None), no comment will be left for the field.
@@ -58,10 +64,9 @@ def set_option_if_not(SECTION_NAME, OPTION_NAME, DESCRIPTIVE_COMMENT = None, REQ
         if DESCRIPTIVE_COMMENT != None:
             print('\n' + DESCRIPTIVE_COMMENT)
         option_value = input(OPTION_NAME + " not set. Enter it:\n")
-        config.set(SECTION_NAME, OPTION_NAME, option_value, comment = DESCRIPTIVE_COMMENT)
-        with open('Ansible_for_Spotify.ini', 'w', encoding='UTF-8') as configfile:
-            config.write(configfile)
-            # print("Wrote section ", SECTION_NAME, "option/value ", OPTION_NAME, option_value, "To .ini and variable.")
+        config_store.set(SECTION_NAME, OPTION_NAME, option_value, comment = DESCRIPTIVE_COMMENT)
+        # write entered values right away, so they're not lost if setup is interrupted:
+        config_store.flush()
         return option_value
     else:
         try:
@@ -71,15 +76,11 @@ def set_option_if_not(SECTION_NAME, OPTION_NAME, DESCRIPTIVE_COMMENT = None, REQ
         except:
             return None
 
+# Sets an option; the .ini is written shortly after (debounced, off this thread), or when the outermost config_store.transaction() around several set_option calls exits.
 def set_option(SECTION_NAME, OPTION_NAME, OPTION_VALUE, DESCRIPTIVE_COMMENT = None):
     # mitigate possible rong type error, though apparently name doesn't have to be a string:
     SECTION_NAME = str(SECTION_NAME); OPTION_NAME = str(OPTION_NAME); OPTION_VALUE = str(OPTION_VALUE)
-    if not config.has_section(SECTION_NAME):
-        config.add_section(SECTION_NAME)
-    config.set(SECTION_NAME, OPTION_NAME, OPTION_VALUE, comment = DESCRIPTIVE_COMMENT)
-    with open('Ansible_for_Spotify.ini', 'w', encoding='UTF-8') as configfile:
-        config.write(configfile)
-        # print("Wrote section ", SECTION_NAME, "option/value ", OPTION_NAME, OPTION_VALUE, "To .ini and variable.")
+    config_store.set(SECTION_NAME, OPTION_NAME, OPTION_VALUE, DESCRIPTIVE_COMMENT)
 
 
 # SETTING GLOBALS HERE:
@@ -100,27 +101,37 @@ if (BACK_SEEK_MS > 0):
 FORWARD_SEEK_MS = int(set_option_if_not('USER_VARIABLES', 'FORWARD_SEEK_MS', 'On skip forward, skip this many ms e.g. 5000ms = 5 seconds:', True))
 # PLAYLIST_ID_1 will here be init as None from the function call if it's not found in the .ini; otherwise it will be set to what is found:
 PLAYLIST_ID_1 = set_option_if_not('USER_VARIABLES', 'PLAYLIST_ID_1', 'Optional playlist for track/library moves/deletes:', False)
+# on swap track everywhere, whether to also unlike the swapped out track (and like the swapped in one instead); 'True' or 'False' (default):
+UNSAVE_SWAPPED_OUT_TRACK = set_option_if_not('USER_VARIABLES', 'UNSAVE_SWAPPED_OUT_TRACK', 'Optional, True or False: on swap track everywhere, also remove the swapped out track from Liked Songs (and like the swapped in one):', False) == 'True'
+# append liked tracks of current playlist: the playlist to append to (playlist 1 if not set), and whether to shuffle them first; 'True' or 'False' (default):
+LIKED_TRACKS_TARGET_PLAYLIST_ID = set_option_if_not('USER_VARIABLES', 'LIKED_TRACKS_TARGET_PLAYLIST_ID', 'Optional playlist to append the liked tracks of the current playlist to (instead of playlist 1):', False)
+SHUFFLE_LIKED_TRACKS = set_option_if_not('USER_VARIABLES', 'SHUFFLE_LIKED_TRACKS', 'Optional, True or False: shuffle the liked tracks of the current playlist before appending them:', False) == 'True'
+# discography playlists: whether to look up the ISRCs of album tracks (one request per 50 tracks) to find the same recording on several albums, instead of by title and duration only; 'True' or 'False' (default):
+DISCOGRAPHY_LOOKUP_ISRCS = set_option_if_not('USER_VARIABLES', 'DISCOGRAPHY_LOOKUP_ISRCS', 'Optional, True or False: on discography playlists, look up tracks\' ISRCs (more requests) to find the same recording on several albums:', False) == 'True'
+# curve playlist: the curves of audio features to follow (see curve_playlist.parse_curve_spec) and the number of tracks; the defaults are used if they're not set:
+CURVE_PLAYLIST_SPEC = set_option_if_not('USER_VARIABLES', 'CURVE_PLAYLIST_SPEC', 'Optional, curves of audio features for curve playlists built from Liked Songs, e.g. valence: rising_sine 0.2 0.9; tempo: rise 90 140', False) or 'valence: rising_sine 0.2 0.9; tempo: rise 90 140'
+CURVE_PLAYLIST_LENGTH = int(set_option_if_not('USER_VARIABLES', 'CURVE_PLAYLIST_LENGTH', 'Optional, number of tracks in curve playlists:', False) or 50)
 # END INI PARSER create / read variables from ini into global variables
 # !--------------------------------------------------------------------
 
 # SET DEFAULT / BLANK INI BOOKMARKS IF THERE ARE NONE
-# TO DO: clearer messages about whether / what it initialized? Because it says it did even if it didn't, I think.
+# (in one transaction, so it's at most one write of the .ini, and none if all bookmarks exist)
 def initialize_bookmarks_in_ini():
-    # Create bookmark sections if they don't exist
-    for i in range(0, 10):  # Let's assume you want to create 10 bookmarks
-        bookmark_name = f"BOOKMARK {i}"
-        if not config.has_section(bookmark_name):
-            config.add_section(bookmark_name)
-            set_option(bookmark_name, 'playlist_id', 'None')
-            set_option(bookmark_name, 'playlist_name', 'Unknown Playlist')
-            set_option(bookmark_name, 'track_id', 'None')
-            set_option(bookmark_name, 'position_ms', '0')
-            set_option(bookmark_name, 'key', i)
-
-    # Save the INI file with these default bookmark sections
-    with open('Ansible_for_Spotify.ini', 'w', encoding='UTF-8') as configfile:
-        config.write(configfile)
-        print("Initialized default blank bookmark sections in INI.")
+    initialized_bookmark_names = []
+    with config_store.transaction():
+        # Create bookmark sections if they don't exist
+        for i in range(0, 10):  # Let's assume you want to create 10 bookmarks
+            bookmark_name = f"BOOKMARK {i}"
+            if not config.has_section(bookmark_name):
+                config.add_section(bookmark_name)
+                set_option(bookmark_name, 'playlist_id', 'None')
+                set_option(bookmark_name, 'playlist_name', 'Unknown Playlist')
+                set_option(bookmark_name, 'track_id', 'None')
+                set_option(bookmark_name, 'position_ms', '0')
+                set_option(bookmark_name, 'key', i)
+                initialized_bookmark_names.append(bookmark_name)
+    if initialized_bookmark_names:
+        print("Initialized default blank bookmark sections in INI:", ', '.join(initialized_bookmark_names))
 
 initialize_bookmarks_in_ini()
 
@@ -128,153 +139,142 @@ API_SCOPE = "user-read-playback-state user-modify-playback-state user-read-curre
 
 
 # BEGIN SET UP API/SPOTIFY CLIENT SpotifyOAuth
-# can also be spotipy.oauth2.SpotifyOAuth:
-	# DEPRECATED on recommendation of AI code review:
-	# AUTH_MANAGER = spotipy.oauth2.SpotifyPKCE(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, scope=API_SCOPE)
-# TRYING INSTEAD on recommendation of AI code review:
-# import sys
-# print("USERNAME IS", USERNAME)
-# sys.exit(0)
-AUTH_MANAGER = SpotifyOAuth(client_id=CLIENT_ID, client_secret=CLIENT_SECRET, redirect_uri=REDIRECT_URI, scope=API_SCOPE, username=USERNAME)
-
-# Instantiate API client.
-sp = spotipy.Spotify(auth_manager=AUTH_MANAGER)
+# Function: import spotipy and create the authorized API client. Deferred (see sp below) because importing spotipy (and requests under it) is the slowest part of startup.
+AUTH_MANAGER = None
+TOKEN_MANAGER = None
+# API traffic can be recorded to a cassette file, or replayed from one (with no authorization or network), for profiling offline; see api_cassette.py:
+RECORD_CASSETTE_PATH = os.environ.get('ANSIBLE_FOR_SPOTIFY_RECORD_CASSETTE')
+REPLAY_CASSETTE_PATH = os.environ.get('ANSIBLE_FOR_SPOTIFY_REPLAY_CASSETTE')
+cassette_recorder = None
+cassette_player = None
+def create_spotify_client():
+    global AUTH_MANAGER, TOKEN_MANAGER, cassette_recorder, cassette_player
+    import spotipy
+    if REPLAY_CASSETTE_PATH:
+        import api_cassette
+        client = stop_client_rate_limit_retries(spotipy.Spotify(auth='cassette_replay', status_forcelist=(500, 502, 503, 504)))
+        cassette_player = api_cassette.CassettePlayer(REPLAY_CASSETTE_PATH, float(os.environ.get('ANSIBLE_FOR_SPOTIFY_REPLAY_SPEED', 1))).install(client)
+        print("~\nReplaying API responses from", REPLAY_CASSETTE_PATH)
+    else:
+        client = create_authorized_spotify_client()
+    if RECORD_CASSETTE_PATH:
+        import api_cassette
+        cassette_recorder = api_cassette.CassetteRecorder(RECORD_CASSETTE_PATH).install(client)
+        print("~\nRecording API traffic to", RECORD_CASSETTE_PATH)
+    return client
+
+def create_authorized_spotify_client():
+    global AUTH_MANAGER, TOKEN_MANAGER
+    import spotipy
+    from token_lifecycle import TokenLifecycleManager, AtomicTokenCacheHandler
+    # can also be spotipy.oauth2.SpotifyOAuth:
+        # DEPRECATED on recommendation of AI code review:
+        # AUTH_MANAGER = spotipy.oauth2.SpotifyPKCE(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, scope=API_SCOPE)
+    # TRYING INSTEAD on recommendation of AI code review:
+    from spotipy.oauth2 import SpotifyOAuth
+    # the token is cached in the same file spotipy caches it in by default, but written atomically:
+    AUTH_MANAGER = SpotifyOAuth(client_id=CLIENT_ID, client_secret=CLIENT_SECRET, redirect_uri=REDIRECT_URI, scope=API_SCOPE, username=USERNAME, cache_handler=AtomicTokenCacheHandler(username=USERNAME))
+    # The client gets its token from TOKEN_MANAGER, which refreshes it ahead of expiry in the background (see token_lifecycle.py), so that the first hotkey after hours idle doesn't wait on (or fail at) a token refresh:
+    TOKEN_MANAGER = TokenLifecycleManager(AUTH_MANAGER)
+    # (the refresh thread also loads the token, retrying until it can, in case that fails here or at warm up:)
+    TOKEN_MANAGER.start()
+    # The client is told not to retry 429s itself, so that the request scheduler sees them:
+    return stop_client_rate_limit_retries(spotipy.Spotify(auth_manager=TOKEN_MANAGER, status_forcelist=(500, 502, 503, 504)))
+
+# Instantiate API client, wrapped to record per-endpoint call statistics (see instrumented_spotify.py and print_api_statistics), with every call going through a shared request scheduler that rate limits calls, honors the API's Retry-After on HTTP 429, and runs hotkey calls before background and bulk work (see request_scheduler.py). The actual spotipy client is created by create_spotify_client on first use, or by warm_up, whichever comes first.
+from instrumented_spotify import InstrumentedSpotify
+from request_scheduler import RequestScheduler, BULK, stop_client_rate_limit_retries
+request_scheduler = RequestScheduler()
+# background threads (see where they are named) doing bulk work, whose API calls wait behind everything else:
+BULK_OPERATIONS = {'discography_albums': BULK, 'discography_artists': BULK, 'discography_playlist_fill': BULK, 'sync_library_database': BULK, 'saved_tracks_cache': BULK, 'playlist_membership': BULK}
+sp = InstrumentedSpotify(None, request_scheduler, BULK_OPERATIONS, client_factory = create_spotify_client)
+
+# Local synced database of the user's playlists and Liked Songs, for fast (indexed, local) library lookups. It's synced in the background at startup (see sync_library_database), and individual playlists are re-synced by snapshot_id before they're relied on.
+from library_database import LibraryDatabase
+library_database = LibraryDatabase(sp)
+
+# In-memory set of Liked Songs track IDs, so the info window can show whether the current track is liked without an API call. Seeded (from the local library database's copy of Liked Songs, so they're only downloaded once) and reconciled in the background (started after hotkeys are registered), and updated in place by the save / unsave hotkeys.
+from saved_tracks_cache import SavedTracksCache
+saved_tracks_cache = SavedTracksCache(sp, library_database)
+
+# The one poller of playback state (track, context, paused/playing, liked), which publishes changes to subscribers such as the info window; see playback_state_service.py:
+from playback_state_service import PlaybackStateService
+playback_state_service = PlaybackStateService(sp, saved_tracks_cache)
+
+# Cache of playlist names / owners and the current user's profile, which hotkeys look up over and over; see metadata_cache.py:
+from metadata_cache import MetadataCache
+metadata_cache = MetadataCache(sp)
+
+# In-memory index of which of the user's own playlists contain each track, so the info window can list them without an API call. Built from the library database in the background (started after hotkeys are registered), and updated as the library database changes; see playlist_membership.py:
+from playlist_membership import PlaylistMembershipIndex
+playlist_membership = PlaylistMembershipIndex(library_database)
+
+# Queue that basic playback hotkeys run on (in order, on one worker thread), which combines bursts of repeated presses of the same hotkey into one call; see action_dispatcher.py:
+from action_dispatcher import ActionDispatcher
+action_dispatcher = ActionDispatcher()
 
 # hotkeys setup:
 from global_hotkeys import *
 # NOTE: for debug print uncomment the following import:
 # import json
-import time
+
+# Function: return a version of a hotkey function that attributes the API calls it makes to it, in API call statistics.
+def attributed(function):
+    def attributed_function(*args):
+        with sp.attributed_to(function.__name__):
+            return function(*args)
+    attributed_function.__name__ = function.__name__
+    return attributed_function
+
+# Function: return a hotkey callback that queues function on the hotkey action dispatcher instead of running it on the hotkey library's thread. If coalesce is True, repeated presses are combined into one call of function with the sum of the presses' callback parameters (or the number of presses, for hotkeys without a parameter).
+def dispatched(function, coalesce = False):
+    def queue_action(value = None):
+        if coalesce and value == None:
+            value = 1
+        action_dispatcher.submit(function.__name__, attributed(function), value, coalesce)
+    return queue_action
 
 # Declare functions that key bindings will use.
 # re: https://stackoverflow.com/a/1489838 - forget managing threads, just destroy all of them with the whole program execution. DO IT.
 def exit_program():
+    # write any config changes still waiting on the debounce timer first:
+    config_store.flush()
+    if cassette_recorder:
+        cassette_recorder.close()
+    if cassette_player:
+        cassette_player.print_summary()
     os._exit(3)
 
-# Function to find an active device. Returns the first active device's ID or None if no devices are found.
-def find_active_device():
-    try:
-        devices = sp.devices()  # Retrieve all available devices
-        # print("Devices List:", devices)
-        for device in devices.get('devices', []):
-            if device.get('is_active') or device.get('id'):
-                # print("Active Device Found:", device['name'], device['id'])
-                return device['id']  # Return the first active device's ID
-        print("No active devices found.")
-        return None
-    except Exception as e:
-        print("Error finding active device:", e)
-        return None
-
-# Function to switch playback to a specified device using its ID
-def switch_to_device(device_id):
-    try:
-        sp.transfer_playback(device_id=device_id, force_play=True)
-        print(f"Playback transferred to device: {device_id}")
-    except Exception as e:
-        print("Error transferring playback:", e)
-
-# Function: pause or start playback, using other functions to find and switch to an active player if no player found:
-def pause_or_start_playback():
-    try:
-        playback = sp.current_playback()
-        if not playback:  # If there's no playback context, find and switch to an active device
-            print("No active player found. Searching for active devices...")
-            active_device_id = find_active_device()
-            if active_device_id:
-                switch_to_device(active_device_id)
-            else:
-                print("No active device available. Cannot resume playback.")
-                return
-
-        if playback and playback['is_playing']:
-            sp.pause_playback()
-        else:
-            sp.start_playback()
-            # global used elsewhere to determine whether to poll API based on playback state:
-            global continue_keepalive_poll
-            continue_keepalive_poll = True
-            # debug print only; comment out for production:
-            # print("Set continue_keepalive_poll to True.")
-    except Exception as e:
-        print("~\nWARNING: no information retrieved for current_playback. If you're playing a device, maybe play and pause the player manually, then retry control from this script.")
-        print(e)
-    update_info_window()
-    
-def previous_track():
-    ret = sp.previous_track()
-    update_info_window()
-
-# Function: advance playback to next track
-def next_track():
-    ret = sp.next_track()
-    update_info_window()
-
-# Function: save currently playing track to user library ("like" current song)
-def save_track():
-    info = sp.current_user_playing_track()
-    try:
-        playlist_ID = info['context']['external_urls']['spotify']
-        track_ID = info['item']['external_urls']['spotify']
-        list_of_track_IDs = [track_ID]
-        sp.current_user_saved_tracks_add(list_of_track_IDs)
-        print("Saved currently playing track", list_of_track_IDs, "to Liked Songs.")
-        print("Attempted confirm:")
-        update_info_window(CLI_print = True)
-    except Exception as e:
-        print("~\nCould not save current track (could not add to Liked Songs).")
-        print(e)
-
-def unsave_track():
-    info = sp.current_user_playing_track()
+# Function: refresh the info window (and anything else subscribed to playback state changes). This only asks the playback state service (see playback_state_service.py) to poll soon, so it's non-blocking, and several hotkeys in quick succession are served by one poll, instead of each polling the API.
+# Can take an optional parameter CLI_print which when passed causes the refresh to print info to CLI.
+# Pass expect_track_change=True from hotkeys that skip tracks, so the new track shows in the info window as soon as possible.
+def update_info_window(CLI_print = False, expect_track_change = False):
+    # It seems that right at script launch, info_window doesn't exist for a bit, so this has to be tried end excepted:
     try:
-        playlist_ID = info['context']['external_urls']['spotify']
-        track_ID = info['item']['external_urls']['spotify']
-        list_of_track_IDs = [track_ID]
-        sp.current_user_saved_tracks_delete(list_of_track_IDs)
-        print("Remove currently playing track", list_of_track_IDs, "from Liked Songs.")
-        print("Attempted confirmation:")
-        update_info_window(CLI_print = True)
-    except Exception as e:
-        print("~\nCould not unsave current track (could not add to Liked Songs).")
-        print(e)
-
-# change repeat mode; cycles from current to previous mode and wraps around; e.g. no repeat, playlist repeat, then track repeat:
-REPEAT_MODES = ['track', 'context', 'off']
-def change_repeat_mode():
-    global REPEAT_MODES
-    retrieved_playback_state = sp.current_playback()['repeat_state']
-    current_repeat_mode_idx = REPEAT_MODES.index(retrieved_playback_state)
-    current_repeat_mode_idx -= 1
-    if current_repeat_mode_idx < 0:
-        current_repeat_mode_idx = 2
-    state_parameter = REPEAT_MODES[current_repeat_mode_idx]
-    sp.repeat(state_parameter)
-
-SHUFFLE_STATES = [True, False]
-def toggle_playback_shuffle():
-    global SHUFFLE_STATES
-    retrieved_playback_state = sp.current_playback()['shuffle_state']
-    current_shuffle_state_idx = SHUFFLE_STATES.index(retrieved_playback_state)
-    current_shuffle_state_idx += 1
-    if current_shuffle_state_idx > 1:
-        current_shuffle_state_idx = 0
-    state_parameter = SHUFFLE_STATES[current_shuffle_state_idx]
-    sp.shuffle(state_parameter)
-
-# set playback position to start of current track
-def seek_to_track_start():
-    sp.seek_track(0)
-    info = sp.current_playback()['progress_ms']
-
-# set playback position forward or backward by seek_ms (milleseconds, negative or positive)
-def relative_seek(seek_ms):
-    # nested function call here: set current playback progress to current + ms (with ms neg. or positive)
-    new_seek_ms_pos = int(sp.current_playback()['progress_ms']) + seek_ms
-    # set that to zero if it's negative, to avoid error:
-    if new_seek_ms_pos < 0:
-        new_seek_ms_pos = 0
-    sp.seek_track(new_seek_ms_pos)
+        info_window.update_glyph("❓")
+    except:
+        print("No glyph info_window object to update (yet?), apparently.")
+    playback_state_service.request_refresh(CLI_print, expect_track_change = expect_track_change)
+
+# The playback and library hotkey functions, which live in hotkey_actions.py so that benchmark_offline.py can run them too; these names are what the hotkeys below are bound to:
+from hotkey_actions import HotkeyActions
+hotkey_actions = HotkeyActions(sp, library_database, saved_tracks_cache, playback_state_service, metadata_cache, PLAYLIST_ID_1, DISCARDS_PLAYLIST_ID, update_info_window)
+pause_or_start_playback = hotkey_actions.pause_or_start_playback
+previous_track = hotkey_actions.previous_track
+next_track = hotkey_actions.next_track
+save_track = hotkey_actions.save_track
+unsave_track = hotkey_actions.unsave_track
+get_current_playback = hotkey_actions.get_current_playback
+change_repeat_mode = hotkey_actions.change_repeat_mode
+toggle_playback_shuffle = hotkey_actions.toggle_playback_shuffle
+seek_to_track_start = hotkey_actions.seek_to_track_start
+relative_seek = hotkey_actions.relative_seek
+print_current_track_information = hotkey_actions.print_current_track_information
+print_playlist_1_info = hotkey_actions.print_playlist_1_info
+add_current_track_to_playlist_1 = hotkey_actions.add_current_track_to_playlist_1
+remove_current_track_from_current_playlist = hotkey_actions.remove_current_track_from_current_playlist
+shuffle_current_track_to_playlist_1 = hotkey_actions.shuffle_current_track_to_playlist_1
+unsave_and_move_from_current_playlist_to_discards = hotkey_actions.unsave_and_move_from_current_playlist_to_discards
 
 # adapted from: https://github.com/spotipy-dev/spotipy/blob/master/examples/artist_discography.py
 # def get_artist(name):
@@ -285,39 +285,6 @@ def relative_seek(seek_ms):
 #     else:
 #         return None
 
-# adapted from: https://github.com/spotipy-dev/spotipy/blob/master/examples/artist_discography.py
-def get_album_tracks(album):
-    tracks = []
-    results = sp.album_tracks(album['id'])
-    tracks.extend(results['items'])
-    while results['next']:
-        results = sp.next(results)
-        tracks.extend(results['items'])
-    # for i, track in enumerate(tracks):
-    # for track in tracks:
-        # print(track)
-        # logger.info('%s. %s', i + 1, track['name'])
-    return tracks
-
-# adapted from: https://github.com/spotipy-dev/spotipy/blob/master/examples/artist_discography.py
-def get_artist_albums(artist):
-    albums = []
-    results = sp.artist_albums(artist['id'], album_type='album')
-    albums.extend(results['items'])
-    while results['next']:
-        results = sp.next(results)
-        albums.extend(results['items'])
-    # logger.info('Total albums: %s', len(albums))
-    # unique = set()  # skip duplicate albums
-    # for album in albums:
-        # print(album)
-    #     name = album['name'].lower()
-    #     if name not in unique:
-    #         logger.info('ALBUM: %s', name)
-    #         unique.add(name)
-    #         show_album_tracks(album)
-    return albums
-
 # adapted from: https://github.com/spotipy-dev/spotipy/blob/master/examples/artist_discography.py
 # def show_artist(artist):
 #     logger.info('====%s====', artist['name'])
@@ -325,49 +292,30 @@ def get_artist_albums(artist):
 #     if len(artist['genres']) > 0:
 #         logger.info('Genres: %s', ','.join(artist['genres']))
 
-# Print information related to currenlty playing track. Also a gatekeeper function returning False if no playing track, and True and a playback info object from sp.current_user_playing_track().
-def print_current_track_information():
-    try:
-        info = sp.current_user_playing_track()
-        track_URL = info['item']['external_urls']['spotify']
-        artists = info['item']['artists']
-        print("Current track URL (ends with ID) :", track_URL)
-        print("Artist(s):")
-        for artist in artists:
-            print("\t", artist['name'])                
-        album = info['item']['album']['name']
-        track_name = info['item']['name']
-        print("Album:\t", album)
-        print("Track:\t", track_name)
-        return True
-    except Exception as e:
-        print("No current track context, or not found, or other API error?")
-        print(e)
-        return False
-
 # TO DO: simplify other places that print this info if they do? By using this function?
+# Makes at most one API call (a playback state poll, which also refreshes the info window) when playlist names are cached; see metadata_cache.py.
 def print_information():
     print_playlist_1_info()
     # boolean that may be overriden depending:
     success = True
-    info = sp.current_user_playing_track()
+    info = None
+    try:
+        info = playback_state_service.poll(is_refresh = True, CLI_print = True)
+    except Exception as e:
+        print("Error attempting to retrieve playback info:")
+        print(e)
     # because in some settings that can result that info is None or there may be other errors:
     try:
         playlist_ID = info['context']['external_urls']['spotify']
         print("~\nCurrent playlist or ID: ", playlist_ID, sep='')
         try:
             playlist_ID = info['context']['external_urls']['spotify']
-            playlist_name = sp.playlist(playlist_ID, fields="name")['name']
+            playlist_name = metadata_cache.get_playlist_name(playlist_ID)
             print("  name:", playlist_name)
-            success = print_current_track_information()
+            success = print_current_track_information(info)
         except Exception as e:
             print("No currently playing playlist context? An album or podcast?")
             print(e)
-        try:
-            update_info_window(CLI_print = True)
-        except Exception as e:
-            print("Error attempting to update user saved tracks (Liked Songs) track info_window:")
-            print(e)
     except Exception as e:
         print("Couldn't obtain track info from current context somehow, or other error?")
         print(e)
@@ -375,68 +323,59 @@ def print_information():
     if DISCARDS_PLAYLIST_ID:
         print("~\nDiscards playlist ID:", DISCARDS_PLAYLIST_ID)
         try:
-            playlist_name = sp.playlist(DISCARDS_PLAYLIST_ID, fields="name")['name']
+            playlist_name = metadata_cache.get_playlist_name(DISCARDS_PLAYLIST_ID)
             print("  name:", playlist_name)
         except Exception as e:
             print("~\nCouldn't obtain playlist information from current context somehow, or other error?")
             print(e)
     else:
         print("~\nNo discards playlist id is set. Things may break if you try to use such a list.")
+    action_dispatcher.print_latency_summary()
     if success == False:
         return False
     else:
         return True, info
 
-# this function is a stub that creates a threaded function call, because if the called function was not threaded, it would be blocking, as it uses time.sleep. If it weren't threaded, the time.sleep wait could block user hotkey presses, which would annoyingly prevent the user from using the hotkeys during time.sleep. Threaded, it's non-blocking, and the user can use the hotkeys while it's running.
-# First required parameter is an object that is an instance of class GlyphWindow
-# Can take an optional parameter CLI_print which when passed to the threaded function causes it to print info to CLI.
-def update_info_window(CLI_print = False):
-    global info_window
-    # pass on the CLI_print parameter:
-    thread = threading.Thread(target=threaded_update_info_window, args = [CLI_print])
-    thread.start()
-
-# can pass along optional parameter; if this parameter is passed and is anything other than False, info is printed to the CLI about whether the currently playing track is in the user's saved tracks (Liked Songs) :
-def threaded_update_info_window(CLI_print = False):
-    # It seems that right at script launch, info_window doesn't exist for a bit, so this has to be tried end excepted:
-    try:
-        info_window.update_glyph("❓")
-    except:
-        print("No glyph info_window object to update (yet?), apparently.")
-    # wait a bit before calling print track info because it can take a bit before a track change happens:
-    time.sleep(0.67)
-    # avoids runtime error of info variable being undeclared:
-    info = None
+# Function: playback state service subscriber that draws the info window for the playing track. If CLI_print is anything other than False, info is printed to the CLI about whether the currently playing track is in the user's saved tracks (Liked Songs) :
+def draw_info_window(event_names, playback, is_in_user_saved_tracks, CLI_print = False):
+    if playback == None or playback.get('item') == None:
+        return
+    track_ID = playback['item']['id']
+    if 'track' in event_names:
+        print("Active playback polling: DIFFERENT track ID ", track_ID, " -- updating user saved tracks (Liked Songs) track info_window.")
+        CLI_print = True
+    album = playback['item']['album']['name']
+    # truncate to a number of characters displayable in the info window:
+    if len(album) > 46:
+        album = album[:46] + " ..."
+    track_name = playback['item']['name']
+    # truncate this also:
+    if len(track_name) > 54:
+        track_name = track_name[:54] + " ..."
+    # which of the user's playlists the track is also in, from the playlist membership index (no API call):
+    playlist_names = playlist_membership.get_playlist_names(track_ID)
+    playlists_line = ""
+    if playlist_names:
+        playlists_line = "\n▤ " + str(len(playlist_names)) + ": " + ", ".join(playlist_names)
+        if len(playlists_line) > 60:
+            playlists_line = playlists_line[:60] + " ..."
+        if CLI_print != False:
+            print("Currently playing track is also in your playlists:", playlist_names)
     try:
-        info = sp.current_user_playing_track()
-    except Exception as e:
-        print("In threaded_update_info_window call, error running function to attempt to retrieve playing track info. If you have an active player, maybe play and pause the player manually, then retry control from this script. OR There was some other error. Printing the error response:")
-        print(e)
-    if info != None:
-        track_ID = info['item']['id']
-        album = info['item']['album']['name']
-        # truncate to a number of characters displayable in the info window:
-        if len(album) > 46:
-            album = album[:46] + " ..."
-        track_name = info['item']['name']
-        # truncate this also:
-        if len(track_name) > 54:
-            track_name = track_name[:54] + " ..."
-        # This function expects a list, so track_ID is put into on in the call by surrounding it with []:
-        is_in_user_saved_tracks = sp.current_user_saved_tracks_contains([track_ID])
-        # That's a 1-lenght array, odd. The first and only element in it can be used as True or False:
-        if is_in_user_saved_tracks[0]:
+        if is_in_user_saved_tracks:
             if CLI_print != False:
                 print("💚🎵💛 Currently playing track ID " + track_ID + " is in user saved tracks (Liked Songs)!")
-            info_window.update_glyph("🖤\n" + album + "\n~ " + track_name)
-            #  + "\n" + album_name + "\n" + track_name
+            info_window.update_glyph("🖤\n" + album + "\n~ " + track_name + playlists_line)
         else:
             if CLI_print != False:
                 print("🖤 Currently playing track ID " + track_ID + " is NOT in user saved tracks (Liked Songs).")
-            info_window.update_glyph("🤍\n~ " + album + "\n ~" + track_name)
+            info_window.update_glyph("🤍\n~ " + album + "\n ~" + track_name + playlists_line)
+    except NameError:
+        print("No glyph info_window object to update (yet?), apparently.")
 
 # make discography playlist from the artist of the currently playing song.
 def make_discography_playlist():
+    import discography
     print("Attempting to make discography playlist..")
     to_continue, info = print_information()
     if to_continue:
@@ -446,84 +385,78 @@ def make_discography_playlist():
             artists = info['item']['artists']
             print("  Artist(s):")
             for artist in artists:
-                # optional dev empty of debug.txt:
-                # TO DO: open and close that file only once instead of repeatedly in a loop over artists here?
-                # f = open("debug.txt", "w", encoding='utf_8')
-                # f.write("")
-                # f.close()
-                discography_artist_name = artist['name']; artist_id = artist['id']; artist_URL = artist['external_urls']['spotify']
-                print(" ", discography_artist_name, artist_id, artist_URL)
-                all_artists_tracks = []
-                # all_related_artists_tracks = []
-                # get all albums of artist!
-                albums = get_artist_albums(artist)
-                # get all tracks of albums!
-                print("Collecting and filtering tracks by credit to artist", discography_artist_name, ". .")
-                for album in albums:
-                    tracks = get_album_tracks(album)
-                    # check tracks for credit to the artist we're building a playlist for, and only add to an array of tracks if it matches (as artists can end up on albums with other artists where they didn't contribute to other tracks) :
-                    for track in tracks:
-                        track_artists = track['artists']
-                        for track_artist in track_artists:
-                            print(". ", end="")
-                            if track_artist['name'] == discography_artist_name:
-                                all_artists_tracks.append(track['external_urls']['spotify'])
-                            # TO DO? - make a separate playlist with these? Or a config item to optionally include them?
-                            # else:
-                                # all_related_artists_tracks.append(track['external_urls']['spotify'])
-                print("Done collectiong all tracks for artist. Building discography playlist . . .")
+                print(" ", artist['name'], artist['id'], artist['external_urls']['spotify'])
+            # get all albums of all artists, and all tracks of those albums, filtered by credit to each artist; concurrently, see discography.py:
+            print("Collecting and filtering tracks by credit to artist(s) . .")
+            artists_releases = discography.collect_discographies(sp, artists, lookup_isrcs = DISCOGRAPHY_LOOKUP_ISRCS)
+            for artist in artists:
+                if artist['id'] not in artists_releases:
+                    continue
+                discography_artist_name = artist['name']
+                all_artists_tracks = discography.get_track_urls(artists_releases[artist['id']]['tracks'])
+                print("Done collectiong all tracks for artist", discography_artist_name, ". Building discography playlist . . .")
                 random_playlist_name_suffix = ''.join((random.choice(' ▔▀▆▄▂▌▐█▊▎░▒▓▖▗▘▙▚▛▜▝▞▟') for i in range(4)))
                 new_playlist_name = discography_artist_name + " ~" + random_playlist_name_suffix
-                print("MAKING PLAYLIST: ", new_playlist_name)
-                user_id = sp.me()['id']
+                user_id = metadata_cache.get_current_user()['id']
                 global THIS_SCRIPT_FRIENDLY_NAME
                 playlist_description = 'Everything by this artist on Spotify (or albums etc. in which this artist appears!), courtesy ' + THIS_SCRIPT_FRIENDLY_NAME
-                # function reference: user_playlist_create(user, name, public=True, collaborative=False, description='')
-                new_playlist_info = sp.user_playlist_create(user_id, new_playlist_name, public=True, collaborative=False, description=playlist_description)
-                new_playlist_id = new_playlist_info['external_urls']['spotify']
-                print('new_playlist_id', new_playlist_id)
-                # API reference for this function: "A maximum of 100 items can be added in one request." So, split them up:
-                # Because the list index/slice syntax returns an empty array if we query out of bounds, we can do an infinite loop over elements getting batches of elements from it until it returns empty.
-                idx = 0
                 print("Number of songs collected for playlist: ", len(all_artists_tracks))
-                # . . AND ADD ALL THOSE SONGS TO IT:
-                how_many_at_a_time = 100
-                while True:
-                    tracks_to_add = all_artists_tracks[idx:][:how_many_at_a_time]
-                    idx += how_many_at_a_time
-                    if tracks_to_add == []:
-                        print("Reached end of available tracks to add to playlist.")
-                        break
-                    else:
-                        # this function call adds to the end of a playlist by default, and we're doing that:
-                        try:
-                            sp.playlist_add_items(new_playlist_id, tracks_to_add)
-                        except Exception as e:
-                            print("WARNING: error attempting to add tracks to playlist ", new_playlist_id)
-                            print(e)
+                # . . AND ADD ALL THOSE SONGS TO IT (or to several "part N" playlists, if there are more than fit in one playlist) :
+                playlist_parts, failed_track_urls = discography.write_discography_playlists(sp, user_id, new_playlist_name, all_artists_tracks, playlist_description)
+                for new_playlist_id, part_name, track_count in playlist_parts:
+                    print('new_playlist_id', new_playlist_id, part_name, track_count, 'tracks')
+                if not playlist_parts:
+                    print("No tracks credited to", discography_artist_name + "; no discography playlist made.")
+                    continue
+                # record the albums and recordings written (not those that failed to be added), so refresh_discography_playlist can append only new releases later, and retry the failed ones:
+                discography_manifest = get_discography_manifest()
+                written_album_ids, recordings = discography.get_written_releases(artists_releases[artist['id']]['album_ids'], artists_releases[artist['id']]['tracks'], failed_track_urls)
+                discography_manifest.record(artist, new_playlist_name, playlist_description, playlist_parts, written_album_ids, recordings)
+                discography_manifest.save()
         except Exception as e:
             print("Could not get albums (nor songs) information.")
             print(e)
 
+# The manifest of discography playlists made (see discography_manifest.py), loaded on first use:
+DISCOGRAPHY_MANIFEST = None
+def get_discography_manifest():
+    global DISCOGRAPHY_MANIFEST
+    if DISCOGRAPHY_MANIFEST == None:
+        from discography_manifest import DiscographyManifest
+        DISCOGRAPHY_MANIFEST = DiscographyManifest()
+    return DISCOGRAPHY_MANIFEST
+
+# refresh the discography playlist(s) of the artist(s) of the currently playing song (made with make_discography_playlist): append only their new releases.
+def refresh_discography_playlist():
+    import discography
+    print("Attempting to refresh discography playlist(s)..")
+    info = sp.current_user_playing_track()
+    try:
+        user_id = metadata_cache.get_current_user()['id']
+        for artist in info['item']['artists']:
+            discography.refresh_discography(sp, user_id, artist, get_discography_manifest(), lookup_isrcs = DISCOGRAPHY_LOOKUP_ISRCS)
+    except Exception as e:
+        print("~\nCould not refresh discography playlist(s). Printing the error response:")
+        print(e)
+
 # function: set a playlist for operations (such as adding a song from another playing list)
 def set_playlist_1():
-    # check currently playing context or "playlist", check owner of it, and see if the owner is the same as me. If so, save the playlist ID of it to PLAYLIST_ID_1. If it's not the same as me or there's an error trying to get the "playlist" owner, don't set playlist 1 to anything, and notify me (the user).
+    # check currently playing context or "playlist", check owner of it, and see if the owner is the same as me. If so, save the playlist ID of it as playlist 1 (hotkey_actions.playlist_id_1, and PLAYLIST_ID_1 in the .ini). If it's not the same as me or there's an error trying to get the "playlist" owner, don't set playlist 1 to anything, and notify me (the user).
     info = sp.current_user_playing_track()
     try:
         playlist_ID = info['context']['external_urls']['spotify']
-        playlist_name = sp.playlist(playlist_ID, fields="name")['name']
+        playlist_name = metadata_cache.get_playlist_name(playlist_ID)
         try:
-            playlist_owner = sp.playlist(playlist_ID)['owner']['external_urls']['spotify']
-            current_user = sp.me()['external_urls']['spotify']
-            global PLAYLIST_ID_1
+            playlist_owner = metadata_cache.get_playlist(playlist_ID)['owner']['id']
+            current_user = metadata_cache.get_current_user()['id']
             if playlist_owner == current_user:
-                PLAYLIST_ID_1 = playlist_ID
+                hotkey_actions.playlist_id_1 = playlist_ID
                 print("~\n! SET playlist 1.")
                 print_playlist_1_info()
                 # write that to the ini for fast setting again on script reload!
                 # function signature reference:
                 # def set_option(SECTION_NAME, OPTION_NAME, OPTION_VALUE, DESCRIPTIVE_COMMENT = None):
-                set_option('USER_VARIABLES', 'PLAYLIST_ID_1', PLAYLIST_ID_1, 'Optional playlist for track/library moves/deletes:')
+                set_option('USER_VARIABLES', 'PLAYLIST_ID_1', playlist_ID, 'Optional playlist for track/library moves/deletes:')
             else:
                 print("~\nCurrent playlist not owned by current user. Can't assign to playlist 1.")
         except Exception as e:
@@ -533,152 +466,108 @@ def set_playlist_1():
         print("~\nCouldn't obtain track info from current context somehow, or other error?")
         print(e)
 
-def print_playlist_1_info():
-    global PLAYLIST_ID_1
-    if PLAYLIST_ID_1:
-        print("~\nPlaylist 1 ID:", PLAYLIST_ID_1)
-        try:
-            playlist_name = sp.playlist(PLAYLIST_ID_1, fields="name")['name']
-            print("  name:", playlist_name)
-        except Exception as e:
-            print("~\nCouldn't obtain playlist information from current context somehow, or other error?")
-            print(e)
-    else:
-        print("~\nno PLAYLIST_ID_1 is set.")
-
-# Append the currently playing track to playlist 1, if playlist 1 is defined, and only if the track is not already on it.
-def add_current_track_to_playlist_1():
-    global PLAYLIST_ID_1
-    if PLAYLIST_ID_1 == None:
-        print("Can't move anything to playlist 1: playlist 1 not defined.")
-        return False
-    else:
-        # get currently playing track:
-        info = sp.current_user_playing_track()
-        track_id_to_add = info['item']['external_urls']['spotify']
-        list_of_track_IDs = [track_id_to_add]
-        print_current_track_information()
-        # get info of target playlist to parse:
-        # prior, deprecated track retrieve method; seems I couldn't paginate with it though:
-        # items = sp.playlist(PLAYLIST_ID_1)['tracks']['items']
-        # last track of prev dev ref.: https://open.spotify.com/track/7tfZ04mgD2fNU2dQ1SrMzG
-        print("Retrieving all tracks in target playlist to determine whether track proposed to add is already in playlist . .")
-        result = sp.playlist_tracks(PLAYLIST_ID_1, fields=None, limit=100, offset=0, market=None)
-        items = result['items']
-        while True:
-            for item in items:
-                track_from_target_list = item['track']['external_urls']['spotify']
-                if track_from_target_list == track_id_to_add:
-                    print('track_from_target_list', track_from_target_list, " == track_id_to_add ", track_id_to_add)
-                    print("That's already in the target playlist! Not adding.")
-                    return False
-            if result['next']:
-                result = sp.next(result)
-                items = result['items']
-                # without this continue statement the program would go on to the code below to add the track, perhaps erroneously :)
-                continue
-            # if the check for whether it's already in the list never returned False, we're good to add the track, and this code will do so:
-            # this function call adds to the end of a playlist by default, and we're doing that:
-            sp.playlist_add_items(PLAYLIST_ID_1, list_of_track_IDs)
-            print("ADDED track to playlist ID", PLAYLIST_ID_1)
-            print_playlist_1_info()
-            return True
-
-# function: remove the current song from the current playlist
-def remove_current_track_from_current_playlist():
+# Swap track everywhere: mark the currently playing track as the one to swap out, then play the track to swap in (for example another recording of the same work) and swap: the marked track is replaced with it, at the same positions, in every playlist the user owns (see track_swap.py).
+TRACK_TO_SWAP_OUT = None
+def mark_track_to_swap_out():
+    global TRACK_TO_SWAP_OUT
     info = sp.current_user_playing_track()
     try:
-        playlist_ID = info['context']['external_urls']['spotify']
-        track_ID = info['item']['external_urls']['spotify']
-        list_of_track_IDs = [track_ID]
-        print("~\nIn a playlist context; will remove currently playing track from the current playlist.")
-                # , and play the next song in the playlist
-        print("Current playlist ID:", playlist_ID)
-        print("track ID:", track_ID)
-        sp.playlist_remove_all_occurrences_of_items(playlist_ID, list_of_track_IDs)
-        # I've gone back and forth on wanting the following; now I don't :p
-        # sp.next_track()
+        TRACK_TO_SWAP_OUT = info['item']['external_urls']['spotify']
+        print_current_track_information(info)
+        user_id = metadata_cache.get_current_user()['id']
+        occurrences = library_database.get_track_occurrences(TRACK_TO_SWAP_OUT, user_id)
+        print("~\nMarked currently playing track to swap out; it's in", len(occurrences), "of your playlists (as of the last library sync). Play the track to swap in, and press the swap track everywhere hotkey.")
     except Exception as e:
-        print("~\nRemove current track from current playlist: cannot; no playlist context.")
+        print("~\nCould not mark currently playing track to swap out.")
         print(e)
 
-def shuffle_current_track_to_playlist_1():
+def swap_marked_track_everywhere():
+    global TRACK_TO_SWAP_OUT
+    if TRACK_TO_SWAP_OUT == None:
+        print("~\nNo track marked to swap out; mark one first.")
+        return
+    import track_swap
+    info = sp.current_user_playing_track()
     try:
-        proceed = add_current_track_to_playlist_1()
-        if proceed:
-            remove_current_track_from_current_playlist()
-        else:
-            print("~\nConditions said don't add to playlist 1; didn't move anything.")
+        print_current_track_information(info)
+        track_to_swap_in = info['item']['external_urls']['spotify']
+        user_id = metadata_cache.get_current_user()['id']
+        summary = track_swap.swap_track_everywhere(sp, library_database, TRACK_TO_SWAP_OUT, track_to_swap_in, user_id, UNSAVE_SWAPPED_OUT_TRACK, saved_tracks_cache)
+        if summary and not summary['failed_playlists']:
+            TRACK_TO_SWAP_OUT = None
     except Exception as e:
-        print("~\nFailure shuffling current track to playlist 1 from current list.")
+        print("~\nCould not swap marked track everywhere. Printing the error response:")
         print(e)
 
-# Function: if in a playlist context, add currently playing track to discards playlist, remove it from currently playing playlist and user library (liked songs), and play the next song in the playlist.
-def unsave_and_move_from_current_playlist_to_discards():
+# Function: append every track of the currently playing playlist that's also in Liked Songs (and not already in the target) to LIKED_TRACKS_TARGET_PLAYLIST_ID, or else playlist 1; shuffled first if SHUFFLE_LIKED_TRACKS (see liked_tracks_filter.py).
+def append_liked_tracks_of_current_playlist():
+    target_playlist_ID = LIKED_TRACKS_TARGET_PLAYLIST_ID or hotkey_actions.playlist_id_1
+    if target_playlist_ID == None:
+        print("~\nCan't append liked tracks: neither playlist 1 nor LIKED_TRACKS_TARGET_PLAYLIST_ID defined.")
+        return
+    import liked_tracks_filter
     info = sp.current_user_playing_track()
     try:
         playlist_ID = info['context']['external_urls']['spotify']
-        print("~\nDiscards playlist ID:", DISCARDS_PLAYLIST_ID)
-        print("Current playlist ID:", playlist_ID)
-        print_current_track_information()
-        track_ID = info['item']['external_urls']['spotify']
-        list_of_track_IDs = [track_ID]
-        sp.playlist_add_items(DISCARDS_PLAYLIST_ID, list_of_track_IDs)
-        sp.current_user_saved_tracks_delete(list_of_track_IDs)
-        sp.playlist_remove_all_occurrences_of_items(playlist_ID, list_of_track_IDs)
-        print("Added current track to discards playlist, removed it from current playlist and from liked songs, and will play the next song in the playlist.")
-        print("Attempted confirm:")
-        update_info_window(CLI_print = True)
-        sp.next_track()
+        print("~\nAppending liked tracks of playlist", metadata_cache.get_playlist_name(playlist_ID), "to playlist", metadata_cache.get_playlist_name(target_playlist_ID), ". .")
+        liked_tracks_filter.append_liked_tracks(sp, library_database, saved_tracks_cache, playlist_ID, target_playlist_ID, SHUFFLE_LIKED_TRACKS)
     except Exception as e:
-        print("~\nUnsave and shuffle current track to discard playlist: no playlist context; cannot remove currently playing track from any playlist. Printing the error response:")
+        print("~\nCould not append liked tracks of current playlist (no playlist context?). Printing the error response:")
         print(e)
 
-keepalive_playback_paused_poll_count = 0
-continue_keepalive_poll = True
-# function: if the player is paused, seek 25 ms ahead, sleep for a fraction of a second, then seek back to where it was. attempt to keep the client engaged with the API if playback is paused, which seems to cause at least the API client to forget the player. 
-def keepalive_poll():
-    global keepalive_playback_paused_poll_count
-    global continue_keepalive_poll
-
-    # OPTIONAL: uncomment the remainder of the next four lines to turn this script into a keepalive tool, by using a hotkey (key combination) that does nothing. If you uncomment these lines, nthis will always be run when this function is called:
-    #if 'pyautogui' not in globals():
-    #   import pyautogui
-    #pyautogui.FAILSAFE = False
-    #pyautogui.hotkey('altleft', 'shift', "`")        # a keypress instead would look like: pyautogui.typewrite(['fn', '\r']). DEPRECATED: combo with pageup which led to some applications seeing or using that keystroke as if by itself.
-    #print("pressed keepalive key combo.")
-
-    # NOTE: because this will never execute if that's false, the following boolean must be set True somewhere else!
-    if continue_keepalive_poll:
-        try:
-            info = sp.current_playback()
-            # OPTIONAL info write to txt file; comment out for production:
-            # f = open("debug.txt", "a")        # alternately use this to append instead of overwrite
-            # f = open("debug.txt", "w", encoding='utf_8')
-            # f.write("\n------------------------------------\n")
-            # f.write(json.dumps(info, indent=4))
-            # f.close()
-            # print("------Wrote info from current_playback() call to debug.txt.")
-            if info['is_playing'] == False or info['is_playing'] == None:
-                keepalive_playback_paused_poll_count += 1
-                # debug print only; comment out in production:
-                # print("Playback may be paused; keepalive_playback_paused_poll_count is", keepalive_playback_paused_poll_count)
-                # if we've queried this 4 times and it's paused, stop spamming the API; exit the script.
-                if keepalive_playback_paused_poll_count == 6:
-                    continue_keepalive_poll = False
-                    print("Playback found to be paused through 6 checks; suspending keepalive attempts until you manually resume playback with a hotkey from this script _or_ restart the script.")
-                    # print("Playback found to be paused through 6 checks; quitting script to avoid API queries. Exit code 1.")
-                    # os._exit(1)
-            else:
-                # reset paused playback counter:
-                keepalive_playback_paused_poll_count = 0
-                # debug print only; comment out in production:
-                # print("Playback may be active; keepalive_playback_paused_poll_count is", keepalive_playback_paused_poll_count)
-            # That's it. I'm just hoping that querying playback status keeps this API client authenticated / active as far as the API host is concerned.
-            # print("~\nRan keepalive_poll.")
-        except Exception as e:
-            print("~\nError running function to attempt to retrieve playback info. If you have an active player, maybe play and pause the player manually, then retry control from this script. OR There was some other error. Printing the error response:")
-            print(e)
+# make a new playlist from Liked Songs whose tracks follow the curves of audio features in CURVE_PLAYLIST_SPEC (for example rising valence and tempo), CURVE_PLAYLIST_LENGTH tracks long (see curve_playlist.py).
+AUDIO_FEATURES_STORE = None
+def make_curve_playlist():
+    global AUDIO_FEATURES_STORE
+    try:
+        import curve_playlist
+        from audio_features import AudioFeaturesStore
+        if AUDIO_FEATURES_STORE == None:
+            AUDIO_FEATURES_STORE = AudioFeaturesStore(sp)
+        targets = curve_playlist.parse_curve_spec(CURVE_PLAYLIST_SPEC)
+        candidate_track_ids = saved_tracks_cache.get_track_ids()
+        if candidate_track_ids == None:
+            print("~\nLiked Songs aren't cached yet; try again in a moment.")
+            return
+        print("~\nBuilding curve playlist (" + CURVE_PLAYLIST_SPEC + ") from", len(candidate_track_ids), "Liked Songs . .")
+        track_ids, summary = curve_playlist.build_curve_playlist(AUDIO_FEATURES_STORE, sorted(candidate_track_ids), targets, CURVE_PLAYLIST_LENGTH)
+        print(summary)
+        if not track_ids:
+            print("No audio features found for Liked Songs; no playlist made.")
+            return
+        user_id = metadata_cache.get_current_user()['id']
+        playlist_url = curve_playlist.write_playlist(sp, user_id, 'Curve ~ ' + CURVE_PLAYLIST_SPEC, track_ids, 'Liked Songs following: ' + CURVE_PLAYLIST_SPEC + ', courtesy ' + THIS_SCRIPT_FRIENDLY_NAME)
+        print("Made curve playlist of", len(track_ids), "tracks:", playlist_url)
+    except Exception as e:
+        print("~\nCould not make curve playlist. Printing the error response:")
+        print(e)
+
+# Function: print API call statistics (count, latency percentiles, bytes, retries and errors per hotkey function / background task and endpoint) and hotkey latencies, and append the API call statistics to a JSONL file.
+API_STATISTICS_FILE = 'Ansible_for_Spotify_api_stats.jsonl'
+def print_api_statistics():
+    sp.print_statistics()
+    print("~\nRequest scheduler:", request_scheduler.get_status())
+    action_dispatcher.print_latency_summary()
+    if TOKEN_MANAGER:
+        TOKEN_MANAGER.print_metrics()
+    if cassette_player:
+        cassette_player.print_summary()
+    try:
+        sp.dump_jsonl(API_STATISTICS_FILE)
+        print("~\nAppended API call statistics to", API_STATISTICS_FILE)
+    except Exception as e:
+        print("~\nCould not write API call statistics to", API_STATISTICS_FILE)
+        print(e)
+
+# Function: sync the local library database (only playlists whose snapshot_id changed are re-downloaded). Run in a thread at startup, as the first sync of a big library can take a while.
+def sync_library_database():
+    try:
+        print("~\nSyncing local library database . .")
+        summary = library_database.sync()
+        print("~\nSynced local library database:", summary)
+    except Exception as e:
+        print("~\nError syncing local library database; library lookups will fall back to the API.")
+        print(e)
 
 # START BOOKMARK FUNCTIONS REGION
 # NOTE THAT LOAD AND SAVE BOOKMARK HOTKEYS are hard-coded in one of these functions (see below).
@@ -708,21 +597,18 @@ def save_bookmark(bookmark_key):
         playlist_name = "None"
         if playlist_id and "playlist" in playlist_id:
             try:
-                playlist_info = sp.playlist(playlist_id.split(":")[-1], fields="name")
+                playlist_info = metadata_cache.get_playlist(playlist_id)
                 playlist_name = playlist_info.get('name', 'Unknown Playlist')
             except:
                 pass
 
-        # Ensure the bookmark section exists and overwrite the values
-        if not config.has_section(bookmark_name):
-            config.add_section(bookmark_name)
-
-        # Overwrite the existing bookmark
-        set_option(bookmark_name, 'playlist_id', playlist_id or 'None')
-        set_option(bookmark_name, 'playlist_name', playlist_name)
-        set_option(bookmark_name, 'track_id', track_id)
-        set_option(bookmark_name, 'position_ms', str(position_ms))
-        set_option(bookmark_name, 'key', bookmark_key)
+        # Overwrite the existing bookmark (or create it); one write of the .ini, done off this thread:
+        with config_store.transaction():
+            set_option(bookmark_name, 'playlist_id', playlist_id or 'None')
+            set_option(bookmark_name, 'playlist_name', playlist_name)
+            set_option(bookmark_name, 'track_id', track_id)
+            set_option(bookmark_name, 'position_ms', str(position_ms))
+            set_option(bookmark_name, 'key', bookmark_key)
 
         # Re-read the configuration file to ensure changes are applied?
         # config.read('Ansible_for_Spotify.ini', encoding='UTF-8')
@@ -774,8 +660,8 @@ def register_bookmark_hotkeys_from_ini():
                 save_sequence = f"control + alt + shift + b, {bookmark_key}"
                 load_sequence = f"control + alt + shift + l, {bookmark_key}"
 # binding structure: ["hotkey", on_press_callback, on_release_callback, actuate_on_partial_release, press_callback_params, release_callback_params]
-                dynamic_bindings.append([save_sequence, None, save_bookmark, True, None, bookmark_key])
-                dynamic_bindings.append([load_sequence, None, load_bookmark, True, None, bookmark_key])
+                dynamic_bindings.append([save_sequence, None, attributed(save_bookmark), True, None, bookmark_key])
+                dynamic_bindings.append([load_sequence, None, attributed(load_bookmark), True, None, bookmark_key])
                 # print(f"Registered hotkeys: '{save_sequence}' (save) and '{load_sequence}' (load) for bookmark '{section}'")
     
     # Register the hotkeys
@@ -815,24 +701,31 @@ def register_bookmark_hotkeys_from_ini():
 # NOTE: although the documentation for that function says the release callback parameter should be a dict, I could not get that to work and it accepted just a value for it. ?
 bindings = [
     # basic:
-    ["control + alt + shift + r", None, change_repeat_mode, True, None, None],
-    ["control + alt + shift + f", None, toggle_playback_shuffle, False, None, None],
-    ["control + alt + shift + home", None, pause_or_start_playback, True, None, None],
-    ["control + alt + shift + insert", None, seek_to_track_start, True, None, None],
-    ["control + alt + shift + left", None, relative_seek, True, None, BACK_SEEK_MS],
-    ["control + alt + shift + right", None, relative_seek, True, None, FORWARD_SEEK_MS],
-    ["control + alt + shift + page_up", None, previous_track, True, None, None],
-    ["control + alt + shift + page_down", None, next_track, True, None, None],
-    ["control + alt + shift + s", None, save_track, True, None, None],
-    ["control + alt + shift + u", None, unsave_track, True, None, None],
+    # (basic hotkeys run on the hotkey action dispatcher; see dispatched() :)
+    ["control + alt + shift + r", None, dispatched(change_repeat_mode, coalesce = True), True, None, None],
+    ["control + alt + shift + f", None, dispatched(toggle_playback_shuffle, coalesce = True), False, None, None],
+    ["control + alt + shift + home", None, dispatched(pause_or_start_playback), True, None, None],
+    ["control + alt + shift + insert", None, dispatched(seek_to_track_start), True, None, None],
+    ["control + alt + shift + left", None, dispatched(relative_seek, coalesce = True), True, None, BACK_SEEK_MS],
+    ["control + alt + shift + right", None, dispatched(relative_seek, coalesce = True), True, None, FORWARD_SEEK_MS],
+    ["control + alt + shift + page_up", None, dispatched(previous_track, coalesce = True), True, None, None],
+    ["control + alt + shift + page_down", None, dispatched(next_track, coalesce = True), True, None, None],
+    ["control + alt + shift + s", None, dispatched(save_track), True, None, None],
+    ["control + alt + shift + u", None, dispatched(unsave_track), True, None, None],
     # advanced:
-    ["control + alt + shift + d", None, remove_current_track_from_current_playlist, False, None, None],
-    ["control + alt + shift + x", None, unsave_and_move_from_current_playlist_to_discards, False, None, None],
-    ["control + alt + shift + 1", None, set_playlist_1, False, None, None],
-    ["control + alt + shift + a", None, add_current_track_to_playlist_1, True, None, None],
-    ["control + alt + shift + m", None, shuffle_current_track_to_playlist_1, False, None, None],
-    ["control + alt + shift + c", None, make_discography_playlist, False, None, None],
-    ["control + alt + shift + i", None, print_information, True, None, None],
+    ["control + alt + shift + d", None, attributed(remove_current_track_from_current_playlist), False, None, None],
+    ["control + alt + shift + x", None, attributed(unsave_and_move_from_current_playlist_to_discards), False, None, None],
+    ["control + alt + shift + 1", None, attributed(set_playlist_1), False, None, None],
+    ["control + alt + shift + a", None, attributed(add_current_track_to_playlist_1), True, None, None],
+    ["control + alt + shift + m", None, attributed(shuffle_current_track_to_playlist_1), False, None, None],
+    ["control + alt + shift + c", None, attributed(make_discography_playlist), False, None, None],
+    ["control + alt + shift + n", None, attributed(refresh_discography_playlist), False, None, None],
+    ["control + alt + shift + v", None, attributed(make_curve_playlist), False, None, None],
+    ["control + alt + shift + k", None, attributed(append_liked_tracks_of_current_playlist), False, None, None],
+    ["control + alt + shift + o", None, attributed(mark_track_to_swap_out), False, None, None],
+    ["control + alt + shift + w", None, attributed(swap_marked_track_everywhere), False, None, None],
+    ["control + alt + shift + i", None, attributed(print_information), True, None, None],
+    ["control + alt + shift + p", None, print_api_statistics, True, None, None],
     ["control + alt + shift + q", None, exit_program, True, None, None],
 ]
 
@@ -843,65 +736,49 @@ register_hotkeys(bindings)
 register_bookmark_hotkeys_from_ini()
 
 # Finally, start listening for keypresses
+action_dispatcher.start()
 start_checking_hotkeys()
+STARTUP_TIMES['hotkeys_ready_ms'] = round((time.perf_counter() - STARTUP_START_TIME) * 1000, 1)
 
-# START: THINGS BETWEEN THIS AND THE END OF THIS COMMENT WILL RUN INDEFINITELY
-# re: https://stackoverflow.com/a/2223182
-# THIS IS AN ATTEMPT TO MAINTAIN API CLIENT AWARENESS OF THE MUSIC PLAYER.
-timer_interval = 82
-
-import threading
-def f(f_stop):
-    keepalive_poll()
-    update_info_window()
-    if not f_stop.is_set():
-        # call f() again in timer_interval seconds
-        threading.Timer(timer_interval, f, [f_stop]).start()
-f_stop = threading.Event()
-# start calling f now and every timer_interval seconds thereafter
-f(f_stop)
-# END: THINGS BETWEEN THIS AND THE END OF THIS COMMENT WILL RUN INDEFINITELY
-
-# START: OTHER THINGS BETWEEN THIS AND THE END OF THIS COMMENT WILL RUN INDEFINITELY
-# re https://stackoverflow.com/a/2223191 - another answer with the above linked, which seems like a far simpler way to implement a repeated threaded task? And maybe would obviate other code my above timer calls needing threading?
-# TO DO: ^ EXAMINE THAT and re-implement it if it is simpler
-# POLL the current playing track ID every N seconds (wait_between_checks), and update the info window glyph if it has changed, to keep display of whether the current playing track is in the user saved tracks (Liked Songs) pretty current:
-last_remembered_track_ID = ''
-wait_between_checks = 6.5
-class BackgroundTimer(Thread):
-    def run(self):
-        global last_remembered_track_ID
-        global continue_keepalive_poll
-        while 1:
-            time.sleep(wait_between_checks)
-            # only do things if a booloean modified in keepalive_poll() is true; this will avoid pointlessly spamming the API for track info if there's little reason to believe it's updated:
-            # avoids runtime error of info being undeclared:
-            info = None
-            if continue_keepalive_poll:
-                try:
-                    info = sp.current_user_playing_track()
-                except Exception as e:
-                    print("In repeat timer query of playing track check, controlled by boolean continue_keepalive_poll, error running function to attempt to retrieve playing track info. If you have an active player, maybe play and pause the player manually, then retry control from this script. OR There was some other error. Printing the error response:")
-                    print(e)
-                if info != None:
-                    current_track_ID = info['item']['id']
-                    if last_remembered_track_ID != current_track_ID:
-                        print("Active playback polling: DIFFERENT track ID ", current_track_ID, " than last seen " + last_remembered_track_ID + " -- will try to update user saved tracks (Liked Songs) track info_window.")
-                        update_info_window(CLI_print = True)
-                        last_remembered_track_ID = current_track_ID
-                        # reset this that another loop uses :/ complicated
-                        global keepalive_playback_paused_poll_count
-                        keepalive_playback_paused_poll_count = 0
-            # optional; probably was more useful in development:
-            # else:
-            #     print("Monitoring of playing track info suspended because of paused or unknown playback state over time; to resume track monitoring, unpause playback with the hotkey of this script.")
-timer = BackgroundTimer()
-timer.start()
-# END: OTHER THINGS BETWEEN THIS AND THE END OF THIS COMMENT WILL RUN INDEFINITELY
+# Function: create the API client (and get an access token), then start everything that uses the API in the background. Run on a thread at startup, so that hotkeys and the info window don't wait on it (a hotkey pressed before it's done waits for the client to be created).
+warm_up_done = threading.Event()
+def warm_up():
+    try:
+        sp.get_client()
+        if TOKEN_MANAGER:
+            TOKEN_MANAGER.get_access_token()
+        STARTUP_TIMES['client_ready_ms'] = round((time.perf_counter() - STARTUP_START_TIME) * 1000, 1)
+    except Exception as e:
+        print("~\nError creating authorized API client or getting an access token at startup; will retry on next hotkey (and the access token in the background). Printing the error response:")
+        print(e)
+    threading.Thread(target=sync_library_database, name='sync_library_database', daemon=True).start()
+    saved_tracks_cache.start_background_reconciliation()
+    playlist_membership.start_background_refresh(lambda: metadata_cache.get_current_user()['id'])
+    # START: THINGS BETWEEN THIS AND THE END OF THIS COMMENT WILL RUN INDEFINITELY
+    # Poll playback state in the background (every few seconds, or slower if playback has been paused for a while), which keeps the info window current and is also an attempt to maintain API client awareness of the music player:
+    playback_state_service.start()
+    # END: THINGS BETWEEN THIS AND THE END OF THIS COMMENT WILL RUN INDEFINITELY
+    warm_up_done.set()
+
+playback_state_service.subscribe(draw_info_window)
+threading.Thread(target=warm_up, name='warm_up', daemon=True).start()
 
 import current_track_in_user_tracks_display
 # info_window is a global used all over the place!
 info_window = current_track_in_user_tracks_display.GlyphWindow()
+info_window.root.update_idletasks()
+STARTUP_TIMES['window_ready_ms'] = round((time.perf_counter() - STARTUP_START_TIME) * 1000, 1)
+print("~\nStartup: hotkeys ready in", STARTUP_TIMES['hotkeys_ready_ms'], "ms, info window ready in", STARTUP_TIMES['window_ready_ms'], "ms.")
+
+# If run by benchmark_startup.py, report startup times and exit (after warm up too, if that's asked for) :
+STARTUP_BENCHMARK = os.environ.get('ANSIBLE_FOR_SPOTIFY_STARTUP_BENCHMARK')
+if STARTUP_BENCHMARK:
+    if STARTUP_BENCHMARK == 'warm':
+        warm_up_done.wait(120)
+    import json
+    print('STARTUP_BENCHMARK ' + json.dumps(STARTUP_TIMES), flush = True)
+    os._exit(0)
+
 # info_window.update_glyph("_")
 update_info_window()
 info_window.run()
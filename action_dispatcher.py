@@ -0,0 +1,96 @@
+# DESCRIPTION
+# A queue of hotkey actions with one dedicated worker thread that runs them in order, so hotkey callbacks return immediately instead of doing API round trips on whatever thread the hotkey library calls them from. Bursts of repeated presses of the same hotkey are coalesced: presses that queue up while an earlier action is running are combined into one call with their values summed, and if a press is already queued behind another of the same hotkey (a burst in progress), the worker waits coalesce_window seconds for the rest of the burst before taking them. A lone press runs at once, without waiting. For example five seek-forward presses become one seek to the summed offset, and three next track presses become one call that sends the three skips as one pipelined batch (see hotkey_actions.py) and refreshes the info window once.
+# The latency of every press (from press to the end of the call that served it) is recorded per action.
+
+# USAGE
+#    from action_dispatcher import ActionDispatcher
+#    action_dispatcher = ActionDispatcher()
+#    action_dispatcher.start()
+#    action_dispatcher.submit('relative_seek', relative_seek, 5000, coalesce=True)
+#    action_dispatcher.print_latency_summary()
+
+import collections
+import threading
+import time
+
+class ActionDispatcher:
+    def __init__(self, coalesce_window=0.05, latency_history_length=200):
+        self.coalesce_window = coalesce_window
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        # action name -> recent press latencies, in seconds:
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=latency_history_length))
+        self.press_counts = collections.Counter()
+        self.call_counts = collections.Counter()
+
+    # Function: queue function to be called (with value, unless value is None) by the worker. If coalesce is True, consecutive queued presses of the same action are combined into one call with the sum of their values.
+    def submit(self, action_name, function, value=None, coalesce=False):
+        with self.condition:
+            self.queue.append((action_name, function, value, coalesce, time.time()))
+            self.condition.notify()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name='action_dispatcher', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                # (only wait for more of a burst that's already under way:)
+                is_burst = self.queue[0][3] and len(self.queue) > 1 and self.queue[1][0] == self.queue[0][0]
+            if is_burst and self.coalesce_window:
+                time.sleep(self.coalesce_window)
+            action_name, function, value, press_times = self.take_next_action()
+            try:
+                if value is None:
+                    function()
+                else:
+                    function(value)
+            except Exception as e:
+                print("~\nError running hotkey action", action_name)
+                print(e)
+            self.record_latencies(action_name, press_times)
+
+    # Function: take the next queued action off the queue, along with any consecutive presses of the same action it can be combined with. Returns the action name, function, (summed) value and the press times of every press it serves.
+    def take_next_action(self):
+        with self.condition:
+            action_name, function, value, coalesce, press_time = self.queue.popleft()
+            press_times = [press_time]
+            while coalesce and self.queue and self.queue[0][0] == action_name:
+                next_press = self.queue.popleft()
+                value += next_press[2]
+                press_times.append(next_press[4])
+            return action_name, function, value, press_times
+
+    def record_latencies(self, action_name, press_times):
+        end_time = time.time()
+        self.press_counts[action_name] += len(press_times)
+        self.call_counts[action_name] += 1
+        for press_time in press_times:
+            self.latencies[action_name].append(end_time - press_time)
+
+    # Function: return a dictionary of action name -> press count, call count, and median / 90th percentile / max latency (in ms) of recent presses.
+    def get_latency_summary(self):
+        summary = {}
+        for action_name, latencies in list(self.latencies.items()):
+            sorted_latencies = sorted(latencies)
+            summary[action_name] = {
+                'presses': self.press_counts[action_name],
+                'calls': self.call_counts[action_name],
+                'median_ms': round(sorted_latencies[len(sorted_latencies) // 2] * 1000),
+                'p90_ms': round(sorted_latencies[int(len(sorted_latencies) * 0.9)] * 1000),
+                'max_ms': round(sorted_latencies[-1] * 1000),
+            }
+        return summary
+
+    def print_latency_summary(self):
+        summary = self.get_latency_summary()
+        if not summary:
+            print("~\nNo hotkey actions recorded yet.")
+            return
+        print("~\nHotkey action latencies (presses, calls, median / p90 / max ms):")
+        for action_name, stats in sorted(summary.items()):
+            print("  ", action_name, stats['presses'], stats['calls'], str(stats['median_ms']) + " / " + str(stats['p90_ms']) + " / " + str(stats['max_ms']))
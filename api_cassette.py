@@ -0,0 +1,269 @@
+# DESCRIPTION
+# Records the Web API traffic of a spotipy client (every request made through its requests session, pagination via sp.next included) to a compact cassette file, and replays cassettes to a client deterministically, with no network: each request is answered with the response recorded for the same method, path, query and body (in recorded order, when the same request was made more than once, as polling does), after the recorded response time divided by speed (speed 0 answers at once).
+# So a real session (playback polling, discography crawls, bulk playlist operations) can be captured once, then profiled offline against realistic data shapes, and two runs (recordings, or replays that are recorded too) can be compared: summary and diff report request counts, response times, bytes and wall time per endpoint, and diff exits nonzero if request count or wall time regressed beyond a tolerance.
+# Cassettes are gzipped JSON lines: a header line, then one line per request (start time since the recording started, response time, thread name, method, URL, request body, status, Retry-After / Content-Type headers, and response body). No request headers are recorded, so no access token ends up in a cassette, and token refreshes (made by the auth manager's own session) aren't recorded.
+# Recording and replay work by wrapping the transport adapters mounted on the client's requests session, so the client's own retry settings stay in place.
+
+# USAGE
+#    from api_cassette import CassetteRecorder, CassettePlayer
+#    recorder = CassetteRecorder('session.jsonl.gz').install(sp_client)
+#    ...
+#    recorder.close()
+# -- replay (at twice the recorded speed), recording the replayed run too for a diff:
+#    player = CassettePlayer('session.jsonl.gz', speed=2).install(sp_client)
+#    recorder = CassetteRecorder('replay.jsonl.gz').install(sp_client)
+# -- compare runs:
+#    python api_cassette.py summary session.jsonl.gz
+#    python api_cassette.py diff session.jsonl.gz replay.jsonl.gz --tolerance 0.1
+# Ansible_for_Spotify.py records when the environment variable ANSIBLE_FOR_SPOTIFY_RECORD_CASSETTE is set to a cassette path, and replays (with no authorization) when ANSIBLE_FOR_SPOTIFY_REPLAY_CASSETTE is (at ANSIBLE_FOR_SPOTIFY_REPLAY_SPEED, default 1).
+
+import argparse
+import collections
+import datetime
+import gzip
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlparse, parse_qsl, urlencode
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from instrumented_spotify import get_endpoint_path
+
+CASSETTE_FORMAT = 'ansible_for_spotify_api_cassette'
+CASSETTE_VERSION = 1
+RECORDED_HEADERS = ('Retry-After', 'Content-Type')
+
+# Function: return the key a request is matched on in replay: method, path and query (query parameters sorted, as their order varies), and body. The host isn't part of it, so a cassette recorded against one server (for example the fake API, on a random port) replays to another.
+def get_request_key(method, url, body):
+    url = urlparse(url)
+    query = urlencode(sorted(parse_qsl(url.query, keep_blank_values=True)))
+    return (method, url.path + ('?' + query if query else ''), body or None)
+
+def get_body_text(body):
+    if isinstance(body, bytes):
+        return body.decode('UTF-8', errors='replace')
+    return body
+
+# Function: read a cassette; returns (header, list of entries). A cassette whose recording didn't end cleanly (for example the script was killed) is read up to its last complete entry.
+def read_cassette(path):
+    lines = []
+    with gzip.open(path, 'rt', encoding='UTF-8') as cassette_file:
+        try:
+            for line in cassette_file:
+                lines.append(line)
+        except EOFError:
+            pass
+    entries = []
+    for line in lines:
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # a partly written last line
+            break
+    if not entries or entries[0].get('format') != CASSETTE_FORMAT:
+        raise ValueError(path + ' is not an API cassette')
+    return entries[0], entries[1:]
+
+class CassetteRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.entry_count = 0
+        self.cassette_file = gzip.open(path, 'wt', encoding='UTF-8')
+        self.write_line({'format': CASSETTE_FORMAT, 'version': CASSETTE_VERSION, 'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+
+    # Function: wrap every transport adapter of a spotipy client's session (client._session) so its traffic is recorded. Returns self.
+    def install(self, client):
+        session = client._session
+        for prefix, adapter in list(session.adapters.items()):
+            session.mount(prefix, RecordingAdapter(adapter, self))
+        return self
+
+    def record(self, request, response, start_time, elapsed):
+        entry = {
+            't': round(start_time - self.start_time, 4),
+            'elapsed': round(elapsed, 4),
+            'thread': threading.current_thread().name,
+            'method': request.method,
+            'url': request.url,
+            'body': get_body_text(request.body),
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            'response': response.content.decode('UTF-8', errors='replace') if response.content else None,
+        }
+        with self.lock:
+            self.entry_count += 1
+            self.write_line(entry)
+
+    def write_line(self, entry):
+        self.cassette_file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        # flush (a zlib sync flush) after every entry, so the cassette is readable up to here even if the script exits without closing it:
+        self.cassette_file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.cassette_file.closed:
+                self.cassette_file.close()
+
+class RecordingAdapter(BaseAdapter):
+    def __init__(self, adapter, recorder):
+        super().__init__()
+        self.adapter = adapter
+        self.recorder = recorder
+
+    def send(self, request, **kwargs):
+        start_time = time.perf_counter()
+        response = self.adapter.send(request, **kwargs)
+        # read the body now (the session would anyway, for a non-streamed request), so its time counts:
+        response.content
+        self.recorder.record(request, response, start_time, time.perf_counter() - start_time)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+    # things that look for the wrapped adapter's settings (such as max_retries) find them:
+    def __getattr__(self, name):
+        return getattr(self.adapter, name)
+
+class CassettePlayer:
+    def __init__(self, path, speed=1.0):
+        self.path = path
+        self.speed = speed
+        self.header, entries = read_cassette(path)
+        self.lock = threading.Lock()
+        # request key -> recorded entries for it, in recorded order:
+        self.responses = collections.defaultdict(collections.deque)
+        for entry in entries:
+            self.responses[get_request_key(entry['method'], entry['url'], entry['body'])].append(entry)
+        self.last_responses = {}
+        self.replayed_count = 0
+        self.repeated_count = 0
+        self.missing_requests = collections.Counter()
+
+    # Function: replace every transport adapter of a spotipy client's session with one answering from the cassette. Returns self.
+    def install(self, client):
+        session = client._session
+        for prefix in list(session.adapters):
+            session.mount(prefix, ReplayAdapter(self))
+        return self
+
+    # Function: return the recorded entry for a request: the next one recorded for it, or (once those run out, as when polling longer than the recording did) the last one again, or None if it was never recorded.
+    def take_entry(self, request):
+        key = get_request_key(request.method, request.url, get_body_text(request.body))
+        with self.lock:
+            if self.responses.get(key):
+                entry = self.responses[key].popleft()
+                self.last_responses[key] = entry
+                self.replayed_count += 1
+                return entry
+            entry = self.last_responses.get(key)
+            if entry is None:
+                self.missing_requests[key[0] + ' ' + get_endpoint_path(request.url)] += 1
+            else:
+                self.repeated_count += 1
+            return entry
+
+    def print_summary(self):
+        print("~\nCassette replay of", self.path + ":", self.replayed_count, "recorded responses replayed,", self.repeated_count, "repeated (requests made more often than recorded),", sum(self.missing_requests.values()), "requests not in the cassette.")
+        for request, count in self.missing_requests.most_common():
+            print("   not in cassette:", request, count)
+
+class ReplayAdapter(BaseAdapter):
+    def __init__(self, player):
+        super().__init__()
+        self.player = player
+
+    def send(self, request, **kwargs):
+        entry = self.player.take_entry(request)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = 'utf-8'
+        if entry is None:
+            response.status_code = 404
+            response.reason = 'Not in cassette'
+            response.headers = CaseInsensitiveDict({'Content-Type': 'application/json'})
+            response._content = json.dumps({'error': {'status': 404, 'message': 'Request not in cassette ' + self.player.path}}).encode('UTF-8')
+            return response
+        if self.player.speed:
+            time.sleep(entry['elapsed'] / self.player.speed)
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = (entry['response'] or '').encode('UTF-8')
+        response.elapsed = datetime.timedelta(seconds=entry['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+# Function: summarize a cassette's entries: per endpoint (method and path with IDs as {id}) the request count, total response seconds and bytes, plus totals and the wall time from first request to last response.
+def summarize_cassette(path):
+    header, entries = read_cassette(path)
+    endpoints = collections.defaultdict(lambda: {'requests': 0, 'seconds': 0.0, 'bytes': 0, 'errors': 0})
+    for entry in entries:
+        endpoint = endpoints[entry['method'] + ' ' + get_endpoint_path(entry['url'])]
+        endpoint['requests'] += 1
+        endpoint['seconds'] += entry['elapsed']
+        endpoint['bytes'] += len(entry['response'] or '')
+        endpoint['errors'] += entry['status'] >= 400
+    wall_seconds = max((entry['t'] + entry['elapsed'] for entry in entries), default=0) - min((entry['t'] for entry in entries), default=0)
+    return {
+        'recorded_at': header.get('recorded_at'),
+        'requests': len(entries),
+        'seconds': round(sum(entry['elapsed'] for entry in entries), 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'bytes': sum(endpoint['bytes'] for endpoint in endpoints.values()),
+        'errors': sum(endpoint['errors'] for endpoint in endpoints.values()),
+        'endpoints': {name: dict(endpoint, seconds=round(endpoint['seconds'], 3)) for name, endpoint in endpoints.items()},
+    }
+
+def print_summary(path):
+    summary = summarize_cassette(path)
+    print("~\nCassette", path, "recorded", summary['recorded_at'] + ":", summary['requests'], "requests,", summary['seconds'], "s response time,", summary['wall_seconds'], "s wall time,", summary['bytes'], "bytes,", summary['errors'], "errors. By endpoint (requests, response s, bytes, errors):")
+    for name, endpoint in sorted(summary['endpoints'].items(), key=lambda item: -item[1]['seconds']):
+        print("  ", name + ":", endpoint['requests'], endpoint['seconds'], endpoint['bytes'], endpoint['errors'])
+
+# Function: print the differences between two cassettes per endpoint and in total; returns True if the second regressed: more requests, or wall time more than tolerance (a fraction) longer.
+def print_diff(base_path, new_path, tolerance=0.1):
+    base = summarize_cassette(base_path)
+    new = summarize_cassette(new_path)
+    print("~\nAPI traffic of", new_path, "compared to", base_path, "(requests, response s, bytes: base -> new):")
+    for name in sorted(set(base['endpoints']) | set(new['endpoints'])):
+        base_endpoint = base['endpoints'].get(name, {'requests': 0, 'seconds': 0, 'bytes': 0})
+        new_endpoint = new['endpoints'].get(name, {'requests': 0, 'seconds': 0, 'bytes': 0})
+        if base_endpoint['requests'] != new_endpoint['requests'] or abs(new_endpoint['seconds'] - base_endpoint['seconds']) > tolerance * max(base_endpoint['seconds'], 0.001):
+            print("  ", name + ":", base_endpoint['requests'], "->", new_endpoint['requests'], "requests,", base_endpoint['seconds'], "->", new_endpoint['seconds'], "s,", base_endpoint['bytes'], "->", new_endpoint['bytes'], "bytes")
+    print("   TOTAL:", base['requests'], "->", new['requests'], "requests,", base['wall_seconds'], "->", new['wall_seconds'], "s wall time,", base['bytes'], "->", new['bytes'], "bytes")
+    regressions = []
+    if new['requests'] > base['requests']:
+        regressions.append(str(new['requests'] - base['requests']) + " more requests")
+    if new['wall_seconds'] > base['wall_seconds'] * (1 + tolerance):
+        regressions.append("wall time " + str(round((new['wall_seconds'] / max(base['wall_seconds'], 0.001) - 1) * 100)) + "% longer")
+    if regressions:
+        print("~\nREGRESSION:", ", ".join(regressions))
+    else:
+        print("~\nNo regression in request count or wall time (tolerance " + str(round(tolerance * 100)) + "%).")
+    return bool(regressions)
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize or compare API cassettes.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary_parser = subparsers.add_parser('summary', help='summarize cassettes')
+    summary_parser.add_argument('cassettes', nargs='+')
+    diff_parser = subparsers.add_parser('diff', help='compare a cassette to a base cassette; exits 1 on regression')
+    diff_parser.add_argument('base_cassette')
+    diff_parser.add_argument('new_cassette')
+    diff_parser.add_argument('--tolerance', type=float, default=0.1, help='allowed fraction of wall time increase (default 0.1)')
+    arguments = parser.parse_args()
+    if arguments.command == 'summary':
+        for path in arguments.cassettes:
+            print_summary(path)
+        return 0
+    return 1 if print_diff(arguments.base_cassette, arguments.new_cassette, arguments.tolerance) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,37 @@
+# DESCRIPTION
+# Atomic file writes, for every module that persists state a crash mid-write mustn't corrupt (export / import progress, the .ini config, the token cache, the discography manifest): the data is written to a temporary file next to the file (created readable by the user only), flushed to disk, and then replaces the file, so the file is always either the old or the new version, never half written. If the write fails, the temporary file is removed and the old file is left as it was.
+
+# USAGE
+#    import atomic_file
+#    atomic_file.write_atomically('Ansible_for_Spotify.ini', text)
+#    atomic_file.write_json_atomically('my_library.ndjson.progress', progress)
+#    progress = atomic_file.read_json('my_library.ndjson.progress')    # None if there's no such file
+
+import json
+import os
+import tempfile
+
+# Function: write text to a file atomically (to a temporary file next to it, which then replaces it).
+def write_atomically(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(file_descriptor, 'w', encoding='UTF-8') as temporary_file:
+            temporary_file.write(data)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.replace(temporary_path, path)
+    except:
+        os.remove(temporary_path)
+        raise
+
+# Function: write data to a JSON file atomically (see write_atomically); cls is an optional JSON encoder class, as for json.dumps.
+def write_json_atomically(path, data, cls=None):
+    write_atomically(path, json.dumps(data, cls=cls))
+
+# Function: return the data of a JSON file, or None if there's no such file.
+def read_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='UTF-8') as json_file:
+        return json.load(json_file)
@@ -0,0 +1,87 @@
+# DESCRIPTION
+# A persistent store of tracks' audio features (danceability, energy, valence, tempo..; see the Web API's audio features endpoint), for building playlists that follow curves of them (see curve_playlist.py):
+# - features are fetched 100 tracks per request (the endpoint's maximum), the batches concurrently on a small thread pool
+# - every track's features (including "none available") are kept in a SQLite cache, so each track's are fetched once, ever; a pool of tens of thousands of tracks is read from the cache in well under a second
+# (The audio features endpoint is refused, with HTTP 403, to Spotify apps created after 27 November 2024.)
+
+# USAGE
+#    from audio_features import AudioFeaturesStore
+#    audio_features_store = AudioFeaturesStore(sp)
+#    features = audio_features_store.get_features(track_IDs)    # dictionary of track ID -> {'valence': 0.61, 'tempo': 121.9, ..}, for tracks that have features
+#    track_IDs_with_features, rows = audio_features_store.get_feature_rows(track_IDs, ['valence', 'tempo'])
+
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from library_database import get_spotify_id
+
+DEFAULT_CACHE_PATH = 'Ansible_for_Spotify_audio_features.db'
+# The audio features endpoint accepts at most this many track IDs per request:
+TRACKS_PER_REQUEST = 100
+FETCH_WORKERS = 4
+# The (numeric) features kept:
+FEATURE_NAMES = ['acousticness', 'danceability', 'energy', 'instrumentalness', 'liveness', 'loudness', 'speechiness', 'tempo', 'valence', 'key', 'mode', 'time_signature', 'duration_ms']
+# SQLite allows at most 999 parameters per statement:
+IDS_PER_QUERY = 900
+
+class AudioFeaturesStore:
+    def __init__(self, sp, cache_path=DEFAULT_CACHE_PATH, workers=FETCH_WORKERS):
+        self.sp = sp
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        with self.lock, self.connection:
+            # (has_features is 0 for tracks the API has no features for, so they aren't asked for again:)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS audio_features (track_id TEXT PRIMARY KEY, has_features INTEGER, ' + ', '.join(name + ' REAL' for name in FEATURE_NAMES) + ', fetched_at REAL)')
+        self.request_count = 0
+
+    # Function: return the cached rows of track IDs, as a dictionary of track ID -> tuple of FEATURE_NAMES values (None for tracks cached as having no features). Uncached tracks are left out.
+    def get_cached(self, track_ids):
+        cached = {}
+        with self.lock:
+            for idx in range(0, len(track_ids), IDS_PER_QUERY):
+                batch = track_ids[idx:idx + IDS_PER_QUERY]
+                for row in self.connection.execute('SELECT track_id, has_features, ' + ', '.join(FEATURE_NAMES) + ' FROM audio_features WHERE track_id IN (' + ', '.join('?' * len(batch)) + ')', batch):
+                    cached[row[0]] = row[2:] if row[1] else None
+        return cached
+
+    # Function: fetch the features of up to TRACKS_PER_REQUEST track IDs in one request, and cache them. Runs on the worker threads.
+    def fetch(self, track_ids):
+        results = self.sp.audio_features(track_ids)
+        fetched_at = time.time()
+        rows = []
+        for track_id, features in zip(track_ids, results):
+            if features:
+                rows.append((track_id, 1) + tuple(features.get(name) for name in FEATURE_NAMES) + (fetched_at,))
+            else:
+                rows.append((track_id, 0) + (None,) * len(FEATURE_NAMES) + (fetched_at,))
+        with self.lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO audio_features VALUES (' + ', '.join('?' * (len(FEATURE_NAMES) + 3)) + ')', rows)
+            self.request_count += 1
+
+    # Function: make sure every one of track IDs (IDs, URIs or URLs) is cached, fetching the uncached ones TRACKS_PER_REQUEST at a time on a thread pool. Returns the number of tracks fetched.
+    def fetch_missing(self, track_ids):
+        track_ids = list(dict.fromkeys(get_spotify_id(track_id) for track_id in track_ids))
+        cached = self.get_cached(track_ids)
+        missing_track_ids = [track_id for track_id in track_ids if track_id not in cached]
+        if missing_track_ids:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='audio_features') as executor:
+                # (list() to raise the first failed batch's error here:)
+                list(executor.map(self.fetch, [missing_track_ids[idx:idx + TRACKS_PER_REQUEST] for idx in range(0, len(missing_track_ids), TRACKS_PER_REQUEST)]))
+        return len(missing_track_ids)
+
+    # Function: return the features of track IDs (fetching any uncached), as a dictionary of track ID -> {feature name: value}, for tracks that have features.
+    def get_features(self, track_ids):
+        self.fetch_missing(track_ids)
+        cached = self.get_cached(list(dict.fromkeys(get_spotify_id(track_id) for track_id in track_ids)))
+        return {track_id: dict(zip(FEATURE_NAMES, row)) for track_id, row in cached.items() if row}
+
+    # Function: return the track IDs (of track_ids, fetching any uncached, in order, without repeats) that have features, and a list of a tuple of their values of feature_names each (for building arrays from).
+    def get_feature_rows(self, track_ids, feature_names):
+        self.fetch_missing(track_ids)
+        track_ids = list(dict.fromkeys(get_spotify_id(track_id) for track_id in track_ids))
+        cached = self.get_cached(track_ids)
+        indexes = [FEATURE_NAMES.index(name) for name in feature_names]
+        track_ids_with_features = [track_id for track_id in track_ids if cached.get(track_id)]
+        return track_ids_with_features, [tuple(cached[track_id][index] for index in indexes) for track_id in track_ids_with_features]
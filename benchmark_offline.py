@@ -0,0 +1,348 @@
+# DESCRIPTION
+# Benchmarks this repository's API-heavy code against the local fake Spotify Web API (see fake_spotify_api.py), so performance work can be measured without a Spotify account, and with repeatable latency, page sizes and rate limiting (HTTP 429s):
+# - hotkey latency: presses of playback / library hotkeys, run through the ActionDispatcher (press to done, as recorded for the real hotkeys), both idle and while a bulk library sync runs in the background
+# - discography throughput: collecting an artist's discography and writing it to a new playlist, as make_discography_playlist does, and refreshing it with new releases, as refresh_discography_playlist does
+# - add_current_track_to_playlist_1 on a 9,999 track playlist 1: the duplicate check by paging through the playlist from the API, and by the local library database (cold: first sync downloads the playlist; warm: only its snapshot_id is checked)
+# - track matching: matching a foreign list (rows of artist / title, some with ISRCs, some repeated, some not on the fake API) to tracks by search (see track_matching.py), with an empty match cache (cold) and again with the cache from the first run (warm)
+# - curve playlist: building a playlist from Liked Songs that follows curves of audio features (see curve_playlist.py), with an empty audio features cache (cold) and again with it filled (warm), and the curve-to-track assignment alone on a larger pool of random features (needs NumPy)
+# - liked tracks filter: appending the liked tracks of a 1,000 track playlist to a new playlist, by paging through the playlist and asking the API which are liked 50 at a time, and by the local library database and cached Liked Songs set (see liked_tracks_filter.py; cold: both downloaded first; warm: only snapshot_ids checked)
+# Every API call goes through InstrumentedSpotify and a RequestScheduler, as in Ansible_for_Spotify.py, and the hotkey benchmarks run that script's own hotkey functions (see hotkey_actions.py). The fake API runs in a child process (unless --in-process), so its request handling doesn't compete with the code measured for the GIL.
+
+# USAGE
+#    python benchmark_offline.py
+#    python benchmark_offline.py --latency 0.08 --max-page-size 50 --rate-limit-every 150 --json benchmark_results.json
+#    python benchmark_offline.py --only discography --verbose
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from action_dispatcher import ActionDispatcher
+from discography_manifest import DiscographyManifest
+from fake_spotify_api import FakeSpotifyAPIProcess, FakeSpotifyAPIServer, FakeSpotifyLibrary
+from hotkey_actions import HotkeyActions
+from instrumented_spotify import InstrumentedSpotify
+from library_database import LibraryDatabase
+from metadata_cache import MetadataCache
+from playback_state_service import PlaybackStateService
+from request_scheduler import RequestScheduler, BULK
+from saved_tracks_cache import SavedTracksCache
+from track_matching import TrackMatcher
+import discography
+import liked_tracks_filter
+import pagination
+
+BENCHMARKS = ['hotkeys', 'discography', 'add_to_playlist_1', 'track_matching', 'curve_playlist', 'liked_tracks_filter']
+# as in Ansible_for_Spotify.py:
+BULK_OPERATIONS = {'discography_albums': BULK, 'discography_artists': BULK, 'discography_playlist_fill': BULK, 'sync_library_database': BULK, 'saved_tracks_cache': BULK, 'playlist_membership': BULK}
+
+# The hotkeys pressed, as bound in Ansible_for_Spotify.py: (HotkeyActions method name, whether repeated presses are coalesced, the hotkey's callback parameter):
+HOTKEYS = [
+    ('next_track', True, None),
+    ('previous_track', True, None),
+    ('pause_or_start_playback', False, None),
+    ('seek_to_track_start', False, None),
+    ('relative_seek', True, 5000),
+    ('change_repeat_mode', True, None),
+    ('toggle_playback_shuffle', True, None),
+    ('save_track', False, None),
+    ('unsave_track', False, None),
+]
+
+# Function: return the HotkeyActions the script would make, on library_database. The playback state service is polled once, as its thread would at startup, but its thread isn't started (it can't be stopped, and its polls would be counted in every later benchmark's requests), so refreshes the hotkeys request aren't polled.
+def make_hotkey_actions(sp, library_database, playlist_id_1=None, discards_playlist_id=None):
+    saved_tracks_cache = SavedTracksCache(sp, library_database)
+    playback_state_service = PlaybackStateService(sp, saved_tracks_cache)
+    playback_state_service.poll()
+    return HotkeyActions(sp, library_database, saved_tracks_cache, playback_state_service, MetadataCache(sp), playlist_id_1, discards_playlist_id)
+
+# Function: press every hotkey of HOTKEYS presses times (press_interval seconds apart, round robin) through an ActionDispatcher, as the script's dispatched() queues them; return its latency summary. What the hotkey functions print is discarded unless verbose.
+def run_hotkey_presses(sp, hotkey_actions, presses, press_interval, verbose=False):
+    action_dispatcher = ActionDispatcher()
+    action_dispatcher.start()
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        for press_number in range(presses):
+            for action_name, coalesce, value in HOTKEYS:
+                def attributed_function(*args, action_name=action_name):
+                    with sp.attributed_to(action_name):
+                        getattr(hotkey_actions, action_name)(*args)
+                action_dispatcher.submit(action_name, attributed_function, 1 if coalesce and value is None else value, coalesce)
+                time.sleep(press_interval)
+        done = threading.Event()
+        action_dispatcher.submit('done', done.set)
+        done.wait()
+    summary = action_dispatcher.get_latency_summary()
+    summary.pop('done', None)
+    return summary
+
+def benchmark_hotkeys(sp, arguments):
+    with tempfile.TemporaryDirectory() as directory:
+        library_database = LibraryDatabase(sp, os.path.join(directory, 'library.db'))
+        hotkey_actions = make_hotkey_actions(sp, library_database)
+        results = {'idle': run_hotkey_presses(sp, hotkey_actions, arguments.presses, arguments.press_interval, arguments.verbose)}
+        # again, while the whole library (9,999 track playlist included) downloads at BULK priority on a background thread, as at startup:
+        sync_thread = threading.Thread(target=library_database.sync_playlists, name='sync_library_database', daemon=True)
+        sync_thread.start()
+        results['during_library_sync'] = run_hotkey_presses(sp, hotkey_actions, arguments.presses, arguments.press_interval, arguments.verbose)
+        sync_thread.join()
+        library_database.connection.close()
+    for condition, summary in results.items():
+        print("~\nHotkey latency (" + condition + "), presses / median / p90 / max ms:")
+        for action_name, stats in sorted(summary.items()):
+            print("  ", action_name + ":", stats['presses'], "/", stats['median_ms'], "/", stats['p90_ms'], "/", stats['max_ms'])
+    return results
+
+def benchmark_discography(sp, server, arguments):
+    artist = server.library.artists[server.library.main_artist_ids[0]]
+    artists = [{key: artist[key] for key in ('id', 'name', 'external_urls')}]
+    # (collected once without deduplication first, untimed, to count what deduplication saves:)
+    all_track_count = len(discography.collect_discographies(sp, artists, dedupe=False)[artist['id']]['tracks'])
+    start_request_count = server.request_count
+    start_time = time.perf_counter()
+    artists_releases = discography.collect_discographies(sp, artists)
+    collect_seconds = time.perf_counter() - start_time
+    track_urls = discography.get_track_urls(artists_releases[artist['id']]['tracks'])
+    user_id = sp.me()['id']
+    start_time = time.perf_counter()
+    parts, failed_track_urls = discography.write_discography_playlists(sp, user_id, artist['name'] + ' ~ benchmark', track_urls, 'Discography throughput benchmark')
+    write_seconds = time.perf_counter() - start_time
+    # refresh: a new album, and a compilation of recordings already written (which should be skipped), are released:
+    discography_manifest = DiscographyManifest(os.path.join(tempfile.mkdtemp(prefix='benchmark_discography_'), 'discographies.json'))
+    discography_manifest.record(artist, artist['name'] + ' ~ benchmark', 'Discography throughput benchmark', parts, *discography.get_written_releases(artists_releases[artist['id']]['album_ids'], artists_releases[artist['id']]['tracks'], failed_track_urls))
+    new_album_id = server.call_library('add_album', artist, artist['name'] + ' New Album', 10)
+    compilation_id = server.call_library('add_album', artist, artist['name'] + ' Greatest Hits', 0)
+    for track in artists_releases[artist['id']]['tracks'][:10]:
+        server.call_library('add_track', compilation_id, track['name'], [artist], track['duration_ms'], track['isrc'])
+    start_request_count_refresh = server.request_count
+    start_time = time.perf_counter()
+    refresh_summary = discography.refresh_discography(sp, user_id, artist, discography_manifest)
+    refresh_seconds = time.perf_counter() - start_time
+    refresh_request_count = server.request_count - start_request_count_refresh
+    results = {
+        'tracks': len(track_urls),
+        'duplicates_removed': all_track_count - len(track_urls),
+        'add_requests_saved': math.ceil(all_track_count / discography.TRACKS_PER_ADD_REQUEST) - math.ceil(len(track_urls) / discography.TRACKS_PER_ADD_REQUEST),
+        'playlists': len(parts),
+        'collect_seconds': round(collect_seconds, 3),
+        'write_seconds': round(write_seconds, 3),
+        'total_seconds': round(collect_seconds + write_seconds, 3),
+        'tracks_per_second': round(len(track_urls) / max(collect_seconds + write_seconds, 0.001), 1),
+        'requests': start_request_count_refresh - start_request_count,
+        'refresh_new_albums': refresh_summary['new_albums'],
+        'refresh_new_tracks': refresh_summary['new_tracks'],
+        'refresh_seconds': round(refresh_seconds, 3),
+        'refresh_requests': refresh_request_count,
+    }
+    print("~\nDiscography:", results)
+    return results
+
+# Function: run hotkey_actions.add_current_track_to_playlist_1 repetitions times, undoing each add afterward (untimed). Returns the median / max seconds and the requests made per run.
+def time_add_to_playlist_1(sp, server, hotkey_actions, repetitions=3, verbose=False):
+    playlist_id = hotkey_actions.playlist_id_1
+    library_database = hotkey_actions.library_database
+    durations = []
+    request_counts = []
+    for repetition in range(repetitions):
+        start_request_count = server.request_count
+        start_time = time.perf_counter()
+        with sp.attributed_to('add_current_track_to_playlist_1'), contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            is_added = hotkey_actions.add_current_track_to_playlist_1()
+        durations.append(time.perf_counter() - start_time)
+        request_counts.append(server.request_count - start_request_count)
+        if is_added:
+            track_id = sp.current_user_playing_track()['item']['external_urls']['spotify']
+            expected_snapshot_id = library_database.get_snapshot_id(playlist_id) if library_database else None
+            result = sp.playlist_remove_all_occurrences_of_items(playlist_id, [track_id])
+            if library_database:
+                library_database.record_tracks_removed(playlist_id, [track_id], result['snapshot_id'], expected_snapshot_id)
+    durations.sort()
+    return {'median_ms': round(durations[len(durations) // 2] * 1000, 1), 'max_ms': round(durations[-1] * 1000, 1), 'requests': max(request_counts)}
+
+def benchmark_add_to_playlist_1(sp, server, arguments):
+    playlist_id = list(server.library.playlists)[0]
+    # make the playing track one that isn't in playlist 1, so that the duplicate check can't stop early:
+    playlist_track_ids = {item['track_id'] for item in server.library.playlist_items[playlist_id]}
+    while sp.current_user_playing_track()['item']['id'] in playlist_track_ids:
+        sp.next_track()
+    # (without a library database, add_current_track_to_playlist_1 pages through playlist 1 from the API:)
+    results = {'api_scan': time_add_to_playlist_1(sp, server, make_hotkey_actions(sp, None, playlist_id), arguments.repetitions, arguments.verbose)}
+    with tempfile.TemporaryDirectory() as directory:
+        library_database = LibraryDatabase(sp, os.path.join(directory, 'library.db'))
+        hotkey_actions = make_hotkey_actions(sp, library_database, playlist_id)
+        results['library_database_cold'] = time_add_to_playlist_1(sp, server, hotkey_actions, 1, arguments.verbose)
+        results['library_database_warm'] = time_add_to_playlist_1(sp, server, hotkey_actions, arguments.repetitions, arguments.verbose)
+        library_database.connection.close()
+    print("~\nadd_current_track_to_playlist_1 on a", len(server.library.playlist_items[playlist_id]), "track playlist 1:")
+    for method, stats in results.items():
+        print("  ", method + ":", stats)
+    return results
+
+# Function: return rows of a foreign list of row_count tracks of the fake library (a third with ISRCs, a tenth repeats of earlier rows, a twentieth not on the fake API), and the track ID each should match (None for those not on it).
+def make_foreign_rows(library, row_count, seed=1):
+    generator = random.Random(seed)
+    track_ids = generator.sample(sorted(library.tracks), row_count)
+    rows = []
+    for row_number, track_id in enumerate(track_ids):
+        if rows and row_number % 10 == 9:
+            rows.append(generator.choice(rows))
+            continue
+        track = library.tracks[track_id]
+        row = {'track_name': track['name'], 'artist_names': ', '.join(artist['name'] for artist in track['artists']), 'isrc': track['external_ids']['isrc'] if row_number % 3 == 0 else '', 'duration_ms': track['duration_ms']}
+        if row_number % 20 == 4:
+            row.update(track_name='Not On Spotify ' + str(row_number), isrc='')
+            track_id = None
+        rows.append((row, track_id))
+    return rows
+
+def benchmark_track_matching(sp, server, arguments):
+    foreign_rows = make_foreign_rows(server.library, arguments.match_rows)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for condition in ('cold', 'warm'):
+            track_matcher = TrackMatcher(sp, os.path.join(directory, 'track_matches.db'))
+            start_request_count = server.request_count
+            correct = 0
+            for (row, track_uri), (expected_row, expected_track_id) in zip(track_matcher.match_rows(row for row, track_id in foreign_rows), foreign_rows):
+                # a match is correct if it's the track the row was made from, or one with the same ISRC (a deluxe re-release of it):
+                if expected_track_id is None:
+                    correct += track_uri is None
+                elif track_uri:
+                    correct += server.library.tracks[track_uri.split(':')[-1]]['external_ids']['isrc'] == server.library.tracks[expected_track_id]['external_ids']['isrc']
+            results[condition] = dict(track_matcher.get_metrics(), accuracy=round(correct / len(foreign_rows), 3), requests=server.request_count - start_request_count)
+            track_matcher.connection.close()
+    print("~\nTrack matching of", len(foreign_rows), "foreign rows:")
+    for condition, stats in results.items():
+        print("  ", condition + ":", stats)
+    return results
+
+def benchmark_curve_playlist(sp, server, arguments):
+    import numpy as np
+    import curve_playlist
+    from audio_features import AudioFeaturesStore
+    targets = curve_playlist.parse_curve_spec('valence: rising_sine 0.2 0.9; tempo: rise 90 140')
+    candidate_track_ids = [track_id for track_id, added_at in server.library.saved_tracks]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        audio_features_store = AudioFeaturesStore(sp, os.path.join(directory, 'audio_features.db'))
+        for condition in ('cold', 'warm'):
+            start_request_count = server.request_count
+            start_time = time.perf_counter()
+            track_ids, summary = curve_playlist.build_curve_playlist(audio_features_store, candidate_track_ids, targets, arguments.curve_length)
+            results[condition] = dict(summary, seconds=round(time.perf_counter() - start_time, 3), requests=server.request_count - start_request_count)
+        audio_features_store.connection.close()
+    start_request_count = server.request_count
+    start_time = time.perf_counter()
+    curve_playlist.write_playlist(sp, sp.me()['id'], 'Curve ~ benchmark', track_ids, 'Curve playlist benchmark')
+    results['write'] = {'tracks': len(track_ids), 'seconds': round(time.perf_counter() - start_time, 3), 'requests': server.request_count - start_request_count}
+    # the assignment alone, on a pool as big as a large library:
+    generator = np.random.default_rng(1)
+    features = np.column_stack([generator.random(arguments.curve_candidates), generator.uniform(60, 190, arguments.curve_candidates)])
+    target_features = np.column_stack([curve_playlist.make_curve(shape, arguments.curve_length, low, high, periods) for shape, low, high, periods, weight in targets.values()])
+    for method in ('greedy', 'auto'):
+        start_time = time.perf_counter()
+        indexes, used_method = curve_playlist.assign_tracks(curve_playlist.get_cost_matrix(features, target_features, [1.0, 1.0]), method)
+        results['solve_' + method] = {'candidates': arguments.curve_candidates, 'method': used_method, 'seconds': round(time.perf_counter() - start_time, 3)}
+    print("~\nCurve playlist of", arguments.curve_length, "tracks:")
+    for condition, stats in results.items():
+        print("  ", condition + ":", stats)
+    return results
+
+def benchmark_liked_tracks_filter(sp, server, arguments):
+    source_playlist_id = list(server.library.playlists)[1]
+    user_id = sp.me()['id']
+    def append_by_api(target_playlist_id):
+        track_ids = list(dict.fromkeys(item['track']['id'] for item in pagination.iterate_items(sp, sp.playlist_items(source_playlist_id, fields='items(track(id)),next', limit=100, additional_types=('track',))) if item.get('track') and item['track'].get('id')))
+        liked_track_ids = []
+        for idx in range(0, len(track_ids), 50):
+            batch = track_ids[idx:idx + 50]
+            liked_track_ids.extend(track_id for track_id, is_liked in zip(batch, sp.current_user_saved_tracks_contains(batch)) if is_liked)
+        for idx in range(0, len(liked_track_ids), liked_tracks_filter.TRACKS_PER_ADD_REQUEST):
+            sp.playlist_add_items(target_playlist_id, ['spotify:track:' + track_id for track_id in liked_track_ids[idx:idx + liked_tracks_filter.TRACKS_PER_ADD_REQUEST]])
+        return {'liked': len(liked_track_ids)}
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        library_database = LibraryDatabase(sp, os.path.join(directory, 'library.db'))
+        saved_tracks_cache = SavedTracksCache(sp, library_database)
+        for condition in ('api', 'cold', 'warm'):
+            target_playlist_id = sp.user_playlist_create(user_id, 'Liked tracks ~ benchmark ' + condition)['id']
+            start_request_count = server.request_count
+            start_time = time.perf_counter()
+            if condition == 'api':
+                summary = append_by_api(target_playlist_id)
+            else:
+                summary = liked_tracks_filter.append_liked_tracks(sp, library_database, saved_tracks_cache, source_playlist_id, target_playlist_id, shuffle=True)
+            results[condition] = {'liked': summary['liked'], 'seconds': round(time.perf_counter() - start_time, 3), 'requests': server.request_count - start_request_count}
+        library_database.connection.close()
+    print("~\nLiked tracks filter of a", len(server.library.playlist_items[source_playlist_id]), "track playlist:")
+    for condition, stats in results.items():
+        print("  ", condition + ":", stats)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark hotkeys, discography and playlist checks against a local fake Spotify Web API.')
+    parser.add_argument('--only', choices=BENCHMARKS, action='append', help='run only this benchmark (may be repeated)')
+    parser.add_argument('--latency', type=float, default=0.03, help='seconds the fake API adds to every response (default 0.03)')
+    parser.add_argument('--latency-jitter', type=float, default=0.01, help='up to this many more seconds, at random (default 0.01)')
+    parser.add_argument('--max-page-size', type=int, default=None, help='cap on items per page')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with HTTP 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds of injected 429s')
+    parser.add_argument('--scheduler-rate', type=float, default=None, help='request scheduler rate (requests/second; default as in RequestScheduler)')
+    parser.add_argument('--presses', type=int, default=5, help='presses of each hotkey (default 5)')
+    parser.add_argument('--press-interval', type=float, default=0.1, help='seconds between hotkey presses (default 0.1)')
+    parser.add_argument('--repetitions', type=int, default=3, help='repetitions of add_current_track_to_playlist_1 (default 3)')
+    parser.add_argument('--match-rows', type=int, default=1000, help='rows of the foreign list to match (default 1000)')
+    parser.add_argument('--curve-length', type=int, default=50, help='tracks in the curve playlist (default 50)')
+    parser.add_argument('--curve-candidates', type=int, default=50000, help='candidates of the assignment-only curve playlist benchmark (default 50000)')
+    parser.add_argument('--json', help='also write results to this JSON file')
+    parser.add_argument('--in-process', action='store_true', help='run the fake API on threads of this process instead of in a child process (it then shares the GIL with the code measured)')
+    parser.add_argument('--verbose', action='store_true', help='print what the hotkey functions print, API call statistics and fake API request counts')
+    arguments = parser.parse_args()
+
+    print("Generating fake library and starting fake Spotify API . .")
+    server_options = {'latency': arguments.latency, 'latency_jitter': arguments.latency_jitter, 'max_page_size': arguments.max_page_size, 'rate_limit_every': arguments.rate_limit_every, 'retry_after': arguments.retry_after}
+    if arguments.in_process:
+        server = FakeSpotifyAPIServer(FakeSpotifyLibrary(), **server_options).start()
+    else:
+        server = FakeSpotifyAPIProcess(**server_options).start()
+    scheduler_options = {'rate': arguments.scheduler_rate} if arguments.scheduler_rate else {}
+    request_scheduler = RequestScheduler(**scheduler_options)
+    sp = InstrumentedSpotify(server.create_client(), request_scheduler, BULK_OPERATIONS)
+    results = {'settings': {key: value for key, value in vars(arguments).items() if key not in ('json', 'verbose')}}
+    benchmarks = arguments.only or BENCHMARKS
+    if 'hotkeys' in benchmarks:
+        results['hotkeys'] = benchmark_hotkeys(sp, arguments)
+    if 'discography' in benchmarks:
+        results['discography'] = benchmark_discography(sp, server, arguments)
+    if 'add_to_playlist_1' in benchmarks:
+        results['add_to_playlist_1'] = benchmark_add_to_playlist_1(sp, server, arguments)
+    if 'track_matching' in benchmarks:
+        results['track_matching'] = benchmark_track_matching(sp, server, arguments)
+    if 'curve_playlist' in benchmarks:
+        results['curve_playlist'] = benchmark_curve_playlist(sp, server, arguments)
+    if 'liked_tracks_filter' in benchmarks:
+        results['liked_tracks_filter'] = benchmark_liked_tracks_filter(sp, server, arguments)
+    results['request_scheduler'] = request_scheduler.get_status()
+    results['fake_api'] = {'requests': server.request_count, 'rate_limited': server.rate_limited_count}
+    print("~\nRequest scheduler:", results['request_scheduler'])
+    print("Fake API:", results['fake_api'])
+    if arguments.verbose:
+        sp.print_statistics()
+        server.print_request_counts()
+    if arguments.json:
+        with open(arguments.json, 'w', encoding='UTF-8') as json_file:
+            json.dump(results, json_file, indent=2)
+        print("~\nWrote results to", arguments.json)
+    server.stop()
+
+if __name__ == '__main__':
+    main()
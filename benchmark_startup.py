@@ -0,0 +1,83 @@
+# DESCRIPTION
+# Measures how fast Ansible_for_Spotify.py starts, to keep the time from launching it to working hotkeys short:
+# - the import cost of every module imported at startup (and of spotipy, which startup defers to a background thread), each measured in a fresh interpreter with python -X importtime, so modules already imported by another don't hide their cost
+# - time to first working hotkey and to the info window being shown, over several launches of the script (which, run by this, reports its STARTUP_TIMES and exits right after the window is created). With --warm, it also waits for and reports the time until the API client is created and authorized (which needs a cached token, or it will wait on the authorization prompt).
+
+# USAGE
+#    python benchmark_startup.py
+#    python benchmark_startup.py --runs 10 --warm
+# Run from the directory with Ansible_for_Spotify.py and a configured Ansible_for_Spotify.ini.
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SCRIPT_FILE_NAME = 'Ansible_for_Spotify.py'
+BENCHMARK_ENVIRONMENT_VARIABLE = 'ANSIBLE_FOR_SPOTIFY_STARTUP_BENCHMARK'
+MODULES = ['extended_configparser.parser', 'global_hotkeys', 'tkinter', 'sqlite3', 'config_store', 'instrumented_spotify', 'request_scheduler', 'pagination', 'library_database', 'saved_tracks_cache', 'playlist_membership', 'playback_state_service', 'metadata_cache', 'action_dispatcher', 'current_track_in_user_tracks_display', 'discography', 'requests', 'spotipy', 'spotipy.oauth2']
+
+# Function: return the cumulative import time of a module in milliseconds, in a fresh interpreter, or None if it can't be imported.
+def get_import_milliseconds(module_name):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module_name], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    # -X importtime lines are: "import time: self [us] | cumulative | imported package"; the cost of importing a submodule includes its parent packages, so this is the largest cumulative time of the module and its parents:
+    names = {'.'.join(module_name.split('.')[:depth]) for depth in range(1, module_name.count('.') + 2)}
+    cumulative_microseconds = [int(fields[1]) for fields in (line.replace('import time:', '').split('|') for line in result.stderr.splitlines()) if len(fields) == 3 and fields[2].strip() in names]
+    return max(cumulative_microseconds) / 1000 if cumulative_microseconds else None
+
+# Function: launch the script once in benchmark mode; return its STARTUP_TIMES plus the wall time of the launch (including interpreter startup) in milliseconds, or None if it didn't report.
+def run_startup(warm, timeout):
+    environment = dict(os.environ)
+    environment[BENCHMARK_ENVIRONMENT_VARIABLE] = 'warm' if warm else '1'
+    start_time = time.perf_counter()
+    try:
+        result = subprocess.run([sys.executable, SCRIPT_FILE_NAME], stdin=subprocess.DEVNULL, capture_output=True, text=True, env=environment, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return None
+    wall_milliseconds = round((time.perf_counter() - start_time) * 1000, 1)
+    for line in result.stdout.splitlines():
+        if line.startswith('STARTUP_BENCHMARK '):
+            startup_times = json.loads(line[len('STARTUP_BENCHMARK '):])
+            startup_times['process_wall_ms'] = wall_milliseconds
+            return startup_times
+    print("~\nStartup run didn't report startup times. Its output was:")
+    print(result.stdout[-2000:], result.stderr[-2000:])
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import costs and time to first hotkey of ' + SCRIPT_FILE_NAME + '.')
+    parser.add_argument('--runs', type=int, default=5, help='number of launches to measure (default 5)')
+    parser.add_argument('--warm', action='store_true', help='also wait for the API client to be created and authorized')
+    parser.add_argument('--timeout', type=float, default=180, help='seconds to wait for one launch (default 180)')
+    parser.add_argument('--skip-imports', action='store_true', help="don't measure import costs")
+    arguments = parser.parse_args()
+
+    if not arguments.skip_imports:
+        print("~\nImport cost of each module, in a fresh interpreter (cumulative ms):")
+        import_costs = [(module_name, get_import_milliseconds(module_name)) for module_name in MODULES]
+        for module_name, milliseconds in sorted(import_costs, key=lambda cost: -(cost[1] or 0)):
+            print("  ", module_name + ":", milliseconds if milliseconds is not None else "(not importable)")
+
+    print("~\nLaunching", SCRIPT_FILE_NAME, arguments.runs, "times..")
+    runs = []
+    for run_number in range(arguments.runs):
+        startup_times = run_startup(arguments.warm, arguments.timeout)
+        if startup_times:
+            print("  run", run_number + 1, startup_times)
+            runs.append(startup_times)
+    if not runs:
+        print("~\nNo launch reported startup times.")
+        return 1
+    print("~\nStartup times over", len(runs), "runs (ms since the script started executing, except process_wall_ms): median / min / max")
+    for name in sorted(set().union(*runs)):
+        values = [run[name] for run in runs if name in run]
+        print("  ", name + ":", round(statistics.median(values), 1), "/", min(values), "/", max(values))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# DESCRIPTION
+# Persistence for the .ini config (an ExtendedConfigParser) of Ansible_for_Spotify.py, which doesn't rewrite the whole file on every option set:
+# - options set inside a transaction are committed as one write
+# - writes are debounced (several sets within debounce_seconds make one write) and done on a timer thread, not on the (hotkey) thread that set them
+# - writes are atomic: the config is written to a temporary file next to the .ini, which then replaces the .ini, so a crash mid-write can't leave a truncated or half-written .ini (see atomic_file.py).
+
+# USAGE
+#    from config_store import ConfigStore
+#    config_store = ConfigStore(config, 'Ansible_for_Spotify.ini')
+#    with config_store.transaction():
+#        config_store.set('BOOKMARK 1', 'track_id', track_id)
+#        config_store.set('BOOKMARK 1', 'position_ms', position_ms)
+#    config_store.flush()    # write now, for example before exiting
+
+import contextlib
+import io
+import threading
+import atomic_file
+
+class ConfigStore:
+    def __init__(self, config, path, debounce_seconds=0.5):
+        self.config = config
+        self.path = path
+        self.debounce_seconds = debounce_seconds
+        self.lock = threading.RLock()
+        self.transaction_depth = 0
+        self.is_dirty = False
+        self.write_timer = None
+        self.write_count = 0
+
+    # Function: set an option (creating its section if need be) and schedule a write.
+    def set(self, section_name, option_name, option_value, comment=None):
+        with self.lock:
+            if not self.config.has_section(section_name):
+                self.config.add_section(section_name)
+            self.config.set(section_name, option_name, option_value, comment=comment)
+            self.mark_dirty()
+
+    # Function: context manager inside which sets are only written once it exits (transactions may be nested; the outermost one commits).
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            self.transaction_depth += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.transaction_depth -= 1
+                if self.transaction_depth == 0 and self.is_dirty:
+                    self.schedule_write()
+
+    def mark_dirty(self):
+        self.is_dirty = True
+        if self.transaction_depth == 0:
+            self.schedule_write()
+
+    # Function: (re)start the debounce timer, so the write happens debounce_seconds after the last change.
+    def schedule_write(self):
+        with self.lock:
+            if self.write_timer is not None:
+                self.write_timer.cancel()
+            self.write_timer = threading.Timer(self.debounce_seconds, self.flush)
+            self.write_timer.name = 'config_store'
+            self.write_timer.daemon = True
+            self.write_timer.start()
+
+    # Function: write the config now if it has unwritten changes, atomically (temporary file, then replace).
+    def flush(self):
+        with self.lock:
+            if self.write_timer is not None:
+                self.write_timer.cancel()
+                self.write_timer = None
+            if not self.is_dirty:
+                return False
+            config_text = io.StringIO()
+            self.config.write(config_text)
+            atomic_file.write_atomically(self.path, config_text.getvalue())
+            self.is_dirty = False
+            self.write_count += 1
+            return True
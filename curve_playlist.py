@@ -0,0 +1,130 @@
+# DESCRIPTION
+# Builds playlists whose tracks follow curves of audio features over the playlist's length (a "multigraph" of track attributes), for example a rising sine wave of valence with a linear rise of tempo:
+# - every feature gets a target curve (a shape, scaled between a low and a high value) sampled at each playlist position
+# - the candidate pool (for example Liked Songs) is held as a NumPy array of its features (from the audio features store; see audio_features.py), each feature scaled to 0..1 over the pool, so features in different units (tempo in BPM, valence 0..1) weigh alike
+# - the cost of every track at every position (squared distance to the targets) is computed at once as a positions x candidates matrix, and tracks are assigned to positions without repeats: optimally (Hungarian method) with SciPy if it's installed, else greedily (each position in turn takes the closest unused track). Either runs on only each position's nearest candidates, which never changes the result, so tens of thousands of candidates take well under a second.
+# - the playlist is written with one request per 100 tracks.
+# Requires NumPy (pip install numpy); SciPy is optional.
+
+# USAGE
+#    import curve_playlist
+#    targets = curve_playlist.parse_curve_spec('valence: rising_sine 0.2 0.9; tempo: rise 90 140')
+#    track_IDs, summary = curve_playlist.build_curve_playlist(audio_features_store, candidate_track_IDs, targets, length=50)
+#    curve_playlist.write_playlist(sp, user_id, 'Uplift', track_IDs, 'Rising valence and tempo')
+
+import time
+import numpy as np
+from audio_features import FEATURE_NAMES
+
+# The add items endpoint accepts at most this many items per request:
+TRACKS_PER_ADD_REQUEST = 100
+# Curve shapes, as functions of playlist position (an array from 0 at the first track to 1 at the last) and number of periods (for the waves), returning values from 0 (the curve's low) to 1 (its high):
+CURVE_SHAPES = {
+    'constant': lambda position, periods: np.full_like(position, 0.5),
+    'rise': lambda position, periods: position,
+    'fall': lambda position, periods: 1 - position,
+    'arc': lambda position, periods: np.sin(np.pi * position),
+    'sine': lambda position, periods: 0.5 + 0.5 * np.sin(2 * np.pi * periods * position),
+    'rising_sine': lambda position, periods: 0.7 * position + 0.15 * (1 + np.sin(2 * np.pi * periods * position)),
+    'falling_sine': lambda position, periods: 0.7 * (1 - position) + 0.15 * (1 + np.sin(2 * np.pi * periods * position)),
+}
+DEFAULT_PERIODS = 2
+
+# Function: return a curve (an array of length values) of a shape (a name of CURVE_SHAPES), scaled from low to high.
+def make_curve(shape, length, low, high, periods=DEFAULT_PERIODS):
+    if shape not in CURVE_SHAPES:
+        raise ValueError('Unknown curve shape ' + repr(shape) + '; one of: ' + ', '.join(CURVE_SHAPES))
+    position = np.linspace(0.0, 1.0, length) if length > 1 else np.zeros(length)
+    return low + (high - low) * CURVE_SHAPES[shape](position, periods)
+
+# Function: parse a curve spec, "feature: shape low high [periods] [*weight]; ..", for example 'valence: rising_sine 0.2 0.9; tempo: rise 90 140 *0.5', into a dictionary of feature name -> (shape, low, high, periods, weight).
+def parse_curve_spec(spec):
+    targets = {}
+    for part in spec.split(';'):
+        if not part.strip():
+            continue
+        feature_name, _, curve = part.partition(':')
+        feature_name = feature_name.strip()
+        words = curve.split()
+        weight = 1.0
+        if words and words[-1].startswith('*'):
+            weight = float(words.pop()[1:])
+        if feature_name not in FEATURE_NAMES or len(words) not in (3, 4):
+            raise ValueError('Bad curve ' + repr(part.strip()) + '; expected "feature: shape low high [periods] [*weight]", with feature one of: ' + ', '.join(FEATURE_NAMES))
+        targets[feature_name] = (words[0], float(words[1]), float(words[2]), float(words[3]) if len(words) == 4 else DEFAULT_PERIODS, weight)
+    return targets
+
+# Function: return the cost matrix (positions x candidates) of putting each candidate (a row of features, candidates x features) at each position (a row of target features, positions x features): the weighted squared distance, with every feature scaled to 0..1 over the candidates.
+def get_cost_matrix(features, target_features, weights):
+    low = features.min(axis=0)
+    span = features.max(axis=0) - low
+    span[span == 0] = 1
+    features = ((features - low) / span).astype(np.float32)
+    target_features = ((target_features - low) / span).astype(np.float32)
+    cost = np.zeros((len(target_features), len(features)), dtype=np.float32)
+    # (one feature at a time, so no positions x candidates x features array is made:)
+    for feature_index, weight in enumerate(weights):
+        cost += weight * np.square(target_features[:, feature_index, None] - features[None, :, feature_index])
+    return cost
+
+# Function: return, for each position (row of cost), the index of the candidate (column) assigned to it, every candidate used at most once: with the Hungarian method (scipy.optimize.linear_sum_assignment) if method is 'hungarian', or 'auto' and SciPy is installed, else greedily. Returns the indexes and the method used.
+def assign_tracks(cost, method='auto'):
+    position_count, candidate_count = cost.shape
+    if position_count > candidate_count:
+        raise ValueError('Fewer candidates (' + str(candidate_count) + ') than positions (' + str(position_count) + ')')
+    # a position assigned a candidate outside its position_count nearest would have a nearer one unused (the other positions use at most position_count - 1), so assignments only need those:
+    if candidate_count > position_count:
+        candidate_indexes = np.unique(np.argpartition(cost, position_count - 1, axis=1)[:, :position_count])
+        cost = cost[:, candidate_indexes]
+    else:
+        candidate_indexes = np.arange(candidate_count)
+    if method in ('auto', 'hungarian'):
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            if method == 'hungarian':
+                raise
+        else:
+            positions, columns = linear_sum_assignment(cost)
+            return candidate_indexes[columns[np.argsort(positions)]], 'hungarian'
+    # greedy: each position in turn takes the nearest candidate not yet taken:
+    cost = cost.copy()
+    columns = np.empty(position_count, dtype=np.int64)
+    for position in range(position_count):
+        columns[position] = np.argmin(cost[position])
+        cost[:, columns[position]] = np.inf
+    return candidate_indexes[columns], 'greedy'
+
+# Function: pick length tracks of candidate_track_ids (IDs, URIs or URLs; their features are fetched into audio_features_store as needed) whose features best follow targets (as parse_curve_spec returns), in playlist order. Returns the track IDs and a summary dictionary (including the mean distance of each feature from its curve, in the feature's units).
+def build_curve_playlist(audio_features_store, candidate_track_ids, targets, length, method='auto'):
+    start_time = time.perf_counter()
+    feature_names = list(targets)
+    track_ids, rows = audio_features_store.get_feature_rows(candidate_track_ids, feature_names)
+    load_seconds = time.perf_counter() - start_time
+    if not track_ids:
+        return [], {'candidates': 0}
+    length = min(length, len(track_ids))
+    features = np.array(rows, dtype=np.float64)
+    target_features = np.column_stack([make_curve(shape, length, low, high, periods) for shape, low, high, periods, weight in targets.values()])
+    weights = [weight for shape, low, high, periods, weight in targets.values()]
+    solve_start_time = time.perf_counter()
+    cost = get_cost_matrix(features, target_features, weights)
+    indexes, method = assign_tracks(cost, method)
+    solve_seconds = time.perf_counter() - solve_start_time
+    summary = {
+        'candidates': len(track_ids),
+        'tracks': length,
+        'method': method,
+        'mean_distance': {feature_name: round(float(np.mean(np.abs(features[indexes, feature_index] - target_features[:, feature_index]))), 3) for feature_index, feature_name in enumerate(feature_names)},
+        'load_seconds': round(load_seconds, 3),
+        'solve_seconds': round(solve_seconds, 3),
+    }
+    return [track_ids[index] for index in indexes], summary
+
+# Function: create a playlist of track_ids, in order, adding TRACKS_PER_ADD_REQUEST per request. Returns the new playlist's URL.
+def write_playlist(sp, user_id, playlist_name, track_ids, playlist_description=''):
+    playlist = sp.user_playlist_create(user_id, playlist_name, public=True, collaborative=False, description=playlist_description)
+    track_uris = ['spotify:track:' + track_id for track_id in track_ids]
+    for idx in range(0, len(track_uris), TRACKS_PER_ADD_REQUEST):
+        sp.playlist_add_items(playlist['id'], track_uris[idx:idx + TRACKS_PER_ADD_REQUEST])
+    return playlist['external_urls']['spotify']
@@ -0,0 +1,263 @@
+# DESCRIPTION
+# Collects complete discographies (every track credited to an artist, on every album of that artist) for the make_discography_playlist hotkey of Ansible_for_Spotify.py, concurrently and in batches:
+# - artists are collected concurrently on a small thread pool
+# - each artist's album list is paged with the next page prefetched while the current page is processed (see pagination.py)
+# - full albums (which include their first 50 tracks) are fetched 20 at a time with the multi-album endpoint (sp.albums), and those batches run concurrently on a bounded thread pool, instead of one album_tracks call (plus pagination) per album, serially.
+# - tracks are credited to an artist by artist ID (not name), and, unless dedupe is False, the same recording on several albums (remasters, deluxe editions, compilations) is kept once: recordings are identified by ISRC where the album batch responses include it (the Web API's album tracks usually don't; looking those up, 50 tracks at a time with sp.tracks, is opt-in with lookup_isrcs, as it costs more requests than deduplication usually saves), or, for tracks without one, by normalized title and a duration within a few seconds. The version kept is the one on the earliest released album, in that album's place.
+# - a discography playlist can be refreshed (refresh_discography): with the artist's albums and recordings already collected, and the playlist parts written, kept in a manifest (see discography_manifest.py), only the artist's album list is fetched, and only new albums' tracks, not already in the playlist as another version, are collected and appended. That's a handful of requests instead of a full crawl.
+
+# USAGE
+#    import discography
+#    artists_releases = discography.collect_discographies(sp, info['item']['artists'])
+# -- which returns a dictionary of artist ID to {'album_ids': all of the artist's album IDs, 'tracks': credited track objects, in album order}; discography.get_track_urls(tracks) for their URLs.
+#    discography.refresh_discography(sp, user_id, artist, discography_manifest)
+
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pagination
+from request_scheduler import is_transient_error
+from text_normalization import normalize_text
+
+# The multi-album endpoint accepts at most this many album IDs per request:
+ALBUMS_PER_REQUEST = 20
+# How many album batch requests may be in flight at once (per collect_discographies call), and how many artists are collected at once:
+ALBUM_BATCH_WORKERS = 8
+ARTIST_WORKERS = 4
+# The multi-track endpoint accepts at most this many track IDs per request:
+TRACKS_PER_REQUEST = 50
+# Tracks without an ISRC are the same recording if their normalized titles are equal and their durations within this many ms:
+DUPLICATE_DURATION_TOLERANCE_MS = 3000
+
+# adapted from: https://github.com/spotipy-dev/spotipy/blob/master/examples/artist_discography.py
+def get_artist_albums(sp, artist):
+    return list(pagination.iterate_items(sp, sp.artist_albums(artist['id'], album_type='album', limit=50)))
+
+# Function: get the tracks of a full album object (as returned by sp.albums), paging beyond the first 50 tracks embedded in it if there are more.
+def get_album_tracks(sp, album):
+    return list(pagination.iterate_items(sp, album['tracks']))
+
+# Function: fetch full albums for up to ALBUMS_PER_REQUEST album IDs in one request, and return all of their tracks (in album order), each with its album's ID and release date added (as 'album_id' and 'album_release_date').
+def get_album_batch_tracks(sp, album_ids):
+    tracks = []
+    for album in sp.albums(album_ids)['albums']:
+        if album:
+            for track in get_album_tracks(sp, album):
+                track['album_id'] = album['id']
+                track['album_release_date'] = album.get('release_date') or ''
+                tracks.append(track)
+    return tracks
+
+# Function: return the ISRCs of up to TRACKS_PER_REQUEST track IDs, fetched in one request, as a dictionary of track ID -> ISRC (tracks without one are left out).
+def get_track_isrcs(sp, track_ids):
+    isrcs = {}
+    for track in sp.tracks(track_ids)['tracks']:
+        if track and (track.get('external_ids') or {}).get('isrc'):
+            isrcs[track['id']] = track['external_ids']['isrc'].upper()
+    return isrcs
+
+# Function: return how a track is identified as a recording (as kept in the discography manifest): [ISRC (if deduplicate_recordings found one, else None), normalized title, duration in ms].
+def get_recording(track):
+    return [track.get('isrc'), normalize_text(track.get('name')), track.get('duration_ms') or 0]
+
+# Function: keep one version of every recording among tracks (album order), identified by ISRC (from the tracks' external_ids if they have them, else, if lookup_isrcs, looked up on executor, TRACKS_PER_REQUEST at a time; added to the tracks as 'isrc'), else by normalized title and duration: the version on the earliest released album. Recordings in known_recordings (see get_recording) are dropped entirely. Returns the kept tracks, in album order, and the number of ISRC lookup requests made.
+def deduplicate_recordings(sp, tracks, executor, known_recordings=(), lookup_isrcs=False):
+    isrcs = {track['id']: track['external_ids']['isrc'].upper() for track in tracks if track.get('id') and (track.get('external_ids') or {}).get('isrc')}
+    futures = []
+    if lookup_isrcs:
+        track_ids = [track['id'] for track in tracks if track.get('id') and track['id'] not in isrcs]
+        futures = [executor.submit(get_track_isrcs, sp, track_ids[idx:idx + TRACKS_PER_REQUEST]) for idx in range(0, len(track_ids), TRACKS_PER_REQUEST)]
+    for future in futures:
+        isrcs.update(future.result())
+    # titles are grouped, each group a list of (duration, title key):
+    untitled_recordings = {}
+    def get_title_key(title, duration_ms):
+        recordings = untitled_recordings.setdefault(title, [])
+        recording_key = next((key for other_duration_ms, key in recordings if abs(other_duration_ms - duration_ms) <= DUPLICATE_DURATION_TOLERANCE_MS), None)
+        if recording_key is None:
+            recording_key = 'title:' + title + ':' + str(len(recordings))
+            recordings.append((duration_ms, recording_key))
+        return recording_key
+    # known recordings are matched by ISRC, or by title and duration where either they or the track have no ISRC (as when one collection had ISRCs and the other didn't):
+    known_isrcs = set()
+    known_title_keys = set()
+    known_title_keys_without_isrc = set()
+    for isrc, title, duration_ms in known_recordings:
+        title_key = get_title_key(title, duration_ms)
+        known_title_keys.add(title_key)
+        if isrc:
+            known_isrcs.add(isrc)
+        else:
+            known_title_keys_without_isrc.add(title_key)
+    # recording key -> index in tracks of the version kept:
+    kept_indexes = {}
+    for index, track in enumerate(tracks):
+        track['isrc'] = isrcs.get(track.get('id'))
+        isrc, title, duration_ms = get_recording(track)
+        title_key = get_title_key(title, duration_ms)
+        if isrc in known_isrcs or title_key in (known_title_keys_without_isrc if isrc else known_title_keys):
+            continue
+        recording_key = 'isrc:' + isrc if isrc else title_key
+        kept_index = kept_indexes.get(recording_key)
+        # release dates are YYYY, YYYY-MM or YYYY-MM-DD, so they sort as text; of equal dates the first in album order is kept:
+        if kept_index is None or track.get('album_release_date', '') < tracks[kept_index].get('album_release_date', ''):
+            kept_indexes[recording_key] = index
+    return [tracks[index] for index in sorted(kept_indexes.values())], len(futures)
+
+# Function: collect every track credited to artist (a simplified artist object, as in a track's 'artists' list) on every one of the artist's albums but those in known_album_ids, with duplicate recordings (and those in known_recordings) removed unless dedupe is False (see deduplicate_recordings for lookup_isrcs). Album batches (and any ISRC lookups) are fetched concurrently on album_executor. Returns the IDs of all of the artist's albums, and the tracks (track objects, in album order).
+def collect_artist_tracks(sp, artist, album_executor, dedupe=True, known_album_ids=(), known_recordings=(), lookup_isrcs=False):
+    start_time = time.time()
+    all_album_ids = [album['id'] for album in get_artist_albums(sp, artist)]
+    known_album_ids = set(known_album_ids)
+    album_ids = [album_id for album_id in all_album_ids if album_id not in known_album_ids]
+    batches = [album_ids[idx:idx + ALBUMS_PER_REQUEST] for idx in range(0, len(album_ids), ALBUMS_PER_REQUEST)]
+    # futures are read back in submission order, so tracks stay in album order:
+    futures = [album_executor.submit(get_album_batch_tracks, sp, batch) for batch in batches]
+    credited_tracks = []
+    track_count = 0
+    for future in futures:
+        for track in future.result():
+            track_count += 1
+            # check tracks for credit to the artist we're building a playlist for (by ID, as names aren't unique), and only collect those (as artists can end up on albums with other artists where they didn't contribute to other tracks) :
+            if any(track_artist.get('id') == artist['id'] for track_artist in track['artists']):
+                credited_tracks.append(track)
+    artist_tracks = credited_tracks
+    if dedupe:
+        artist_tracks, lookup_request_count = deduplicate_recordings(sp, credited_tracks, album_executor, known_recordings, lookup_isrcs)
+        duplicate_count = len(credited_tracks) - len(artist_tracks)
+        saved_add_request_count = math.ceil(len(credited_tracks) / TRACKS_PER_ADD_REQUEST) - math.ceil(len(artist_tracks) / TRACKS_PER_ADD_REQUEST)
+        print("Removed", duplicate_count, "duplicate recordings (remasters, deluxe editions, compilations) of", artist['name'] + ", saving", duplicate_count, "playlist slots and", saved_add_request_count, "add requests, for", lookup_request_count, "ISRC lookup requests.")
+    elapsed = max(time.time() - start_time, 0.001)
+    print("Collected", len(artist_tracks), "tracks credited to", artist['name'], "(of", track_count, "tracks on", len(album_ids), "albums) in", round(elapsed, 2), "seconds;", round(track_count / elapsed, 1), "tracks/sec.")
+    return all_album_ids, artist_tracks
+
+def get_track_urls(tracks):
+    return [track['external_urls']['spotify'] for track in tracks]
+
+# Function: return what to record in the discography manifest after writing tracks (collected from album_ids) to a discography playlist, with failed_track_urls failing to be added: the album IDs, less those of albums with a failed track (so a refresh collects those again), and the recordings (see get_recording) of the tracks written.
+def get_written_releases(album_ids, tracks, failed_track_urls):
+    failed_track_urls = set(failed_track_urls)
+    failed_album_ids = set(track.get('album_id') for track in tracks if track['external_urls']['spotify'] in failed_track_urls)
+    return [album_id for album_id in album_ids if album_id not in failed_album_ids], [get_recording(track) for track in tracks if track['external_urls']['spotify'] not in failed_track_urls]
+
+# Function: collect discographies of several artists concurrently, with duplicate recordings removed unless dedupe is False (with ISRCs looked up if lookup_isrcs; see deduplicate_recordings). Returns a dictionary of artist ID to {'album_ids': all of the artist's album IDs, 'tracks': credited track objects, in album order}. An artist whose collection fails is left out (and the error printed).
+def collect_discographies(sp, artists, dedupe=True, lookup_isrcs=False):
+    start_time = time.time()
+    artists_releases = {}
+    with ThreadPoolExecutor(max_workers=ALBUM_BATCH_WORKERS, thread_name_prefix='discography_albums') as album_executor, ThreadPoolExecutor(max_workers=ARTIST_WORKERS, thread_name_prefix='discography_artists') as artist_executor:
+        futures = [(artist, artist_executor.submit(collect_artist_tracks, sp, artist, album_executor, dedupe, lookup_isrcs=lookup_isrcs)) for artist in artists]
+        for artist, future in futures:
+            try:
+                album_ids, tracks = future.result()
+                artists_releases[artist['id']] = {'album_ids': album_ids, 'tracks': tracks}
+            except Exception as e:
+                print("Could not collect discography of artist", artist['name'])
+                print(e)
+    elapsed = max(time.time() - start_time, 0.001)
+    total_tracks = sum(len(releases['tracks']) for releases in artists_releases.values())
+    print("Collected", total_tracks, "tracks for", len(artists_releases), "artist(s) in", round(elapsed, 2), "seconds;", round(total_tracks / elapsed, 1), "credited tracks/sec.")
+    return artists_releases
+
+# A playlist can hold at most this many tracks (Frederic Chopin broke it at 11,000!), and at most this many can be added per request:
+MAX_PLAYLIST_TRACKS = 10000
+TRACKS_PER_ADD_REQUEST = 100
+# How many playlist parts are filled at once, and how many times a failed add request is retried:
+PLAYLIST_FILL_WORKERS = 4
+ADD_RETRIES = 4
+
+# Function: add up to TRACKS_PER_ADD_REQUEST tracks to the end of a playlist that has track_count tracks, retrying transient failures with exponential backoff. Adds aren't idempotent, so the request scheduler sp goes through only retries them when rate limited (see request_scheduler.py); after a server or network error the add may still have been applied, so the playlist's track count is checked before retrying, and the add is only retried if it wasn't.
+def add_items_with_retry(sp, playlist_id, track_urls, track_count):
+    for attempt in range(ADD_RETRIES + 1):
+        try:
+            return sp.playlist_add_items(playlist_id, track_urls)
+        except Exception as e:
+            if attempt == ADD_RETRIES or not is_transient_error(e):
+                raise
+            wait_seconds = 0.5 * (2 ** attempt)
+            print("Transient error adding tracks to playlist", playlist_id, "; checking whether they were added, and retrying in", wait_seconds, "seconds if not:", e)
+            time.sleep(wait_seconds)
+            if sp.playlist(playlist_id, fields='tracks.total')['tracks']['total'] >= track_count + len(track_urls):
+                return None
+            # count the retry in API call statistics, if sp is an InstrumentedSpotify:
+            if hasattr(sp, 'record_retry'):
+                sp.record_retry('playlist_add_items')
+
+# Function: fill one playlist (part), which has track_count tracks, with track_urls, in order, TRACKS_PER_ADD_REQUEST at a time. Returns the track URLs that failed to be added.
+def fill_playlist(sp, playlist_id, track_urls, track_count=0):
+    failed_track_urls = []
+    for idx in range(0, len(track_urls), TRACKS_PER_ADD_REQUEST):
+        tracks_to_add = track_urls[idx:idx + TRACKS_PER_ADD_REQUEST]
+        try:
+            add_items_with_retry(sp, playlist_id, tracks_to_add, track_count)
+            track_count += len(tracks_to_add)
+        except Exception as e:
+            print("WARNING: error attempting to add tracks to playlist ", playlist_id)
+            print(e)
+            failed_track_urls.extend(tracks_to_add)
+    return failed_track_urls
+
+# Function: write track_urls to as many new playlists as it takes to stay under MAX_PLAYLIST_TRACKS per playlist: "<playlist_name>" if they fit in one, otherwise "<playlist_name> ~ part 1", "<playlist_name> ~ part 2" etc. (numbered from first_part_number, when adding parts to existing ones). The parts are created in order and then filled concurrently (each part's adds stay in order, so each part keeps album order). Returns a list of (playlist_id, playlist_name, track_count) for the parts (none if there are no track_urls), and the track URLs that failed to be added.
+def write_discography_playlists(sp, user_id, playlist_name, track_urls, playlist_description, first_part_number=1):
+    start_time = time.time()
+    shards = [track_urls[idx:idx + MAX_PLAYLIST_TRACKS] for idx in range(0, len(track_urls), MAX_PLAYLIST_TRACKS)]
+    parts = []
+    for part_number, shard in enumerate(shards, start=first_part_number):
+        part_name = playlist_name if len(shards) == 1 and first_part_number == 1 else playlist_name + " ~ part " + str(part_number)
+        print("MAKING PLAYLIST: ", part_name)
+        # function reference: user_playlist_create(user, name, public=True, collaborative=False, description='')
+        new_playlist_info = sp.user_playlist_create(user_id, part_name, public=True, collaborative=False, description=playlist_description)
+        parts.append((new_playlist_info['external_urls']['spotify'], part_name, len(shard)))
+    with ThreadPoolExecutor(max_workers=PLAYLIST_FILL_WORKERS, thread_name_prefix='discography_playlist_fill') as executor:
+        failed_track_urls_of_parts = list(executor.map(lambda part_and_shard: fill_playlist(sp, part_and_shard[0][0], part_and_shard[1]), zip(parts, shards)))
+    parts = [(playlist_id, part_name, track_count - len(failed_track_urls)) for (playlist_id, part_name, track_count), failed_track_urls in zip(parts, failed_track_urls_of_parts)]
+    failed_track_urls = [track_url for failed_track_urls in failed_track_urls_of_parts for track_url in failed_track_urls]
+    elapsed = max(time.time() - start_time, 0.001)
+    print("Wrote", len(track_urls) - len(failed_track_urls), "of", len(track_urls), "tracks to", len(parts), "playlist(s) in", round(elapsed, 2), "seconds;", round(len(track_urls) / elapsed, 1), "tracks/sec.")
+    return parts, failed_track_urls
+
+# Function: append track_urls to the last of a discography's playlist parts (a list of (playlist_id, playlist_name, track_count), as write_discography_playlists returns), and to new parts once it's full (or if there are no parts yet). Returns the updated list of parts, and the track URLs that failed to be added.
+def append_to_discography_playlists(sp, user_id, playlist_name, parts, track_urls, playlist_description):
+    parts = [tuple(part) for part in parts]
+    if not parts:
+        return write_discography_playlists(sp, user_id, playlist_name, track_urls, playlist_description)
+    last_playlist_id, last_part_name = parts[-1][0], parts[-1][1]
+    # (the playlist may have been edited since, so its track count is read rather than taken from parts:)
+    last_track_count = sp.playlist(last_playlist_id, fields='tracks.total')['tracks']['total']
+    fitting_track_count = max(MAX_PLAYLIST_TRACKS - last_track_count, 0)
+    failed_track_urls = []
+    if track_urls[:fitting_track_count]:
+        failed_track_urls = fill_playlist(sp, last_playlist_id, track_urls[:fitting_track_count], last_track_count)
+        print("Appended", len(track_urls[:fitting_track_count]) - len(failed_track_urls), "tracks to playlist", last_part_name)
+    parts[-1] = (last_playlist_id, last_part_name, last_track_count + len(track_urls[:fitting_track_count]) - len(failed_track_urls))
+    if track_urls[fitting_track_count:]:
+        new_parts, new_failed_track_urls = write_discography_playlists(sp, user_id, playlist_name, track_urls[fitting_track_count:], playlist_description, first_part_number=len(parts) + 1)
+        parts.extend(new_parts)
+        failed_track_urls.extend(new_failed_track_urls)
+    return parts, failed_track_urls
+
+# Function: append artist's new releases to the artist's discography playlist (as recorded in discography_manifest, a DiscographyManifest): only albums not in the manifest are fetched, and only their tracks that aren't already in the playlist as another version are appended. Records the new albums and tracks in the manifest (but not albums with tracks that failed to be added, so the next refresh tries those again). Returns a summary dictionary, or None if the manifest has no discography playlist of the artist.
+def refresh_discography(sp, user_id, artist, discography_manifest, lookup_isrcs=False):
+    start_time = time.time()
+    entry = discography_manifest.get(artist['id'])
+    if entry is None:
+        print("No discography playlist of", artist['name'], "recorded (in", discography_manifest.path + ") to refresh; make one first.")
+        return None
+    with ThreadPoolExecutor(max_workers=ALBUM_BATCH_WORKERS, thread_name_prefix='discography_albums') as album_executor:
+        album_ids, tracks = collect_artist_tracks(sp, artist, album_executor, known_album_ids=entry['album_ids'], known_recordings=entry['recordings'], lookup_isrcs=lookup_isrcs)
+    new_album_ids = set(album_ids) - set(entry['album_ids'])
+    parts = entry['parts']
+    failed_track_urls = []
+    if tracks:
+        parts, failed_track_urls = append_to_discography_playlists(sp, user_id, entry['playlist_name'], parts, get_track_urls(tracks), entry['playlist_description'])
+    written_album_ids, recordings = get_written_releases(album_ids, tracks, failed_track_urls)
+    discography_manifest.record_new_releases(artist['id'], parts, written_album_ids, recordings)
+    discography_manifest.save()
+    summary = {
+        'new_albums': len(new_album_ids),
+        'new_tracks': len(recordings),
+        'failed_tracks': len(failed_track_urls),
+        'playlists': [part[1] for part in parts],
+        'seconds': round(time.time() - start_time, 2),
+    }
+    print("Refreshed discography of", artist['name'] + ":", summary['new_tracks'], "new tracks on", summary['new_albums'], "new albums appended, in", summary['seconds'], "seconds.")
+    return summary
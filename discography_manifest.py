@@ -0,0 +1,56 @@
+# DESCRIPTION
+# A persistent manifest of the discography playlists made by make_discography_playlist (see discography.py), per artist: the playlist (parts) written, every album of the artist's as of the last collection, and every recording (ISRC, normalized title and duration) written, so that a discography can be refreshed with only the artist's new releases, without re-crawling every album or making a new playlist.
+# The manifest is one JSON file, written atomically (to a temporary file, then renamed over it; see atomic_file.py), so an interrupted save never leaves it half written.
+
+# USAGE
+#    from discography_manifest import DiscographyManifest
+#    discography_manifest = DiscographyManifest()
+#    discography_manifest.record(artist, playlist_name, playlist_description, parts, album_ids, recordings)
+#    discography_manifest.save()
+#    discography.refresh_discography(sp, user_id, artist, discography_manifest)
+
+import copy
+import threading
+import time
+from atomic_file import read_json, write_json_atomically
+
+DEFAULT_MANIFEST_PATH = 'Ansible_for_Spotify_discographies.json'
+
+class DiscographyManifest:
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        # artist ID -> {'name', 'playlist_name', 'playlist_description', 'parts': [[playlist_id, playlist_name, track_count], ..], 'album_ids': [..], 'recordings': [[isrc, title, duration_ms], ..], 'updated_at'}:
+        self.artists = (read_json(path) or {}).get('artists', {})
+
+    # Function: return a copy of the manifest entry of an artist (by ID), or None if there's no discography playlist of the artist recorded.
+    def get(self, artist_id):
+        with self.lock:
+            return copy.deepcopy(self.artists.get(artist_id))
+
+    # Function: record (replacing any earlier one) the discography playlist of artist: its parts (as discography.write_discography_playlists returns them), the artist's album IDs, and the recordings written (see discography.get_written_releases and get_recording).
+    def record(self, artist, playlist_name, playlist_description, parts, album_ids, recordings):
+        with self.lock:
+            self.artists[artist['id']] = {
+                'name': artist['name'],
+                'playlist_name': playlist_name,
+                'playlist_description': playlist_description,
+                'parts': [list(part) for part in parts],
+                'album_ids': list(album_ids),
+                'recordings': [list(recording) for recording in recordings],
+                'updated_at': time.time(),
+            }
+
+    # Function: record new releases appended to an artist's discography playlist: its updated parts, the artist's album IDs (added to those recorded), and the recordings appended.
+    def record_new_releases(self, artist_id, parts, album_ids, recordings):
+        with self.lock:
+            entry = self.artists[artist_id]
+            entry['parts'] = [list(part) for part in parts]
+            known_album_ids = set(entry['album_ids'])
+            entry['album_ids'].extend(album_id for album_id in album_ids if album_id not in known_album_ids)
+            entry['recordings'].extend(list(recording) for recording in recordings)
+            entry['updated_at'] = time.time()
+
+    def save(self):
+        with self.lock:
+            write_json_atomically(self.path, {'artists': self.artists})
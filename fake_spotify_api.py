@@ -0,0 +1,687 @@
+# DESCRIPTION
+# A local stand-in for the Spotify Web API (and its token endpoint), for benchmarking and exercising this repository's code without a Spotify account or network. It serves, from a generated in-memory library, the endpoints Ansible_for_Spotify.py and its modules use: playback state and control, the current user, Liked Songs (saved tracks), playlists and their items (list, add, remove, create), artists' albums, albums (one or several at once) and their tracks, tracks (and their audio features), and track search.
+# The generated library (FakeSpotifyLibrary) is deterministic for a given seed: a few "main" artists with big discographies (including albums with tracks credited to other artists, and deluxe re-releases that repeat an album's tracks with the same ISRCs), plus filler artists whose tracks fill playlists of the requested sizes (by default one of 9,999 tracks: as full as a playlist can be with room to add one more) and Liked Songs.
+# The server (FakeSpotifyAPIServer) adds configurable latency to every response, caps page sizes (to force more pagination), and can inject HTTP 429 (rate limited) responses with a Retry-After header every rate_limit_every requests. It counts requests per endpoint.
+# spotipy clients are pointed at it by setting their prefix attribute to the server's api_prefix (see create_client); a TokenLifecycleManager by passing the server's token_url. The token endpoint can be made to fail (token_error_status) or to answer slowly (token_latency), to exercise refresh failures and timeouts.
+# FakeSpotifyAPIProcess runs the server in a child process, so that its request handling doesn't share the GIL with the code being measured (as the real API doesn't); that process is asked for request counts, and to change its library, over a pipe.
+
+# USAGE
+#    from fake_spotify_api import FakeSpotifyAPIServer
+#    server = FakeSpotifyAPIServer(latency=0.05, max_page_size=50, rate_limit_every=200)
+#    server.start()
+#    sp = server.create_client()
+#    sp.current_playback()
+#    server.print_request_counts()
+#    server.stop()
+# -- or in a child process (with the same interface for request counts and clients; library changes through call_library):
+#    server = FakeSpotifyAPIProcess(latency=0.05).start()
+#    server.call_library('add_album', artist, 'New Album', 10)
+# -- or run it on its own, for example to point Ansible_for_Spotify.py's client at by hand:
+#    python fake_spotify_api.py --port 8777 --latency 0.05
+
+import argparse
+import collections
+import itertools
+import json
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+FAKE_USER_ID = 'fake_user'
+FAKE_ACCESS_TOKEN = 'fake_access_token'
+FAKE_DEVICE_ID = 'fakedevice000000000000'
+
+# Function: return a fake Spotify ID (22 characters, like a real one) for the number-th thing of a kind, e.g. make_id('track', 42) -> 'track00000000000000042'
+def make_id(kind, number):
+    return kind + str(number).zfill(22 - len(kind))
+
+# Function: return the lowercased words of a track or artist name, as the fake search matches them.
+def get_words(text):
+    return re.findall(r'\w+', text.lower())
+
+# Function: return the bare ID from an ID, a URI (spotify:track:ID) or a URL.
+def get_id(id_uri_or_url):
+    return id_uri_or_url.split(':')[-1].split('?')[0].rstrip('/').split('/')[-1]
+
+def make_reference(kind, spotify_id, **fields):
+    return dict({'id': spotify_id, 'type': kind, 'uri': 'spotify:' + kind + ':' + spotify_id, 'external_urls': {'spotify': 'https://open.spotify.com/' + kind + '/' + spotify_id}, 'href': 'https://api.spotify.com/v1/' + kind + 's/' + spotify_id}, **fields)
+
+class FakeSpotifyLibrary:
+    def __init__(self, main_artist_count=4, albums_per_artist=24, tracks_per_album=12, playlist_sizes=(9999, 1000, 100), saved_track_count=3000, filler_tracks_per_album=20, filler_artist_count=100, seed=1):
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.artists = {}
+        self.artist_album_ids = collections.defaultdict(list)
+        self.albums = {}
+        self.album_track_ids = {}
+        self.tracks = {}
+        # search indexes, kept up to date by add_track: ISRC -> track IDs, and word (of a track's name, or of its artists' names) -> track IDs:
+        self.isrc_track_ids = collections.defaultdict(list)
+        self.track_name_word_track_ids = collections.defaultdict(set)
+        self.artist_name_word_track_ids = collections.defaultdict(set)
+        self.playlists = {}
+        self.playlist_items = {}
+        self.saved_tracks = []
+        self.id_counters = collections.defaultdict(itertools.count)
+        self.snapshot_counter = itertools.count(1)
+        self.user = make_reference('user', FAKE_USER_ID, display_name='Fake User', followers={'total': 0}, product='premium')
+        main_artists = [self.add_artist('Fake Artist ' + str(number + 1)) for number in range(main_artist_count)]
+        self.main_artist_ids = [artist['id'] for artist in main_artists]
+        for artist_number, artist in enumerate(main_artists):
+            other_artist = main_artists[(artist_number + 1) % len(main_artists)]
+            previous_album_id = None
+            for album_number in range(albums_per_artist):
+                if album_number % 8 == 7 and previous_album_id:
+                    # a deluxe edition: the previous album's tracks again (new IDs, same ISRCs), plus bonus tracks:
+                    previous_album = self.albums[previous_album_id]
+                    album_id = self.add_album(artist, previous_album['name'] + ' (Deluxe Edition)', 0)
+                    for track_id in self.album_track_ids[previous_album_id]:
+                        track = self.tracks[track_id]
+                        self.add_track(album_id, track['name'], track['artists'], track['duration_ms'], track['external_ids']['isrc'])
+                    for bonus_number in range(2):
+                        self.add_track(album_id, 'Bonus Track ' + str(bonus_number + 1), [artist])
+                elif album_number % 6 == 5:
+                    # a split album: every other track credited only to another artist:
+                    album_id = self.add_album(artist, artist['name'] + ' & ' + other_artist['name'] + ' Split ' + str(album_number + 1), 0, album_artists=[artist, other_artist])
+                    for track_number in range(tracks_per_album):
+                        self.add_track(album_id, 'Split Song ' + str(track_number + 1), [other_artist] if track_number % 2 else [artist])
+                else:
+                    album_id = self.add_album(artist, artist['name'] + ' Album ' + str(album_number + 1), tracks_per_album)
+                    previous_album_id = album_id
+        filler_artists = [self.add_artist('Fake Filler Artist ' + str(number + 1)) for number in range(filler_artist_count)]
+        filler_track_count = max(playlist_sizes + (0,)) + saved_track_count
+        for album_number in range(-(-filler_track_count // filler_tracks_per_album)):
+            artist = filler_artists[album_number % len(filler_artists)]
+            self.add_album(artist, artist['name'] + ' Album ' + str(album_number + 1), filler_tracks_per_album)
+        all_track_ids = list(self.tracks)
+        for playlist_number, playlist_size in enumerate(playlist_sizes):
+            playlist_id = self.create_playlist(FAKE_USER_ID, 'Fake Playlist ' + str(playlist_number + 1) + ' (' + str(playlist_size) + ' tracks)')['id']
+            self.playlist_items[playlist_id] = [self.make_playlist_item(track_id) for track_id in self.random.sample(all_track_ids, min(playlist_size, len(all_track_ids)))]
+        added_at = time.time()
+        for track_id in self.random.sample(all_track_ids, min(saved_track_count, len(all_track_ids))):
+            added_at -= 3600
+            self.saved_tracks.append((track_id, time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(added_at))))
+        # playback starts on the last (smallest) playlist, so the first (biggest) is free to be used as playlist 1:
+        self.playback = {'context_playlist_id': list(self.playlists)[-1] if self.playlists else None, 'index': 0, 'progress_ms': 0, 'started_at': time.time(), 'is_playing': True, 'shuffle_state': False, 'repeat_state': 'off', 'device_id': FAKE_DEVICE_ID}
+
+    def get_next_id(self, kind):
+        return make_id(kind, next(self.id_counters[kind]))
+
+    def add_artist(self, name):
+        artist = make_reference('artist', self.get_next_id('artist'), name=name)
+        self.artists[artist['id']] = artist
+        return artist
+
+    def add_album(self, artist, name, track_count, album_artists=None):
+        album_id = self.get_next_id('album')
+        album_artists = album_artists or [artist]
+        self.albums[album_id] = make_reference('album', album_id, name=name, album_type='album', album_group='album', artists=album_artists, release_date=str(1970 + len(self.albums) % 50), release_date_precision='year', total_tracks=track_count, images=[])
+        self.album_track_ids[album_id] = []
+        for artist_on_album in album_artists:
+            self.artist_album_ids[artist_on_album['id']].append(album_id)
+        for track_number in range(track_count):
+            self.add_track(album_id, name + ' Song ' + str(track_number + 1), [artist])
+        return album_id
+
+    def add_track(self, album_id, name, artists, duration_ms=None, isrc=None):
+        track_id = self.get_next_id('track')
+        album = self.albums[album_id]
+        simplified_album = {key: album[key] for key in ('id', 'type', 'uri', 'external_urls', 'href', 'name', 'album_type', 'artists', 'release_date', 'release_date_precision', 'images')}
+        track_number = len(self.album_track_ids[album_id]) + 1
+        self.tracks[track_id] = make_reference('track', track_id, name=name, artists=[{key: artist[key] for key in ('id', 'type', 'uri', 'external_urls', 'href', 'name')} for artist in artists], album=simplified_album, duration_ms=duration_ms or self.random.randint(120000, 360000), explicit=False, is_local=False, popularity=self.random.randint(0, 100), track_number=track_number, disc_number=1, external_ids={'isrc': isrc or 'QZFAK' + track_id[-7:]})
+        self.album_track_ids[album_id].append(track_id)
+        album['total_tracks'] = len(self.album_track_ids[album_id])
+        with self.lock:
+            self.isrc_track_ids[self.tracks[track_id]['external_ids']['isrc']].append(track_id)
+            for word in get_words(name):
+                self.track_name_word_track_ids[word].add(track_id)
+            for word in get_words(' '.join(artist['name'] for artist in artists)):
+                self.artist_name_word_track_ids[word].add(track_id)
+        return track_id
+
+    def make_playlist_item(self, track_id):
+        return {'added_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'added_by': {'id': FAKE_USER_ID}, 'is_local': False, 'track_id': track_id}
+
+    # Function: return a track's audio features, generated from its ID (so they're the same every time, without being stored), or None for a track that doesn't exist. Every 50th track has none, as some real tracks don't.
+    def get_audio_features(self, track_id):
+        track = self.tracks.get(track_id)
+        if not track or int(track_id[-7:]) % 50 == 49:
+            return None
+        features_random = random.Random(track_id)
+        features = {name: round(features_random.random(), 3) for name in ('acousticness', 'danceability', 'energy', 'instrumentalness', 'liveness', 'speechiness', 'valence')}
+        features.update(id=track_id, type='audio_features', uri=track['uri'], duration_ms=track['duration_ms'], key=features_random.randint(0, 11), mode=features_random.randint(0, 1), time_signature=4, loudness=round(features_random.uniform(-30, -2), 2), tempo=round(features_random.uniform(60, 190), 2))
+        return features
+
+    def get_simplified_track(self, track_id):
+        return {key: value for key, value in self.tracks[track_id].items() if key != 'album'}
+
+    def create_playlist(self, user_id, name, public=True, collaborative=False, description=''):
+        with self.lock:
+            playlist_id = self.get_next_id('playlist')
+            self.playlists[playlist_id] = make_reference('playlist', playlist_id, name=name, owner=self.user, public=public, collaborative=collaborative, description=description, snapshot_id=self.get_next_snapshot_id(), images=[])
+            self.playlist_items[playlist_id] = []
+            return self.get_playlist(playlist_id)
+
+    def get_next_snapshot_id(self):
+        return 'fakesnapshot' + str(next(self.snapshot_counter))
+
+    def get_playlist(self, playlist_id, items_page=None):
+        with self.lock:
+            playlist = dict(self.playlists[playlist_id])
+            tracks = items_page or {'href': playlist['href'] + '/tracks', 'total': len(self.playlist_items[playlist_id])}
+            playlist['tracks'] = tracks
+            playlist['items'] = tracks
+            return playlist
+
+    def get_playlist_item(self, item):
+        track = self.tracks[item['track_id']]
+        return {'added_at': item['added_at'], 'added_by': item['added_by'], 'is_local': False, 'track': track, 'item': track}
+
+    # Function: insert track IDs into a playlist at position (or at the end); returns the new snapshot_id.
+    def add_playlist_items(self, playlist_id, track_ids, position=None):
+        with self.lock:
+            items = self.playlist_items[playlist_id]
+            if len(items) + len(track_ids) > 10000:
+                raise ValueError('Playlist size limit reached')
+            new_items = [self.make_playlist_item(track_id) for track_id in track_ids if track_id in self.tracks]
+            if position is None:
+                items.extend(new_items)
+            else:
+                items[position:position] = new_items
+            return self.set_new_snapshot_id(playlist_id)
+
+    # Function: remove tracks from a playlist: every occurrence, or (for tracks given with positions) only the occurrences at those positions; returns the new snapshot_id.
+    def remove_playlist_items(self, playlist_id, tracks_to_remove):
+        with self.lock:
+            items = self.playlist_items[playlist_id]
+            remove_everywhere = {get_id(track['uri']) for track in tracks_to_remove if 'positions' not in track}
+            remove_at = {(get_id(track['uri']), position) for track in tracks_to_remove for position in track.get('positions', ())}
+            self.playlist_items[playlist_id] = [item for position, item in enumerate(items) if item['track_id'] not in remove_everywhere and (item['track_id'], position) not in remove_at]
+            return self.set_new_snapshot_id(playlist_id)
+
+    def set_new_snapshot_id(self, playlist_id):
+        snapshot_id = self.get_next_snapshot_id()
+        self.playlists[playlist_id]['snapshot_id'] = snapshot_id
+        return snapshot_id
+
+    # Function: return the playback state, advancing through the context playlist as tracks end (as if playing).
+    def get_playback(self):
+        with self.lock:
+            playback = self.playback
+            context_items = self.playlist_items.get(playback['context_playlist_id']) or []
+            if not context_items:
+                return None
+            now = time.time()
+            while True:
+                track = self.tracks[context_items[playback['index'] % len(context_items)]['track_id']]
+                progress_ms = playback['progress_ms'] + (int((now - playback['started_at']) * 1000) if playback['is_playing'] else 0)
+                if progress_ms < track['duration_ms']:
+                    break
+                playback['started_at'] += (track['duration_ms'] - playback['progress_ms']) / 1000
+                playback['progress_ms'] = 0
+                playback['index'] += 1
+            context_playlist = self.playlists[playback['context_playlist_id']]
+            return {
+                'device': {'id': playback['device_id'], 'is_active': True, 'name': 'Fake Spotify Player', 'type': 'Computer', 'volume_percent': 50},
+                'shuffle_state': playback['shuffle_state'],
+                'repeat_state': playback['repeat_state'],
+                'timestamp': int(now * 1000),
+                'context': {'type': 'playlist', 'uri': context_playlist['uri'], 'href': context_playlist['href'], 'external_urls': context_playlist['external_urls']},
+                'progress_ms': progress_ms,
+                'item': track,
+                'currently_playing_type': 'track',
+                'actions': {'disallows': {}},
+                'is_playing': playback['is_playing'],
+            }
+
+    # Function: change playback state (skip by skip tracks, seek, pause / play, or set repeat / shuffle / device).
+    def control_playback(self, skip=0, position_ms=None, is_playing=None, **states):
+        with self.lock:
+            playback_state = self.get_playback()
+            playback = self.playback
+            if playback_state:
+                playback['progress_ms'] = playback_state['progress_ms']
+            playback['started_at'] = time.time()
+            if skip:
+                playback['index'] += skip
+                playback['progress_ms'] = 0
+            if position_ms is not None:
+                playback['progress_ms'] = position_ms
+            if is_playing is not None:
+                playback['is_playing'] = is_playing
+            playback.update(states)
+
+    # Function: return the IDs of tracks matching a search query (as the real API's search, simplified): isrc:<ISRC> matches exactly, and the words of track:<name> and artist:<name> (quoted if several words) and of any other words must all be words of the track's name, its artists' names, or (other words) either; tracks named exactly as searched for come first. Looked up in the search indexes, so a search doesn't scan the library.
+    def search_tracks(self, query):
+        filters = collections.defaultdict(list)
+        for field, quoted_value, value in re.findall(r'(?:(isrc|track|artist):)?(?:"([^"]*)"|(\S+))', query):
+            filters[field or 'any'].append(quoted_value or value)
+        with self.lock:
+            matching_sets = [set(self.isrc_track_ids.get(isrc.upper(), ())) for isrc in filters['isrc']]
+            matching_sets += [self.track_name_word_track_ids.get(word, set()) for name in filters['track'] for word in get_words(name)]
+            matching_sets += [self.artist_name_word_track_ids.get(word, set()) for name in filters['artist'] for word in get_words(name)]
+            matching_sets += [self.track_name_word_track_ids.get(word, set()) | self.artist_name_word_track_ids.get(word, set()) for value in filters['any'] for word in get_words(value)]
+            if not matching_sets:
+                return list(self.tracks)
+            matching_sets.sort(key=len)
+            track_ids = matching_sets[0].intersection(*matching_sets[1:])
+            # tracks named exactly as searched for come first (as the most relevant), then in the order they were added (track IDs are zero-padded numbers):
+            searched_names = [get_words(name) for name in filters['track']]
+            return sorted(track_ids, key=lambda track_id: (any(get_words(self.tracks[track_id]['name']) != words for words in searched_names), track_id))
+
+    def get_saved_track_ids(self):
+        with self.lock:
+            return [track_id for track_id, added_at in self.saved_tracks]
+
+    def save_tracks(self, track_ids):
+        with self.lock:
+            self.remove_saved_tracks(track_ids)
+            added_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            self.saved_tracks[0:0] = [(track_id, added_at) for track_id in track_ids if track_id in self.tracks]
+
+    def remove_saved_tracks(self, track_ids):
+        with self.lock:
+            track_ids = set(track_ids)
+            self.saved_tracks = [saved_track for saved_track in self.saved_tracks if saved_track[0] not in track_ids]
+
+class FakeSpotifyAPIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class FakeSpotifyAPIServer:
+    def __init__(self, library=None, latency=0.0, latency_jitter=0.0, max_page_size=None, rate_limit_every=0, retry_after=1, token_lifetime=3600, token_error_status=None, token_latency=0.0, host='127.0.0.1', port=0):
+        self.library = library or FakeSpotifyLibrary()
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.max_page_size = max_page_size
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        # (both may be changed while the server runs, to make the token endpoint fail or hang, and recover:)
+        self.token_error_status = token_error_status
+        self.token_latency = token_latency
+        self.http_server = ThreadingHTTPServer((host, port), FakeSpotifyAPIRequestHandler)
+        self.http_server.daemon_threads = True
+        self.http_server.fake_api = self
+        self.base_url = 'http://' + host + ':' + str(self.http_server.server_address[1])
+        self.api_prefix = self.base_url + '/v1/'
+        self.token_url = self.base_url + '/api/token'
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.token_request_count = 0
+        self.request_counts = collections.Counter()
+        self.thread = None
+        self.routes = [(method, re.compile('^' + pattern + '$'), handler) for method, pattern, handler in (
+            ('GET', r'me/player', self.get_playback),
+            ('PUT', r'me/player', self.transfer_playback),
+            ('GET', r'me/player/currently-playing', self.get_playback),
+            ('GET', r'me/player/devices', self.get_devices),
+            ('PUT', r'me/player/play', lambda request: self.control_playback(is_playing=True)),
+            ('PUT', r'me/player/pause', lambda request: self.control_playback(is_playing=False)),
+            ('POST', r'me/player/next', lambda request: self.control_playback(skip=1)),
+            ('POST', r'me/player/previous', lambda request: self.control_playback(skip=-1)),
+            ('PUT', r'me/player/seek', lambda request: self.control_playback(position_ms=int(request['query']['position_ms']))),
+            ('PUT', r'me/player/repeat', lambda request: self.control_playback(repeat_state=request['query']['state'])),
+            ('PUT', r'me/player/shuffle', lambda request: self.control_playback(shuffle_state=request['query']['state'] == 'true')),
+            ('GET', r'me', lambda request: self.library.user),
+            ('GET', r'users/([^/]+)', lambda request, user_id: self.library.user),
+            ('GET', r'me/playlists', self.get_current_user_playlists),
+            ('GET', r'users/[^/]+/playlists', self.get_current_user_playlists),
+            ('POST', r'(?:users/[^/]+|me)/playlists', self.create_playlist),
+            ('GET', r'me/tracks', self.get_saved_tracks),
+            ('PUT', r'me/(?:tracks|library)', lambda request: self.library.save_tracks(self.get_request_ids(request))),
+            ('DELETE', r'me/(?:tracks|library)', lambda request: self.library.remove_saved_tracks(self.get_request_ids(request))),
+            ('GET', r'me/(?:tracks|library)/contains', self.get_saved_tracks_contain),
+            ('GET', r'playlists/(\w+)', self.get_playlist),
+            ('PUT', r'playlists/(\w+)', self.change_playlist_details),
+            ('GET', r'playlists/(\w+)/(?:tracks|items)', self.get_playlist_items),
+            ('POST', r'playlists/(\w+)/(?:tracks|items)', self.add_playlist_items),
+            ('DELETE', r'(?:users/[^/]+/)?playlists/(\w+)/(?:tracks|items)', self.remove_playlist_items),
+            ('GET', r'artists', lambda request: {'artists': [self.library.artists.get(artist_id) for artist_id in self.get_request_ids(request)]}),
+            ('GET', r'artists/(\w+)', lambda request, artist_id: self.get_item(self.library.artists, artist_id)),
+            ('GET', r'artists/(\w+)/albums', self.get_artist_albums),
+            ('GET', r'albums', lambda request: {'albums': [self.get_full_album(album_id) if album_id in self.library.albums else None for album_id in self.get_request_ids(request)[:20]]}),
+            ('GET', r'albums/(\w+)', lambda request, album_id: self.get_full_album(album_id)),
+            ('GET', r'albums/(\w+)/tracks', self.get_album_tracks),
+            ('GET', r'tracks', lambda request: {'tracks': [self.library.tracks.get(track_id) for track_id in self.get_request_ids(request)[:50]]}),
+            ('GET', r'tracks/(\w+)', lambda request, track_id: self.get_item(self.library.tracks, track_id)),
+            ('GET', r'audio-features', lambda request: {'audio_features': [self.library.get_audio_features(track_id) for track_id in self.get_request_ids(request)[:100]]}),
+            ('GET', r'search', self.search),
+        )]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.http_server.serve_forever, name='fake_spotify_api', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
+
+    def create_client(self, **kwargs):
+        return create_client(self.api_prefix, **kwargs)
+
+    # Function: call a method of the library (for example add_album, to release a new album), as FakeSpotifyAPIProcess.call_library does.
+    def call_library(self, method_name, *args):
+        return getattr(self.library, method_name)(*args)
+
+    def get_counts(self):
+        with self.lock:
+            return self.request_count, self.rate_limited_count
+
+    # Function: handle one request (method, path relative to /v1/, query dictionary, parsed JSON body); returns (status, headers, JSON-able body or None).
+    def handle(self, method, path, query, body):
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + random.uniform(0, self.latency_jitter))
+        path = path.strip('/')
+        with self.lock:
+            self.request_count += 1
+            is_rate_limited = self.rate_limit_every and self.request_count % self.rate_limit_every == 0
+            if is_rate_limited:
+                self.rate_limited_count += 1
+        if is_rate_limited:
+            return 429, {'Retry-After': str(self.retry_after)}, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                with self.lock:
+                    self.request_counts[method + ' ' + re.sub(r'\w+\d{5,}', '{id}', path)] += 1
+                try:
+                    result = handler({'query': query, 'body': body, 'path': path}, *match.groups())
+                except FakeSpotifyAPIError as e:
+                    return e.status, {}, {'error': {'status': e.status, 'message': e.message}}
+                except (KeyError, ValueError) as e:
+                    return 400, {}, {'error': {'status': 400, 'message': 'Bad request: ' + str(e)}}
+                return (204, {}, None) if result is None else (200, {}, result)
+        return 404, {}, {'error': {'status': 404, 'message': 'Service not found: ' + method + ' ' + path}}
+
+    # Function: handle a request to the token endpoint (any grant), returning a new access token; after token_latency seconds, and with an error of status token_error_status instead, if that's set.
+    def handle_token_request(self):
+        with self.lock:
+            self.token_request_count += 1
+            token_number = self.token_request_count
+        if self.token_latency:
+            time.sleep(self.token_latency)
+        if self.token_error_status:
+            return self.token_error_status, {}, {'error': 'server_error', 'error_description': 'Fake token endpoint failure'}
+        return 200, {}, {'access_token': FAKE_ACCESS_TOKEN + str(token_number), 'token_type': 'Bearer', 'expires_in': self.token_lifetime, 'refresh_token': 'fake_refresh_token', 'scope': ''}
+
+    def get_request_ids(self, request):
+        ids = request['query'].get('ids') or request['query'].get('uris')
+        if ids:
+            return [get_id(spotify_id) for spotify_id in ids.split(',')]
+        body = request['body'] or {}
+        return [get_id(spotify_id) for spotify_id in body.get('ids') or body.get('uris') or []]
+
+    def get_item(self, items, spotify_id):
+        if spotify_id not in items:
+            raise FakeSpotifyAPIError(404, 'Resource not found')
+        return items[spotify_id]
+
+    # Function: return one page (a paging object) of items, with next / previous URLs pointing back at this server. limit is capped by maximum_limit (as the real API does) and by max_page_size (to force more pagination).
+    def get_page(self, request, items, maximum_limit=50, default_limit=20):
+        query = request['query']
+        limit = min(int(query.get('limit') or default_limit), maximum_limit, self.max_page_size or maximum_limit)
+        offset = int(query.get('offset') or 0)
+        def get_page_url(page_offset):
+            return self.api_prefix + request['path'] + '?' + urlencode(dict(query, offset=page_offset, limit=limit))
+        return {
+            'href': get_page_url(offset),
+            'items': items[offset:offset + limit],
+            'limit': limit,
+            'next': get_page_url(offset + limit) if offset + limit < len(items) else None,
+            'offset': offset,
+            'previous': get_page_url(max(offset - limit, 0)) if offset > 0 else None,
+            'total': len(items),
+        }
+
+    def get_playback(self, request):
+        return self.library.get_playback()
+
+    def get_devices(self, request):
+        return {'devices': [{'id': self.library.playback['device_id'], 'is_active': True, 'name': 'Fake Spotify Player', 'type': 'Computer', 'volume_percent': 50}]}
+
+    def transfer_playback(self, request):
+        body = request['body'] or {}
+        self.control_playback(device_id=body['device_ids'][0], is_playing=bool(body.get('play')) or None)
+
+    def control_playback(self, **changes):
+        self.library.control_playback(**changes)
+
+    def get_current_user_playlists(self, request):
+        with self.library.lock:
+            playlists = [self.library.get_playlist(playlist_id) for playlist_id in self.library.playlists]
+        return self.get_page(request, playlists)
+
+    def create_playlist(self, request):
+        body = request['body'] or {}
+        return self.library.create_playlist(FAKE_USER_ID, body['name'], body.get('public', True), body.get('collaborative', False), body.get('description', ''))
+
+    def change_playlist_details(self, request, playlist_id):
+        with self.library.lock:
+            playlist = self.get_item(self.library.playlists, playlist_id)
+            playlist.update({key: value for key, value in (request['body'] or {}).items() if key in ('name', 'public', 'collaborative', 'description')})
+
+    def get_saved_tracks(self, request):
+        with self.library.lock:
+            items = [{'added_at': added_at, 'track': self.library.tracks[track_id]} for track_id, added_at in self.library.saved_tracks]
+        return self.get_page(request, items)
+
+    def get_saved_tracks_contain(self, request):
+        saved_track_ids = set(self.library.get_saved_track_ids())
+        return [track_id in saved_track_ids for track_id in self.get_request_ids(request)]
+
+    def get_playlist(self, request, playlist_id):
+        with self.library.lock:
+            self.get_item(self.library.playlists, playlist_id)
+            # a full playlist includes the first page of its items:
+            items_page = self.get_playlist_items({'path': 'playlists/' + playlist_id + '/tracks', 'query': {'limit': 100}}, playlist_id)
+            return self.library.get_playlist(playlist_id, items_page)
+
+    def get_playlist_items(self, request, playlist_id):
+        with self.library.lock:
+            page = self.get_page(request, self.get_item(self.library.playlist_items, playlist_id), maximum_limit=100, default_limit=100)
+            page['items'] = [self.library.get_playlist_item(item) for item in page['items']]
+            return page
+
+    def add_playlist_items(self, request, playlist_id):
+        self.get_item(self.library.playlists, playlist_id)
+        body = request['body']
+        # newer spotipy versions send a list of URIs (and position in the query), older ones {"uris": [...], "position": N}:
+        uris = body if isinstance(body, list) else (body or {}).get('uris') or request['query'].get('uris', '').split(',')
+        position = request['query'].get('position') if isinstance(body, list) or not body else body.get('position')
+        if len(uris) > 100:
+            raise FakeSpotifyAPIError(400, 'Too many tracks requested; maximum is 100')
+        return {'snapshot_id': self.library.add_playlist_items(playlist_id, [get_id(uri) for uri in uris], None if position is None else int(position))}
+
+    def remove_playlist_items(self, request, playlist_id):
+        self.get_item(self.library.playlists, playlist_id)
+        body = request['body'] or {}
+        tracks_to_remove = body.get('tracks') or body.get('items') or []
+        if len(tracks_to_remove) > 100:
+            raise FakeSpotifyAPIError(400, 'Too many tracks requested; maximum is 100')
+        if body.get('snapshot_id') and body['snapshot_id'] != self.library.playlists[playlist_id]['snapshot_id'] and any('positions' in track for track in tracks_to_remove):
+            raise FakeSpotifyAPIError(400, 'Invalid snapshot_id')
+        return {'snapshot_id': self.library.remove_playlist_items(playlist_id, tracks_to_remove)}
+
+    def get_artist_albums(self, request, artist_id):
+        self.get_item(self.library.artists, artist_id)
+        albums = [{key: value for key, value in self.library.albums[album_id].items()} for album_id in self.library.artist_album_ids[artist_id]]
+        return self.get_page(request, albums)
+
+    def get_full_album(self, album_id):
+        with self.library.lock:
+            album = dict(self.get_item(self.library.albums, album_id))
+            tracks = [self.library.get_simplified_track(track_id) for track_id in self.library.album_track_ids[album_id]]
+            album['tracks'] = self.get_page({'path': 'albums/' + album_id + '/tracks', 'query': {'limit': 50}}, tracks)
+            return album
+
+    def get_album_tracks(self, request, album_id):
+        with self.library.lock:
+            self.get_item(self.library.albums, album_id)
+            tracks = [self.library.get_simplified_track(track_id) for track_id in self.library.album_track_ids[album_id]]
+        return self.get_page(request, tracks)
+
+    # Function: search tracks only (type=track), as the rest of the repository does.
+    def search(self, request):
+        if 'track' not in request['query']['type'].split(','):
+            raise FakeSpotifyAPIError(400, 'Only track search is faked')
+        track_ids = self.library.search_tracks(request['query']['q'])
+        return {'tracks': self.get_page(request, [self.library.tracks[track_id] for track_id in track_ids])}
+
+    def print_request_counts(self):
+        print("~\nFake Spotify API:", self.request_count, "requests,", self.rate_limited_count, "answered 429 (rate limited),", self.token_request_count, "token requests. By endpoint:")
+        for endpoint, count in self.request_counts.most_common():
+            print("  ", endpoint + ":", count)
+
+# Function: return a spotipy client that talks to a fake API at api_prefix (with a fake access token). As in Ansible_for_Spotify.py, the client is told not to retry 429s itself (so a RequestScheduler sees them).
+def create_client(api_prefix, **kwargs):
+    import spotipy
+    from request_scheduler import stop_client_rate_limit_retries
+    kwargs.setdefault('status_forcelist', (500, 502, 503, 504))
+    client = stop_client_rate_limit_retries(spotipy.Spotify(auth=FAKE_ACCESS_TOKEN, **kwargs))
+    client.prefix = api_prefix
+    return client
+
+# Function: (in the child process of a FakeSpotifyAPIProcess) start a server with a library made with library_options, send its api_prefix and token_url over connection, then answer calls, (target 'server' or 'library', method name, arguments), with (True, result) or (False, error), until told to stop.
+def serve_in_process(connection, library_options, server_options):
+    server = FakeSpotifyAPIServer(FakeSpotifyLibrary(**library_options), **server_options).start()
+    connection.send((server.api_prefix, server.token_url))
+    while True:
+        target_name, method_name, args = connection.recv()
+        if method_name == 'stop':
+            server.stop()
+            connection.send((True, None))
+            return
+        try:
+            result = (True, getattr(server.library if target_name == 'library' else server, method_name)(*args))
+        except Exception as e:
+            result = (False, e)
+        # (anything the call printed shows before the parent goes on:)
+        sys.stdout.flush()
+        connection.send(result)
+
+class FakeSpotifyAPIProcess:
+    def __init__(self, library_options=None, **server_options):
+        self.library_options = library_options or {}
+        self.server_options = server_options
+        # a copy of the library the server starts from (the library is deterministic for its options), for looking up what was generated without asking the server. Changes made through the API, or call_library, are only made to the server's:
+        self.library = None
+        self.process = None
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_in_process, args=(child_connection, self.library_options, self.server_options), name='fake_spotify_api', daemon=True)
+        self.process.start()
+        self.library = FakeSpotifyLibrary(**self.library_options)
+        self.api_prefix, self.token_url = self.connection.recv()
+        return self
+
+    # Function: call method_name(*args) of the server ('server') or its library ('library') in the child process, and return the result (or raise its error).
+    def call(self, target_name, method_name, *args):
+        with self.lock:
+            self.connection.send((target_name, method_name, args))
+            is_success, result = self.connection.recv()
+        if not is_success:
+            raise result
+        return result
+
+    # Function: call a method of the server's library (for example add_album, to release a new album).
+    def call_library(self, method_name, *args):
+        return self.call('library', method_name, *args)
+
+    @property
+    def request_count(self):
+        return self.call('server', 'get_counts')[0]
+
+    @property
+    def rate_limited_count(self):
+        return self.call('server', 'get_counts')[1]
+
+    def create_client(self, **kwargs):
+        return create_client(self.api_prefix, **kwargs)
+
+    def print_request_counts(self):
+        self.call('server', 'print_request_counts')
+
+    def stop(self):
+        self.call('server', 'stop')
+        self.process.join()
+
+class FakeSpotifyAPIRequestHandler(BaseHTTPRequestHandler):
+    # keep connections alive, as the real API does (requests sessions reuse them) :
+    protocol_version = 'HTTP/1.1'
+    # send headers and body without waiting (Nagle's algorithm would otherwise hold the body back, adding ~40 ms to responses) :
+    disable_nagle_algorithm = True
+
+    def handle_request(self, method):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        content_length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(content_length) if content_length else b''
+        fake_api = self.server.fake_api
+        if url.path.rstrip('/') == '/api/token' and method == 'POST':
+            status, headers, body = fake_api.handle_token_request()
+        elif not url.path.startswith('/v1/'):
+            status, headers, body = 404, {}, {'error': {'status': 404, 'message': 'Not found'}}
+        elif not (self.headers.get('Authorization') or '').startswith('Bearer '):
+            status, headers, body = 401, {}, {'error': {'status': 401, 'message': 'No token provided'}}
+        else:
+            try:
+                request_body = json.loads(raw_body) if raw_body else None
+            except ValueError:
+                request_body = None
+            status, headers, body = fake_api.handle(method, url.path[len('/v1/'):], query, request_body)
+        response_body = b'' if body is None else json.dumps(body).encode('UTF-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local fake Spotify Web API server.')
+    parser.add_argument('--port', type=int, default=8777)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='up to this many more seconds, at random')
+    parser.add_argument('--max-page-size', type=int, default=None, help='cap on items per page')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with HTTP 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds of injected 429s (whole seconds, as the real API sends)')
+    arguments = parser.parse_args()
+    server = FakeSpotifyAPIServer(latency=arguments.latency, latency_jitter=arguments.latency_jitter, max_page_size=arguments.max_page_size, rate_limit_every=arguments.rate_limit_every, retry_after=arguments.retry_after, port=arguments.port)
+    print("Fake Spotify API serving at", server.api_prefix, "(token endpoint", server.token_url + ") ; Ctrl+C to stop.")
+    try:
+        server.http_server.serve_forever()
+    except KeyboardInterrupt:
+        server.print_request_counts()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+# DESCRIPTION
+# The playback and library hotkey functions of Ansible_for_Spotify.py (next / previous track, pause or start, repeat, shuffle, seek, save / unsave, add to playlist 1, remove from the current playlist, move to discards), with what they use (the API client, library database, Liked Songs cache, playback state service, metadata cache, playlist 1 and discards playlist IDs) passed in rather than read from the script's globals. That script runs everything at import (hotkeys, info window), so these live here to be importable: benchmark_offline.py runs these same functions against a local fake API.
+# The script binds its hotkeys to these methods (which keep the names of the functions they were, so API call statistics and hotkey latencies are recorded under the same names).
+
+# USAGE
+#    from hotkey_actions import HotkeyActions
+#    hotkey_actions = HotkeyActions(sp, library_database, saved_tracks_cache, playback_state_service, metadata_cache, PLAYLIST_ID_1, DISCARDS_PLAYLIST_ID, update_info_window)
+#    hotkey_actions.next_track(2)
+#    hotkey_actions.add_current_track_to_playlist_1()
+#    hotkey_actions.playlist_id_1 = playlist_ID    # e.g. when the set playlist 1 hotkey sets it
+
+from concurrent.futures import ThreadPoolExecutor
+import pagination
+
+REPEAT_MODES = ['track', 'context', 'off']
+SHUFFLE_STATES = [True, False]
+# At most this many skips of a burst are in flight at once:
+PIPELINED_CALLS = 8
+
+class HotkeyActions:
+    # library_database may be None, in which case add_current_track_to_playlist_1 checks playlist 1 by paging through it from the API (benchmark_offline.py compares the two); the other library hotkeys need it. update_info_window(CLI_print, expect_track_change) is called after hotkeys that change playback, or else a refresh is requested from playback_state_service.
+    def __init__(self, sp, library_database, saved_tracks_cache, playback_state_service, metadata_cache, playlist_id_1=None, discards_playlist_id=None, update_info_window=None):
+        self.sp = sp
+        self.library_database = library_database
+        self.saved_tracks_cache = saved_tracks_cache
+        self.playback_state_service = playback_state_service
+        self.metadata_cache = metadata_cache
+        self.playlist_id_1 = playlist_id_1
+        self.discards_playlist_id = discards_playlist_id
+        self.on_update_info_window = update_info_window
+
+    def update_info_window(self, CLI_print = False, expect_track_change = False):
+        if self.on_update_info_window:
+            self.on_update_info_window(CLI_print = CLI_print, expect_track_change = expect_track_change)
+        else:
+            self.playback_state_service.request_refresh(CLI_print, expect_track_change = expect_track_change)
+
+    # Function to find an active device. Returns the first active device's ID or None if no devices are found.
+    def find_active_device(self):
+        try:
+            devices = self.sp.devices()  # Retrieve all available devices
+            # print("Devices List:", devices)
+            for device in devices.get('devices', []):
+                if device.get('is_active') or device.get('id'):
+                    # print("Active Device Found:", device['name'], device['id'])
+                    return device['id']  # Return the first active device's ID
+            print("No active devices found.")
+            return None
+        except Exception as e:
+            print("Error finding active device:", e)
+            return None
+
+    # Function to switch playback to a specified device using its ID
+    def switch_to_device(self, device_id):
+        try:
+            self.sp.transfer_playback(device_id=device_id, force_play=True)
+            print(f"Playback transferred to device: {device_id}")
+        except Exception as e:
+            print("Error transferring playback:", e)
+
+    # Function: pause or start playback, using other functions to find and switch to an active player if no player found:
+    def pause_or_start_playback(self):
+        try:
+            playback = self.sp.current_playback()
+            if not playback:  # If there's no playback context, find and switch to an active device
+                print("No active player found. Searching for active devices...")
+                active_device_id = self.find_active_device()
+                if active_device_id:
+                    self.switch_to_device(active_device_id)
+                else:
+                    print("No active device available. Cannot resume playback.")
+                    return
+
+            if playback and playback['is_playing']:
+                self.sp.pause_playback()
+            else:
+                self.sp.start_playback()
+                # end any suspension of playback state polling (see playback_state_service.py) :
+                self.playback_state_service.resume()
+        except Exception as e:
+            print("~\nWARNING: no information retrieved for current_playback. If you're playing a device, maybe play and pause the player manually, then retry control from this script.")
+            print(e)
+        self.update_info_window()
+
+    # Function: call function (an API call without arguments) times times, with up to PIPELINED_CALLS of the calls in flight at once instead of one after another, so a burst of skips takes about one round trip rather than one per skip (skips don't depend on each other's order). The calls are attributed to, and made at the priority of, the hotkey calling this.
+    def call_pipelined(self, function, times):
+        if times == 1:
+            function()
+            return
+        context = self.sp.get_context() if hasattr(self.sp, 'get_context') else None
+        def call_in_context(call_number):
+            if context is None:
+                return function()
+            with self.sp.in_context(context):
+                return function()
+        with ThreadPoolExecutor(max_workers = min(times, PIPELINED_CALLS), thread_name_prefix = 'hotkey_pipeline') as executor:
+            # (list() to raise the first failed call's error here:)
+            list(executor.map(call_in_context, range(times)))
+
+    # Function: jump playback to previous track, times times (repeated presses of the hotkey are combined into one call, whose skips are pipelined; see action_dispatcher.py)
+    def previous_track(self, times = 1):
+        self.call_pipelined(self.sp.previous_track, times)
+        self.update_info_window(expect_track_change = True)
+
+    # Function: advance playback to next track, times times
+    def next_track(self, times = 1):
+        self.call_pipelined(self.sp.next_track, times)
+        self.update_info_window(expect_track_change = True)
+
+    # Function: save currently playing track to user library ("like" current song)
+    def save_track(self):
+        info = self.sp.current_user_playing_track()
+        try:
+            playlist_ID = info['context']['external_urls']['spotify']
+            track_ID = info['item']['external_urls']['spotify']
+            list_of_track_IDs = [track_ID]
+            self.sp.current_user_saved_tracks_add(list_of_track_IDs)
+            self.library_database.record_saved_tracks_added(list_of_track_IDs)
+            self.saved_tracks_cache.add(list_of_track_IDs)
+            print("Saved currently playing track", list_of_track_IDs, "to Liked Songs.")
+            print("Attempted confirm:")
+            self.update_info_window(CLI_print = True)
+        except Exception as e:
+            print("~\nCould not save current track (could not add to Liked Songs).")
+            print(e)
+
+    def unsave_track(self):
+        info = self.sp.current_user_playing_track()
+        try:
+            playlist_ID = info['context']['external_urls']['spotify']
+            track_ID = info['item']['external_urls']['spotify']
+            list_of_track_IDs = [track_ID]
+            self.sp.current_user_saved_tracks_delete(list_of_track_IDs)
+            self.library_database.record_saved_tracks_removed(list_of_track_IDs)
+            self.saved_tracks_cache.discard(list_of_track_IDs)
+            print("Remove currently playing track", list_of_track_IDs, "from Liked Songs.")
+            print("Attempted confirmation:")
+            self.update_info_window(CLI_print = True)
+        except Exception as e:
+            print("~\nCould not unsave current track (could not add to Liked Songs).")
+            print(e)
+
+    # Function: return the current playback state from the playback state service's locally maintained snapshot (with progress extrapolated; no API call), or from the API if there's no snapshot yet.
+    def get_current_playback(self):
+        playback = self.playback_state_service.get_playback()
+        if playback == None:
+            playback = self.sp.current_playback()
+        return playback
+
+    # change repeat mode; cycles from current to previous mode and wraps around; e.g. no repeat, playlist repeat, then track repeat. steps is how many times to cycle (repeated presses of the hotkey are combined) :
+    def change_repeat_mode(self, steps = 1):
+        retrieved_playback_state = self.get_current_playback()['repeat_state']
+        current_repeat_mode_idx = REPEAT_MODES.index(retrieved_playback_state)
+        current_repeat_mode_idx = (current_repeat_mode_idx - steps) % len(REPEAT_MODES)
+        state_parameter = REPEAT_MODES[current_repeat_mode_idx]
+        self.sp.repeat(state_parameter)
+        self.playback_state_service.apply_optimistic_update(repeat_state = state_parameter)
+
+    # toggle shuffle times times (repeated presses of the hotkey are combined, so an even number of presses does nothing) :
+    def toggle_playback_shuffle(self, times = 1):
+        if times % 2 == 0:
+            return
+        retrieved_playback_state = self.get_current_playback()['shuffle_state']
+        current_shuffle_state_idx = SHUFFLE_STATES.index(retrieved_playback_state)
+        current_shuffle_state_idx += 1
+        if current_shuffle_state_idx > 1:
+            current_shuffle_state_idx = 0
+        state_parameter = SHUFFLE_STATES[current_shuffle_state_idx]
+        self.sp.shuffle(state_parameter)
+        self.playback_state_service.apply_optimistic_update(shuffle_state = state_parameter)
+
+    # set playback position to start of current track
+    def seek_to_track_start(self):
+        self.sp.seek_track(0)
+        self.playback_state_service.apply_optimistic_update(progress_ms = 0)
+
+    # set playback position forward or backward by seek_ms (milleseconds, negative or positive)
+    def relative_seek(self, seek_ms):
+        # nested function call here: set current playback progress to current + ms (with ms neg. or positive)
+        new_seek_ms_pos = int(self.get_current_playback()['progress_ms']) + seek_ms
+        # set that to zero if it's negative, to avoid error:
+        if new_seek_ms_pos < 0:
+            new_seek_ms_pos = 0
+        self.sp.seek_track(new_seek_ms_pos)
+        self.playback_state_service.apply_optimistic_update(progress_ms = new_seek_ms_pos)
+
+    # Print information related to currenlty playing track. Also a gatekeeper function returning False if no playing track, and True and a playback info object from sp.current_user_playing_track(). Pass info if the caller already has it, to save an API call.
+    def print_current_track_information(self, info = None):
+        try:
+            if info == None:
+                info = self.sp.current_user_playing_track()
+            track_URL = info['item']['external_urls']['spotify']
+            artists = info['item']['artists']
+            print("Current track URL (ends with ID) :", track_URL)
+            print("Artist(s):")
+            for artist in artists:
+                print("\t", artist['name'])
+            album = info['item']['album']['name']
+            track_name = info['item']['name']
+            print("Album:\t", album)
+            print("Track:\t", track_name)
+            return True
+        except Exception as e:
+            print("No current track context, or not found, or other API error?")
+            print(e)
+            return False
+
+    def print_playlist_1_info(self):
+        if self.playlist_id_1:
+            print("~\nPlaylist 1 ID:", self.playlist_id_1)
+            try:
+                playlist_name = self.metadata_cache.get_playlist_name(self.playlist_id_1)
+                print("  name:", playlist_name)
+            except Exception as e:
+                print("~\nCouldn't obtain playlist information from current context somehow, or other error?")
+                print(e)
+        else:
+            print("~\nno PLAYLIST_ID_1 is set.")
+
+    # Append the currently playing track to playlist 1, if playlist 1 is defined, and only if the track is not already on it.
+    def add_current_track_to_playlist_1(self):
+        if self.playlist_id_1 == None:
+            print("Can't move anything to playlist 1: playlist 1 not defined.")
+            return False
+        else:
+            # get currently playing track:
+            info = self.sp.current_user_playing_track()
+            track_id_to_add = info['item']['external_urls']['spotify']
+            list_of_track_IDs = [track_id_to_add]
+            self.print_current_track_information(info)
+            # get info of target playlist to parse:
+            # prior, deprecated track retrieve method; seems I couldn't paginate with it though:
+            # items = sp.playlist(PLAYLIST_ID_1)['tracks']['items']
+            # last track of prev dev ref.: https://open.spotify.com/track/7tfZ04mgD2fNU2dQ1SrMzG
+            # check the local library database for whether the track is already in the target playlist; that re-downloads the playlist only if its snapshot_id changed since the last sync:
+            already_in_playlist = None
+            if self.library_database:
+                try:
+                    self.library_database.sync_playlist(self.playlist_id_1)
+                    already_in_playlist = self.library_database.playlist_contains(self.playlist_id_1, track_id_to_add)
+                except Exception as e:
+                    print("Could not check local library database for whether track is already in playlist 1; will check playlist from API.")
+                    print(e)
+            if already_in_playlist == True:
+                print("That's already in the target playlist! Not adding.")
+                return False
+            elif already_in_playlist == False:
+                # (the local copy was just synced, so its snapshot_id is the playlist's just before the add:)
+                expected_snapshot_id = self.library_database.get_snapshot_id(self.playlist_id_1)
+                result = self.sp.playlist_add_items(self.playlist_id_1, list_of_track_IDs)
+                self.library_database.record_tracks_added(self.playlist_id_1, list_of_track_IDs, result['snapshot_id'], expected_snapshot_id)
+                print("ADDED track to playlist ID", self.playlist_id_1)
+                self.print_playlist_1_info()
+                return True
+            print("Retrieving all tracks in target playlist to determine whether track proposed to add is already in playlist . .")
+            # pages are fetched lazily (each next page while the one before it is checked), and no more are fetched once the track is found:
+            for item in pagination.iterate_items(self.sp, self.sp.playlist_tracks(self.playlist_id_1, fields=None, limit=100, offset=0, market=None)):
+                track_from_target_list = (item['track'] or {}).get('external_urls', {}).get('spotify')
+                if track_from_target_list == track_id_to_add:
+                    print('track_from_target_list', track_from_target_list, " == track_id_to_add ", track_id_to_add)
+                    print("That's already in the target playlist! Not adding.")
+                    return False
+            # if the check for whether it's already in the list never returned False, we're good to add the track, and this code will do so:
+            # this function call adds to the end of a playlist by default, and we're doing that:
+            self.sp.playlist_add_items(self.playlist_id_1, list_of_track_IDs)
+            print("ADDED track to playlist ID", self.playlist_id_1)
+            self.print_playlist_1_info()
+            return True
+
+    # function: remove the current song from the current playlist
+    def remove_current_track_from_current_playlist(self):
+        info = self.sp.current_user_playing_track()
+        try:
+            playlist_ID = info['context']['external_urls']['spotify']
+            track_ID = info['item']['external_urls']['spotify']
+            list_of_track_IDs = [track_ID]
+            print("~\nIn a playlist context; will remove currently playing track from the current playlist.")
+                    # , and play the next song in the playlist
+            print("Current playlist ID:", playlist_ID)
+            print("track ID:", track_ID)
+            # (the playlist's snapshot_id just before the change, so the library database only mirrors it onto the copy it was made to:)
+            expected_snapshot_id = self.library_database.fetch_snapshot_id(playlist_ID)
+            result = self.sp.playlist_remove_all_occurrences_of_items(playlist_ID, list_of_track_IDs)
+            self.library_database.record_tracks_removed(playlist_ID, list_of_track_IDs, result['snapshot_id'], expected_snapshot_id)
+            # I've gone back and forth on wanting the following; now I don't :p
+            # sp.next_track()
+        except Exception as e:
+            print("~\nRemove current track from current playlist: cannot; no playlist context.")
+            print(e)
+
+    def shuffle_current_track_to_playlist_1(self):
+        try:
+            proceed = self.add_current_track_to_playlist_1()
+            if proceed:
+                self.remove_current_track_from_current_playlist()
+            else:
+                print("~\nConditions said don't add to playlist 1; didn't move anything.")
+        except Exception as e:
+            print("~\nFailure shuffling current track to playlist 1 from current list.")
+            print(e)
+
+    # Function: if in a playlist context, add currently playing track to discards playlist, remove it from currently playing playlist and user library (liked songs), and play the next song in the playlist.
+    def unsave_and_move_from_current_playlist_to_discards(self):
+        info = self.sp.current_user_playing_track()
+        try:
+            playlist_ID = info['context']['external_urls']['spotify']
+            print("~\nDiscards playlist ID:", self.discards_playlist_id)
+            print("Current playlist ID:", playlist_ID)
+            self.print_current_track_information(info)
+            track_ID = info['item']['external_urls']['spotify']
+            list_of_track_IDs = [track_ID]
+            # (the playlists' snapshot_ids just before the changes, so the library database only mirrors them onto the copies they were made to:)
+            expected_snapshot_id = self.library_database.fetch_snapshot_id(self.discards_playlist_id)
+            result = self.sp.playlist_add_items(self.discards_playlist_id, list_of_track_IDs)
+            self.library_database.record_tracks_added(self.discards_playlist_id, list_of_track_IDs, result['snapshot_id'], expected_snapshot_id)
+            self.sp.current_user_saved_tracks_delete(list_of_track_IDs)
+            self.library_database.record_saved_tracks_removed(list_of_track_IDs)
+            self.saved_tracks_cache.discard(list_of_track_IDs)
+            expected_snapshot_id = self.library_database.fetch_snapshot_id(playlist_ID)
+            result = self.sp.playlist_remove_all_occurrences_of_items(playlist_ID, list_of_track_IDs)
+            self.library_database.record_tracks_removed(playlist_ID, list_of_track_IDs, result['snapshot_id'], expected_snapshot_id)
+            print("Added current track to discards playlist, removed it from current playlist and from liked songs, and will play the next song in the playlist.")
+            print("Attempted confirm:")
+            self.sp.next_track()
+            self.update_info_window(CLI_print = True, expect_track_change = True)
+        except Exception as e:
+            print("~\nUnsave and shuffle current track to discard playlist: no playlist context; cannot remove currently playing track from any playlist. Printing the error response:")
+            print(e)
@@ -0,0 +1,208 @@
+# DESCRIPTION
+# A wrapper around a spotipy.Spotify client that records, for every API method called through it (current_playback, playlist_tracks, album_tracks, ...), how many calls were made, their latency percentiles, response bytes, retries (made by the HTTP layer) and errors by class. Every call is also attributed to an operation: the hotkey function that triggered it (see attributed_to), or else the name of the thread it ran on.
+# Calls made with sp.next(results) are recorded as "next <path of the page>", with IDs in the path replaced by {id}, so pagination is attributed to the endpoint being paged.
+# Statistics can be printed as a table and appended to a JSONL file.
+# Instead of a client, a client_factory (a function returning a client) may be passed, in which case the client is only created on first use (or by calling get_client), so that importing spotipy and setting up authorization can be deferred (for example to a background thread at startup).
+# If a RequestScheduler is passed, every call goes through it (see request_scheduler.py): calls attributed to a hotkey run at INTERACTIVE priority, and other calls at the priority operation_priorities gives their operation (thread) name, or BACKGROUND. Calls of NON_IDEMPOTENT_METHODS are only retried when rate limited. Retries made by the scheduler are counted in the statistics too.
+
+# USAGE
+#    from instrumented_spotify import InstrumentedSpotify
+#    sp = InstrumentedSpotify(spotipy.Spotify(auth_manager=AUTH_MANAGER))
+# -- or, with a request scheduler:
+#    sp = InstrumentedSpotify(stop_client_rate_limit_retries(spotipy.Spotify(auth_manager=AUTH_MANAGER, status_forcelist=(500, 502, 503, 504))), RequestScheduler(), {'discography_albums': BULK})
+#    with sp.attributed_to('next_track'):
+#        sp.next_track()
+#    sp.print_statistics()
+#    sp.dump_jsonl('Ansible_for_Spotify_api_stats.jsonl')
+
+import collections
+import contextlib
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+from request_scheduler import INTERACTIVE, BACKGROUND
+
+# spotipy methods whose calls aren't idempotent (repeating one repeats its effect: POSTs, and the position-based reorders and removals), which the request scheduler only retries when rate limited:
+NON_IDEMPOTENT_METHODS = frozenset(['playlist_add_items', 'user_playlist_add_tracks', 'user_playlist_add_episodes', 'user_playlist_create', 'playlist_reorder_items', 'user_playlist_reorder_tracks', 'playlist_remove_specific_occurrences_of_items', 'user_playlist_remove_specific_occurrences_of_tracks', 'add_to_queue', 'next_track', 'previous_track'])
+# Spotify IDs are 22 base-62 characters; user IDs in paths may be anything, so they are matched by the path segment before them:
+SPOTIFY_ID_PATTERN = re.compile(r'/[0-9A-Za-z]{22}(?=/|$)')
+USER_ID_PATTERN = re.compile(r'/users/[^/]+')
+
+class EndpointStatistics:
+    def __init__(self, latency_history_length=1000):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.latencies = collections.deque(maxlen=latency_history_length)
+        self.response_bytes = 0
+        self.retries = 0
+        self.errors = collections.Counter()
+
+    def get_summary(self):
+        sorted_latencies = sorted(self.latencies)
+        def percentile(fraction):
+            if not sorted_latencies:
+                return None
+            return round(sorted_latencies[min(int(len(sorted_latencies) * fraction), len(sorted_latencies) - 1)] * 1000, 1)
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_seconds * 1000, 1),
+            'p50_ms': percentile(0.5),
+            'p90_ms': percentile(0.9),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(sorted_latencies[-1] * 1000, 1) if sorted_latencies else None,
+            'bytes': self.response_bytes,
+            'retries': self.retries,
+            'errors': dict(self.errors),
+        }
+
+class InstrumentedSpotify:
+    def __init__(self, client=None, scheduler=None, operation_priorities=None, client_factory=None):
+        self.client = None
+        self.client_factory = client_factory
+        self.client_lock = threading.Lock()
+        self.scheduler = scheduler
+        self.operation_priorities = operation_priorities or {}
+        self.statistics = collections.defaultdict(EndpointStatistics)
+        self.statistics_lock = threading.Lock()
+        self.local = threading.local()
+        self.start_time = time.time()
+        if client is not None:
+            self.set_client(client)
+
+    def set_client(self, client):
+        session = getattr(client, '_session', None)
+        if session is not None:
+            session.hooks['response'].append(self.record_response)
+        self.client = client
+
+    # Function: return the wrapped client, creating it with client_factory first if it hasn't been yet (callers on other threads wait for that).
+    def get_client(self):
+        if self.client is None:
+            with self.client_lock:
+                if self.client is None:
+                    self.set_client(self.client_factory())
+        return self.client
+
+    # Function: context manager attributing every call made on this thread inside it to operation_name (for example the hotkey function being run).
+    @contextlib.contextmanager
+    def attributed_to(self, operation_name):
+        previous_operation_name = getattr(self.local, 'operation_name', None)
+        self.local.operation_name = operation_name
+        try:
+            yield
+        finally:
+            self.local.operation_name = previous_operation_name
+
+    # Function: return the operation calls on this thread are attributed to: whatever attributed_to set, or the operation of the thread in_context was given, or else the thread's name (without the _N worker number thread pools add).
+    def get_operation_name(self):
+        operation_name = getattr(self.local, 'operation_name', None)
+        if operation_name:
+            return operation_name
+        context = getattr(self.local, 'context', None)
+        if context:
+            return context[0]
+        return re.sub(r'_\d+$', '', threading.current_thread().name)
+
+    # Function: return the request scheduler priority of calls on this thread: INTERACTIVE inside attributed_to, otherwise the priority of the thread in_context was given, or from operation_priorities by operation (thread) name.
+    def get_priority(self):
+        if getattr(self.local, 'operation_name', None):
+            return INTERACTIVE
+        context = getattr(self.local, 'context', None)
+        if context:
+            return context[1]
+        return self.operation_priorities.get(self.get_operation_name(), BACKGROUND)
+
+    # Function: return the operation and priority of calls on this thread, for in_context on a helper thread.
+    def get_context(self):
+        return (self.get_operation_name(), self.get_priority())
+
+    # Function: context manager making calls on this thread inside it as if they were made on the thread context (from get_context) came from: attributed to the same operation, at the same priority. For helper threads, such as those prefetching pages (see pagination.py).
+    @contextlib.contextmanager
+    def in_context(self, context):
+        previous_context = getattr(self.local, 'context', None)
+        self.local.context = context
+        try:
+            yield
+        finally:
+            self.local.context = previous_context
+
+    def __getattr__(self, name):
+        attribute = getattr(self.get_client(), name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        def instrumented_call(*args, **kwargs):
+            endpoint_name = name
+            if name in ('next', 'previous') and args and args[0]:
+                endpoint_name = name + ' ' + get_endpoint_path(args[0].get(name) or '')
+            return self.call(endpoint_name, attribute, *args, **kwargs)
+        instrumented_call.__name__ = name
+        return instrumented_call
+
+    # Function: call function, recording the call under (operation, endpoint_name).
+    def call(self, endpoint_name, function, *args, **kwargs):
+        key = (self.get_operation_name(), endpoint_name)
+        self.local.current_key = key
+        start_time = time.perf_counter()
+        try:
+            if self.scheduler is None:
+                return function(*args, **kwargs)
+            return self.scheduler.run(self.get_priority(), function, *args, on_retry=lambda: self.record_retry(endpoint_name), idempotent=endpoint_name not in NON_IDEMPOTENT_METHODS, **kwargs)
+        except Exception as e:
+            error_name = type(e).__name__
+            if getattr(e, 'http_status', None):
+                error_name += ' ' + str(e.http_status)
+            with self.statistics_lock:
+                self.statistics[key].errors[error_name] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start_time
+            self.local.current_key = None
+            with self.statistics_lock:
+                statistics = self.statistics[key]
+                statistics.count += 1
+                statistics.total_seconds += elapsed
+                statistics.latencies.append(elapsed)
+
+    # Function: requests response hook, which records response size and retries (made by urllib3 under the requests session) of the call in progress on this thread.
+    def record_response(self, response, *args, **kwargs):
+        key = getattr(self.local, 'current_key', None)
+        if key is None:
+            return
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', None) or ()
+        with self.statistics_lock:
+            self.statistics[key].response_bytes += len(response.content or b'')
+            self.statistics[key].retries += len(retries)
+
+    # Function: record a retry made above the HTTP layer (for example by code that retries a failed call itself).
+    def record_retry(self, endpoint_name):
+        with self.statistics_lock:
+            self.statistics[(self.get_operation_name(), endpoint_name)].retries += 1
+
+    # Function: return a list of summary dictionaries, one per (operation, endpoint), most total time first.
+    def get_statistics(self):
+        with self.statistics_lock:
+            rows = [dict(operation=operation, endpoint=endpoint, **statistics.get_summary()) for (operation, endpoint), statistics in self.statistics.items()]
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+    def print_statistics(self):
+        rows = self.get_statistics()
+        print("~\nAPI calls since startup (" + str(round(time.time() - self.start_time)) + " s), by operation and endpoint, most total time first:")
+        print("  operation / endpoint: count, total ms, p50 / p90 / p99 / max ms, bytes, retries, errors")
+        for row in rows:
+            print("  ", row['operation'], "/", row['endpoint'] + ":", row['count'], row['total_ms'], str(row['p50_ms']) + " / " + str(row['p90_ms']) + " / " + str(row['p99_ms']) + " / " + str(row['max_ms']), row['bytes'], row['retries'], row['errors'] or '')
+
+    # Function: append the current statistics to a JSONL file, one line per (operation, endpoint), each stamped with the time of the dump.
+    def dump_jsonl(self, path):
+        dump_time = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(path, 'a', encoding='UTF-8') as jsonl_file:
+            for row in self.get_statistics():
+                jsonl_file.write(json.dumps(dict(time=dump_time, **row)) + '\n')
+
+# Function: return the path of an API URL, relative to the API version, with IDs replaced by {id}; e.g. https://api.spotify.com/v1/playlists/37i9dQZF1DXcBWIGoYBM5M/tracks?offset=100 -> /playlists/{id}/tracks
+def get_endpoint_path(url):
+    path = urlparse(url).path
+    path = re.sub(r'^/v1', '', path)
+    path = USER_ID_PATTERN.sub('/users/{id}', path)
+    return SPOTIFY_ID_PATTERN.sub('/{id}', path)
@@ -0,0 +1,290 @@
+# DESCRIPTION
+# A local synced database (SQLite) mirroring the user's playlists and Liked Songs, so that library lookups such as "is this track already in playlist 1?" are indexed local queries instead of paging through a whole playlist over the Web API.
+# Every playlist's snapshot_id is stored with it; a sync only re-downloads the tracks of playlists whose snapshot_id changed since the last sync. Liked Songs have no snapshot_id, so they are only re-downloaded if the total count or the most recently added track changed (the first page marker). Saves and unsaves this script makes are applied to the stored rows and the marker together, so they don't cause a re-download; a change made elsewhere leaves the marker different from the first page, which does.
+# Changes this script makes to a playlist are mirrored onto its local copy (by the record_* methods) only if that copy is the one they were made to, that is, its snapshot_id is the playlist's from just before the change; otherwise the copy's snapshot_id is forgotten, so the next sync re-downloads it.
+
+# USAGE
+# From another script that has a spotipy client (sp) :
+#    from library_database import LibraryDatabase
+#    library_database = LibraryDatabase(sp)
+#    library_database.sync()
+#    library_database.playlist_contains(PLAYLIST_ID_1, track_ID)
+# The sp object may be any spotipy.Spotify client, including one pointed at a local fake API (by setting its prefix attribute to that server's URL), which is how this can be exercised without a Spotify account.
+
+import sqlite3
+import threading
+import time
+import pagination
+
+DEFAULT_DATABASE_PATH = 'Ansible_for_Spotify_library.db'
+
+# Function: return the bare Spotify ID from an ID, a URI (spotify:track:ID) or a URL (https://open.spotify.com/track/ID?si=..). The main script passes URLs around as IDs in many places, but the database only stores bare IDs.
+def get_spotify_id(id_uri_or_url):
+    if id_uri_or_url is None:
+        return None
+    value = str(id_uri_or_url)
+    if value.startswith('spotify:'):
+        return value.split(':')[-1]
+    if '/' in value:
+        value = value.split('?')[0].rstrip('/')
+        return value.split('/')[-1]
+    return value
+
+# Function: return the Liked Songs first page marker: the total number of items, and the ID of the most recently added track.
+def make_saved_tracks_marker(total, newest_track_id):
+    return str(total) + ' ' + (newest_track_id or '')
+
+class LibraryDatabase:
+    def __init__(self, sp, database_path=DEFAULT_DATABASE_PATH):
+        self.sp = sp
+        self.database_path = database_path
+        # one connection shared by the hotkey threads and the background sync thread, serialized by this lock:
+        self.lock = threading.RLock()
+        # (so that Liked Songs synced by sync and by the saved tracks cache at the same time are downloaded once:)
+        self.saved_tracks_sync_lock = threading.Lock()
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        # callbacks (of a playlist ID) called after a playlist's local copy changes (see subscribe):
+        self.subscribers = []
+        with self.lock, self.connection:
+            self.connection.executescript('''
+                CREATE TABLE IF NOT EXISTS playlists (
+                    playlist_id TEXT PRIMARY KEY,
+                    name TEXT,
+                    owner_id TEXT,
+                    snapshot_id TEXT,
+                    track_count INTEGER,
+                    synced_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS playlist_tracks (
+                    playlist_id TEXT,
+                    position INTEGER,
+                    track_id TEXT,
+                    PRIMARY KEY (playlist_id, position)
+                );
+                CREATE INDEX IF NOT EXISTS playlist_tracks_by_track ON playlist_tracks (track_id, playlist_id);
+                CREATE TABLE IF NOT EXISTS saved_tracks (
+                    track_id TEXT PRIMARY KEY,
+                    added_at TEXT
+                );
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+            ''')
+
+    # Function: sync everything (playlists and Liked Songs). Returns a dictionary summarizing what was (re)downloaded.
+    def sync(self):
+        start_time = time.time()
+        summary = self.sync_playlists()
+        summary['saved_tracks_downloaded'] = self.sync_saved_tracks()
+        summary['seconds'] = round(time.time() - start_time, 2)
+        return summary
+
+    # Function: list all of the user's playlists, re-download the tracks of any whose snapshot_id changed (or which are new), and forget playlists the user no longer has.
+    def sync_playlists(self):
+        known_snapshots = dict(self.query('SELECT playlist_id, snapshot_id FROM playlists'))
+        listed_playlist_ids = set()
+        downloaded = 0
+        for playlist in pagination.iterate_items(self.sp, self.sp.current_user_playlists(limit=50)):
+            if not playlist:
+                continue
+            listed_playlist_ids.add(playlist['id'])
+            if known_snapshots.get(playlist['id']) != playlist['snapshot_id']:
+                self.download_playlist(playlist)
+                downloaded += 1
+        removed_playlist_ids = set(known_snapshots) - listed_playlist_ids
+        with self.lock, self.connection:
+            for playlist_id in removed_playlist_ids:
+                self.connection.execute('DELETE FROM playlists WHERE playlist_id = ?', (playlist_id,))
+                self.connection.execute('DELETE FROM playlist_tracks WHERE playlist_id = ?', (playlist_id,))
+        for playlist_id in removed_playlist_ids:
+            self.publish_playlist_change(playlist_id)
+        return {'playlists': len(listed_playlist_ids), 'playlists_downloaded': downloaded, 'playlists_removed': len(removed_playlist_ids)}
+
+    # Function: sync one playlist: fetch only its snapshot_id (one small request) and re-download its tracks only if that changed. Returns True if it was re-downloaded, False if the local copy was current.
+    def sync_playlist(self, playlist_id):
+        playlist_id = get_spotify_id(playlist_id)
+        playlist = self.sp.playlist(playlist_id, fields='id,name,owner.id,snapshot_id,tracks.total')
+        if self.get_snapshot_id(playlist_id) == playlist['snapshot_id']:
+            return False
+        self.download_playlist(playlist)
+        return True
+
+    # Function: download every track (in order) of a playlist object (as returned by current_user_playlists or playlist), and replace the local copy of it.
+    def download_playlist(self, playlist):
+        playlist_id = playlist['id']
+        track_ids = []
+        for item in pagination.iterate_items(self.sp, self.sp.playlist_items(playlist_id, fields='items(track(id)),next', limit=100, additional_types=('track',))):
+            # local files and unavailable tracks have no track (or no ID), but still occupy a position:
+            track = item.get('track') or {}
+            track_ids.append(track.get('id'))
+        owner_id = (playlist.get('owner') or {}).get('id')
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM playlist_tracks WHERE playlist_id = ?', (playlist_id,))
+            self.connection.executemany('INSERT INTO playlist_tracks (playlist_id, position, track_id) VALUES (?, ?, ?)', [(playlist_id, position, track_id) for position, track_id in enumerate(track_ids)])
+            self.connection.execute('INSERT OR REPLACE INTO playlists (playlist_id, name, owner_id, snapshot_id, track_count, synced_at) VALUES (?, ?, ?, ?, ?, ?)', (playlist_id, playlist.get('name'), owner_id, playlist['snapshot_id'], len(track_ids), time.time()))
+        self.publish_playlist_change(playlist_id)
+        return track_ids
+
+    # Function: re-download Liked Songs, but only if the first page says they changed (different total, or a different most recently added track). Returns True if re-downloaded.
+    def sync_saved_tracks(self):
+        with self.saved_tracks_sync_lock:
+            results = self.sp.current_user_saved_tracks(limit=50)
+            newest_track_id = ((results['items'][0].get('track') or {}).get('id') or '') if results['items'] else ''
+            marker = make_saved_tracks_marker(results['total'], newest_track_id)
+            if self.get_sync_state('saved_tracks_marker') == marker:
+                return False
+            saved_tracks = [(item['track']['id'], item['added_at']) for item in pagination.iterate_items(self.sp, results) if item.get('track') and item['track'].get('id')]
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM saved_tracks')
+                self.connection.executemany('INSERT OR REPLACE INTO saved_tracks (track_id, added_at) VALUES (?, ?)', saved_tracks)
+                self.connection.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', ('saved_tracks_marker', marker))
+            return True
+
+    # Function: return the set of Liked Songs track IDs, and the total number of Liked Songs items as of the last sync_saved_tracks (including items without a track ID, such as unavailable tracks, which aren't in the set); None and None if they were never synced.
+    def get_saved_tracks(self):
+        with self.lock:
+            total = self.get_saved_tracks_total()
+            if total is None:
+                return None, None
+            return set(row[0] for row in self.query('SELECT track_id FROM saved_tracks')), total
+
+    # Function: return True or False for whether a playlist contains a track, or None if that playlist isn't in the local database (never synced).
+    def playlist_contains(self, playlist_id, track_id):
+        playlist_id = get_spotify_id(playlist_id)
+        if self.get_snapshot_id(playlist_id) is None:
+            return None
+        rows = self.query('SELECT 1 FROM playlist_tracks WHERE track_id = ? AND playlist_id = ? LIMIT 1', (get_spotify_id(track_id), playlist_id))
+        return len(rows) > 0
+
+    # Function: return a list of (playlist_id, name) of every synced playlist that contains a track.
+    def playlists_containing(self, track_id):
+        return self.query('SELECT DISTINCT playlists.playlist_id, playlists.name FROM playlist_tracks JOIN playlists ON playlists.playlist_id = playlist_tracks.playlist_id WHERE playlist_tracks.track_id = ? ORDER BY playlists.name', (get_spotify_id(track_id),))
+
+    # Function: return every occurrence of a track in synced playlists (only in playlists owned by owner_id, if that's passed), as a dictionary of playlist ID -> {'name', 'snapshot_id', 'positions' (ascending)}. This is the track -> (playlist, position, snapshot_id) index, kept current by syncs and the record_* methods.
+    def get_track_occurrences(self, track_id, owner_id=None):
+        sql = 'SELECT playlists.playlist_id, playlists.name, playlists.snapshot_id, playlist_tracks.position FROM playlist_tracks JOIN playlists ON playlists.playlist_id = playlist_tracks.playlist_id WHERE playlist_tracks.track_id = ?'
+        parameters = [get_spotify_id(track_id)]
+        if owner_id:
+            sql += ' AND playlists.owner_id = ?'
+            parameters.append(owner_id)
+        occurrences = {}
+        for playlist_id, name, snapshot_id, position in self.query(sql + ' ORDER BY playlists.playlist_id, playlist_tracks.position', parameters):
+            occurrences.setdefault(playlist_id, {'name': name, 'snapshot_id': snapshot_id, 'positions': []})['positions'].append(position)
+        return occurrences
+
+    # Function: return the track IDs of a synced playlist, in order (None for local files and unavailable tracks), or None if that playlist isn't in the local database.
+    def get_playlist_track_ids(self, playlist_id):
+        playlist_id = get_spotify_id(playlist_id)
+        if self.get_snapshot_id(playlist_id) is None:
+            return None
+        return [row[0] for row in self.query('SELECT track_id FROM playlist_tracks WHERE playlist_id = ? ORDER BY position', (playlist_id,))]
+
+    def is_saved_track(self, track_id):
+        return len(self.query('SELECT 1 FROM saved_tracks WHERE track_id = ?', (get_spotify_id(track_id),))) > 0
+
+    def get_snapshot_id(self, playlist_id):
+        rows = self.query('SELECT snapshot_id FROM playlists WHERE playlist_id = ?', (get_spotify_id(playlist_id),))
+        return rows[0][0] if rows else None
+
+    # Function: fetch a playlist's current snapshot_id (one small request), to pass as the expected_snapshot_id of a record_* method when the playlist wasn't just synced. Returns None, without a request, if there's no local copy of the playlist to mirror a change onto.
+    def fetch_snapshot_id(self, playlist_id):
+        if self.get_snapshot_id(playlist_id) is None:
+            return None
+        return self.sp.playlist(get_spotify_id(playlist_id), fields='snapshot_id')['snapshot_id']
+
+    # Function: (under self.lock, in a transaction) return True if the local copy of a playlist is the one a change was made to, that is, its stored snapshot_id is expected_snapshot_id (the playlist's snapshot_id just before the change, as the caller knows it; None if unknown). If it isn't, the change can't be mirrored onto it, so forget its snapshot_id: the next sync re-downloads it.
+    def is_current_before_change(self, playlist_id, expected_snapshot_id):
+        stored_snapshot_id = self.get_snapshot_id(playlist_id)
+        if stored_snapshot_id is None:
+            return False
+        if expected_snapshot_id is None or stored_snapshot_id != expected_snapshot_id:
+            self.connection.execute('UPDATE playlists SET snapshot_id = NULL WHERE playlist_id = ?', (playlist_id,))
+            return False
+        return True
+
+    # Function: after this script appends tracks to a playlist, mirror that locally, so the next sync_playlist of it finds the snapshot_id current and doesn't re-download it. new_snapshot_id is the snapshot_id returned by the API call that made the change, and expected_snapshot_id the playlist's just before it (see is_current_before_change).
+    def record_tracks_added(self, playlist_id, track_ids, new_snapshot_id, expected_snapshot_id=None):
+        playlist_id = get_spotify_id(playlist_id)
+        with self.lock, self.connection:
+            if not self.is_current_before_change(playlist_id, expected_snapshot_id):
+                return
+            track_count = self.connection.execute('SELECT COUNT(*) FROM playlist_tracks WHERE playlist_id = ?', (playlist_id,)).fetchone()[0]
+            self.connection.executemany('INSERT INTO playlist_tracks (playlist_id, position, track_id) VALUES (?, ?, ?)', [(playlist_id, track_count + offset, get_spotify_id(track_id)) for offset, track_id in enumerate(track_ids)])
+            self.connection.execute('UPDATE playlists SET snapshot_id = ?, track_count = ? WHERE playlist_id = ?', (new_snapshot_id, track_count + len(track_ids), playlist_id))
+        self.publish_playlist_change(playlist_id)
+
+    # Function: mirror locally the removal of all occurrences of tracks from a playlist (renumbering the positions of what remains).
+    def record_tracks_removed(self, playlist_id, track_ids, new_snapshot_id, expected_snapshot_id=None):
+        playlist_id = get_spotify_id(playlist_id)
+        removed_track_ids = set(get_spotify_id(track_id) for track_id in track_ids)
+        with self.lock, self.connection:
+            if not self.is_current_before_change(playlist_id, expected_snapshot_id):
+                return
+            remaining_track_ids = [row[0] for row in self.connection.execute('SELECT track_id FROM playlist_tracks WHERE playlist_id = ? ORDER BY position', (playlist_id,)) if row[0] not in removed_track_ids]
+            self.connection.execute('DELETE FROM playlist_tracks WHERE playlist_id = ?', (playlist_id,))
+            self.connection.executemany('INSERT INTO playlist_tracks (playlist_id, position, track_id) VALUES (?, ?, ?)', [(playlist_id, position, track_id) for position, track_id in enumerate(remaining_track_ids)])
+            self.connection.execute('UPDATE playlists SET snapshot_id = ?, track_count = ? WHERE playlist_id = ?', (new_snapshot_id, len(remaining_track_ids), playlist_id))
+        self.publish_playlist_change(playlist_id)
+
+    # Function: mirror locally the replacement of the tracks at positions of a playlist with another track (positions don't change).
+    def record_track_replaced(self, playlist_id, positions, new_track_id, new_snapshot_id, expected_snapshot_id=None):
+        playlist_id = get_spotify_id(playlist_id)
+        with self.lock, self.connection:
+            if not self.is_current_before_change(playlist_id, expected_snapshot_id):
+                return
+            self.connection.executemany('UPDATE playlist_tracks SET track_id = ? WHERE playlist_id = ? AND position = ?', [(get_spotify_id(new_track_id), playlist_id, position) for position in positions])
+            self.connection.execute('UPDATE playlists SET snapshot_id = ? WHERE playlist_id = ?', (new_snapshot_id, playlist_id))
+        self.publish_playlist_change(playlist_id)
+
+    # Function: mirror locally tracks saved to Liked Songs, updating the first page marker in the same transaction to what the first page now shows (one more item per newly saved track, the first of track_ids newest, as the API lists them), so the next sync_saved_tracks doesn't re-download. If Liked Songs changed elsewhere, the marker won't match the first page, and the next sync re-downloads them.
+    def record_saved_tracks_added(self, track_ids):
+        track_ids = [get_spotify_id(track_id) for track_id in track_ids]
+        if not track_ids:
+            return
+        added_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        with self.lock, self.connection:
+            known_track_ids = set(row[0] for row in self.connection.execute('SELECT track_id FROM saved_tracks WHERE track_id IN (' + ', '.join('?' * len(track_ids)) + ')', track_ids))
+            self.connection.executemany('INSERT OR REPLACE INTO saved_tracks (track_id, added_at) VALUES (?, ?)', [(track_id, added_at) for track_id in track_ids])
+            total = self.get_saved_tracks_total()
+            if total is not None:
+                self.set_saved_tracks_marker(total + len(set(track_ids) - known_track_ids), track_ids[0])
+
+    # Function: mirror locally tracks removed from Liked Songs, updating the first page marker in the same transaction (one item fewer per track removed from the rows, and the newest remaining row newest).
+    def record_saved_tracks_removed(self, track_ids):
+        track_ids = [get_spotify_id(track_id) for track_id in track_ids]
+        with self.lock, self.connection:
+            removed_count = sum(self.connection.execute('DELETE FROM saved_tracks WHERE track_id = ?', (track_id,)).rowcount for track_id in set(track_ids))
+            total = self.get_saved_tracks_total()
+            if total is not None:
+                newest_row = self.connection.execute('SELECT track_id FROM saved_tracks ORDER BY added_at DESC LIMIT 1').fetchone()
+                self.set_saved_tracks_marker(total - removed_count, newest_row[0] if newest_row else '')
+
+    # Function: return the total number of Liked Songs items in the first page marker, or None if they were never synced.
+    def get_saved_tracks_total(self):
+        marker = self.get_sync_state('saved_tracks_marker')
+        return int(marker.split(' ')[0]) if marker else None
+
+    # Function: (under self.lock, in a transaction) store the first page marker.
+    def set_saved_tracks_marker(self, total, newest_track_id):
+        self.connection.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', ('saved_tracks_marker', make_saved_tracks_marker(total, newest_track_id)))
+
+    # Function: register callback(playlist_id) to be called (on the thread that made the change) after the local copy of a playlist is re-downloaded, changed by a record_* method, or removed; for in-memory indexes built from the database, such as the playlist membership index.
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def publish_playlist_change(self, playlist_id):
+        for callback in self.subscribers:
+            try:
+                callback(playlist_id)
+            except Exception as e:
+                print("Error in library database subscriber", callback.__name__)
+                print(e)
+
+    def get_sync_state(self, key):
+        rows = self.query('SELECT value FROM sync_state WHERE key = ?', (key,))
+        return rows[0][0] if rows else None
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
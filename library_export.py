@@ -0,0 +1,243 @@
+# DESCRIPTION
+# Exports the user's library (Liked Songs and every playlist, exportify style) to an NDJSON or CSV file, and imports such a file back (into new playlists and Liked Songs), both streaming, so memory stays flat however big the library is:
+# - export writes each page of tracks to the file as it arrives (paging lazily, with the next page prefetched; see pagination.py), and after every page records its progress (which source, which offset, how many bytes written) in a <file>.progress file, written atomically (see atomic_file.py). If interrupted, running it again resumes from the last written page (truncating anything written after it); a playlist that changed meanwhile (different snapshot_id) is re-exported from its start.
+# - import reads the file row by row, adding tracks in batches of 100 to playlists (created as it goes, named as the exported ones, plus a suffix) and of 50 to Liked Songs, and records its progress (rows done, playlists created) in a <file>.import_progress file after every batch, so it too resumes where it stopped.
+# The format is chosen by file extension (.csv, else NDJSON). Each row is one track occurrence, with the fields in EXPORT_FIELDS; 'source' is 'saved_tracks' or 'playlist'. Local files are exported (with their local URI) but can't be imported.
+# Every call goes through InstrumentedSpotify and a RequestScheduler, so both are bounded by the API rate limit (and honor Retry-After on HTTP 429s) rather than by client overhead.
+
+# USAGE
+#    python library_export.py export my_library.ndjson
+#    python library_export.py import my_library.ndjson --suffix " (imported)"
+#    python library_export.py import other_service_export.csv --match    # any CSV / NDJSON with artist and title (and optionally ISRC) columns, as one playlist; tracks are matched by search (see track_matching.py)
+#    python library_export.py export my_library.csv --fake    # against a local fake API (see fake_spotify_api.py), no Spotify account needed
+# The API client is created from Ansible_for_Spotify.ini (API_VARIABLES), sharing the main script's token cache. Or from another script that has a spotipy client (sp) :
+#    import library_export
+#    library_export.export_library(sp, 'my_library.ndjson')
+#    library_export.import_library(sp, 'my_library.ndjson', user_id)
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+import pagination
+from atomic_file import read_json, write_json_atomically
+
+EXPORT_FIELDS = ['source', 'playlist_id', 'playlist_name', 'position', 'added_at', 'track_uri', 'track_name', 'artist_names', 'album_name', 'isrc', 'duration_ms']
+# Page sizes of the saved tracks and playlist items endpoints, and the most tracks one add request accepts, to a playlist and to Liked Songs:
+SAVED_TRACKS_PAGE_SIZE = 50
+PLAYLIST_ITEMS_PAGE_SIZE = 100
+TRACKS_PER_PLAYLIST_ADD = 100
+TRACKS_PER_SAVED_TRACKS_ADD = 50
+# Column names (lowercased) of other services' exports (exportify's, and plain artist / title lists) and the export fields they map to:
+FOREIGN_FIELD_NAMES = {'track uri': 'track_uri', 'uri': 'track_uri', 'spotify uri': 'track_uri', 'track name': 'track_name', 'title': 'track_name', 'name': 'track_name', 'track': 'track_name', 'song': 'track_name', 'artist name(s)': 'artist_names', 'artist': 'artist_names', 'artists': 'artist_names', 'album name': 'album_name', 'album': 'album_name', 'isrc': 'isrc', 'duration (ms)': 'duration_ms', 'duration_ms': 'duration_ms', 'added at': 'added_at'}
+INI_PATH = 'Ansible_for_Spotify.ini'
+API_SCOPE = 'playlist-read-private playlist-read-collaborative playlist-modify-private playlist-modify-public user-library-read user-library-modify'
+
+def is_csv_path(path):
+    return path.lower().endswith('.csv')
+
+# Function: return an export row (a dictionary of EXPORT_FIELDS) for a saved track or playlist item.
+def make_row(source, item, position):
+    track = item.get('track') or item.get('item') or {}
+    return {
+        'source': 'saved_tracks' if source['kind'] == 'saved_tracks' else 'playlist',
+        'playlist_id': source.get('id', ''),
+        'playlist_name': source.get('name', ''),
+        'position': position,
+        'added_at': item.get('added_at') or '',
+        'track_uri': track.get('uri') or '',
+        'track_name': track.get('name') or '',
+        'artist_names': '; '.join(artist.get('name') or '' for artist in track.get('artists') or []),
+        'album_name': (track.get('album') or {}).get('name') or '',
+        'isrc': (track.get('external_ids') or {}).get('isrc') or '',
+        'duration_ms': track.get('duration_ms') or '',
+    }
+
+# Function: return the sources to export (Liked Songs first, then every playlist the user has, in order) as small dictionaries.
+def list_sources(sp, include_saved_tracks=True):
+    sources = [{'kind': 'saved_tracks'}] if include_saved_tracks else []
+    for playlist in pagination.iterate_items(sp, sp.current_user_playlists(limit=50)):
+        if playlist:
+            sources.append({'kind': 'playlist', 'id': playlist['id'], 'name': playlist['name'], 'snapshot_id': playlist['snapshot_id']})
+    return sources
+
+# Function: return the first page of a source, starting at offset.
+def get_source_page(sp, source, offset):
+    if source['kind'] == 'saved_tracks':
+        return sp.current_user_saved_tracks(limit=SAVED_TRACKS_PAGE_SIZE, offset=offset)
+    return sp.playlist_items(source['id'], limit=PLAYLIST_ITEMS_PAGE_SIZE, offset=offset, additional_types=('track',))
+
+# Function: export Liked Songs and every playlist to path, page by page, resuming from path's .progress file if there is one (unless restart). Prints and returns a summary.
+def export_library(sp, path, include_saved_tracks=True, restart=False):
+    start_time = time.perf_counter()
+    progress_path = path + '.progress'
+    progress = None if restart else read_json(progress_path)
+    if progress:
+        # drop anything written after the last recorded page:
+        with open(path, 'ab') as export_file:
+            export_file.truncate(progress['file_size'])
+        source = progress['sources'][progress['source_index']] if progress['source_index'] < len(progress['sources']) else None
+        if source and source['kind'] == 'playlist' and progress['offset'] > 0 and sp.playlist(source['id'], fields='snapshot_id')['snapshot_id'] != source['snapshot_id']:
+            print("~\nPlaylist", source['name'], "changed since the interrupted export; exporting it again from its start.")
+            with open(path, 'ab') as export_file:
+                export_file.truncate(progress['source_file_size'])
+            progress.update(file_size=progress['source_file_size'], offset=0, rows=progress['source_rows'])
+        print("~\nResuming export to", path, "at source", progress['source_index'] + 1, "of", len(progress['sources']), "offset", progress['offset'], ". .")
+    else:
+        print("~\nListing playlists to export to", path, ". .")
+        progress = {'sources': list_sources(sp, include_saved_tracks), 'source_index': 0, 'offset': 0, 'rows': 0, 'file_size': 0, 'source_file_size': 0, 'source_rows': 0}
+        with open(path, 'w', encoding='UTF-8', newline='') as export_file:
+            if is_csv_path(path):
+                csv.DictWriter(export_file, EXPORT_FIELDS).writeheader()
+            progress['file_size'] = progress['source_file_size'] = export_file.tell()
+    with open(path, 'a', encoding='UTF-8', newline='') as export_file:
+        csv_writer = csv.DictWriter(export_file, EXPORT_FIELDS) if is_csv_path(path) else None
+        while progress['source_index'] < len(progress['sources']):
+            source = progress['sources'][progress['source_index']]
+            for page in pagination.iterate_pages(sp, get_source_page(sp, source, progress['offset'])):
+                for index, item in enumerate(page['items']):
+                    row = make_row(source, item, page['offset'] + index)
+                    if csv_writer:
+                        csv_writer.writerow(row)
+                    else:
+                        export_file.write(json.dumps(row, ensure_ascii=False) + '\n')
+                export_file.flush()
+                progress['offset'] = page['offset'] + len(page['items'])
+                progress['rows'] += len(page['items'])
+                progress['file_size'] = export_file.tell()
+                write_json_atomically(progress_path, progress)
+            progress.update(source_index=progress['source_index'] + 1, offset=0, source_file_size=progress['file_size'], source_rows=progress['rows'])
+            write_json_atomically(progress_path, progress)
+    os.remove(progress_path)
+    seconds = time.perf_counter() - start_time
+    summary = {'rows': progress['rows'], 'sources': len(progress['sources']), 'seconds': round(seconds, 2), 'file_bytes': progress['file_size']}
+    print("~\nExported", summary['rows'], "tracks from", summary['sources'], "sources to", path, "in", summary['seconds'], "seconds.")
+    return summary
+
+# Function: return a row of another service's export (or of any list with artist / title columns) as an export row, of one playlist named as the file.
+def normalize_foreign_row(row, path):
+    normalized = dict.fromkeys(EXPORT_FIELDS, '')
+    for name, value in row.items():
+        field = FOREIGN_FIELD_NAMES.get((name or '').strip().lower())
+        if field and value and not normalized[field]:
+            normalized[field] = value
+    normalized.update(source='playlist', playlist_id=os.path.basename(path), playlist_name=os.path.splitext(os.path.basename(path))[0])
+    return normalized
+
+# Function: yield the rows (dictionaries of EXPORT_FIELDS) of an export file, or of another service's export (see normalize_foreign_row), one at a time.
+def read_rows(path):
+    with open(path, encoding='UTF-8-sig', newline='') as export_file:
+        rows = csv.DictReader(export_file) if is_csv_path(path) else (json.loads(line) for line in export_file if line.strip())
+        for row in rows:
+            yield row if 'source' in row else normalize_foreign_row(row, path)
+
+# Function: add the tracks of an export file: each exported playlist's to a new private playlist of user_id (named as it was, plus name_suffix), and, if include_saved_tracks, the Liked Songs to Liked Songs. Rows without a Spotify URI (from other services' exports) are matched by track_matcher (a TrackMatcher; see track_matching.py), if one is passed, or else skipped. Resumes from path's .import_progress file if there is one (unless restart). Prints and returns a summary.
+# Liked Songs are exported newest first and added in that order, so their order by date added comes out reversed.
+def import_library(sp, path, user_id, name_suffix=' (imported)', include_saved_tracks=True, restart=False, track_matcher=None):
+    start_time = time.perf_counter()
+    progress_path = path + '.import_progress'
+    progress = None if restart else read_json(progress_path)
+    if progress:
+        print("~\nResuming import of", path, "after row", progress['rows'], ". .")
+    else:
+        progress = {'rows': 0, 'tracks_added': 0, 'skipped': 0, 'playlists': {}}
+    rows_to_skip = progress['rows']
+    rows_done = rows_to_skip
+    batch_target = None
+    batch = []
+    def add_batch(rows_done):
+        if batch:
+            if batch_target == 'saved_tracks':
+                sp.current_user_saved_tracks_add(batch)
+            else:
+                sp.playlist_add_items(batch_target, batch)
+            progress['tracks_added'] += len(batch)
+            batch.clear()
+        progress['rows'] = rows_done
+        write_json_atomically(progress_path, progress)
+    rows = itertools.islice(read_rows(path), rows_to_skip, None)
+    matched_rows = track_matcher.match_rows(rows) if track_matcher else ((row, row['track_uri']) for row in rows)
+    for row_number, (row, track_uri) in enumerate(matched_rows, rows_to_skip):
+        rows_done = row_number + 1
+        track_uri = track_uri or ''
+        if row['source'] == 'saved_tracks':
+            target = 'saved_tracks' if include_saved_tracks else None
+            is_importable = track_uri.startswith('spotify:track:')
+        else:
+            target = progress['playlists'].get(row['playlist_id'])
+            if target is None:
+                add_batch(row_number)
+                target = sp.user_playlist_create(user_id, row['playlist_name'] + name_suffix, public=False, description='Imported from ' + os.path.basename(path))['id']
+                progress['playlists'][row['playlist_id']] = target
+                write_json_atomically(progress_path, progress)
+            is_importable = track_uri.startswith(('spotify:track:', 'spotify:episode:'))
+        if target is None:
+            continue
+        if not is_importable:
+            progress['skipped'] += 1
+            continue
+        if target != batch_target:
+            add_batch(row_number)
+            batch_target = target
+        batch.append(track_uri)
+        if len(batch) >= (TRACKS_PER_SAVED_TRACKS_ADD if target == 'saved_tracks' else TRACKS_PER_PLAYLIST_ADD):
+            add_batch(rows_done)
+    add_batch(rows_done)
+    os.remove(progress_path)
+    seconds = time.perf_counter() - start_time
+    summary = {'tracks_added': progress['tracks_added'], 'playlists_created': len(progress['playlists']), 'skipped': progress['skipped'], 'seconds': round(seconds, 2)}
+    print("~\nImported", summary['tracks_added'], "tracks (" + str(summary['playlists_created']), "playlists created,", summary['skipped'], "local, unavailable or unmatched tracks skipped) from", path, "in", summary['seconds'], "seconds.")
+    return summary
+
+# Function: create an API client authorized as the user configured in Ansible_for_Spotify.ini (sharing its token cache with the main script).
+def create_client_from_ini(ini_path=INI_PATH):
+    import spotipy
+    from extended_configparser.parser import ExtendedConfigParser
+    from spotipy.oauth2 import SpotifyOAuth
+    from token_lifecycle import AtomicTokenCacheHandler
+    from request_scheduler import stop_client_rate_limit_retries
+    config = ExtendedConfigParser()
+    config.read(ini_path, encoding='UTF-8')
+    api_variables = config['API_VARIABLES']
+    auth_manager = SpotifyOAuth(client_id=api_variables['CLIENT_ID'], client_secret=api_variables['CLIENT_SECRET'], redirect_uri=api_variables['REDIRECT_URI'], scope=API_SCOPE, username=api_variables['USERNAME'], cache_handler=AtomicTokenCacheHandler(username=api_variables['USERNAME']))
+    return stop_client_rate_limit_retries(spotipy.Spotify(auth_manager=auth_manager, status_forcelist=(500, 502, 503, 504)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the Spotify library (Liked Songs and playlists) to NDJSON / CSV, or import such an export, streaming and resumably.')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('path', help='export file (.csv for CSV, else NDJSON)')
+    parser.add_argument('--no-saved-tracks', action='store_true', help="don't export / import Liked Songs")
+    parser.add_argument('--suffix', default=' (imported)', help='appended to the names of imported playlists (default " (imported)")')
+    parser.add_argument('--restart', action='store_true', help="start over instead of resuming an interrupted export / import")
+    parser.add_argument('--match', action='store_true', help="on import, search for tracks without a Spotify URI (as in other services' exports) by ISRC or artist and title, caching matches (see track_matching.py)")
+    parser.add_argument('--fake', action='store_true', help='use a local fake Spotify API (see fake_spotify_api.py) instead of the account in ' + INI_PATH)
+    arguments = parser.parse_args()
+
+    from instrumented_spotify import InstrumentedSpotify
+    from request_scheduler import RequestScheduler
+    server = None
+    if arguments.fake:
+        from fake_spotify_api import FakeSpotifyAPIServer
+        server = FakeSpotifyAPIServer().start()
+        client = server.create_client()
+    else:
+        client = create_client_from_ini()
+    sp = InstrumentedSpotify(client, RequestScheduler())
+    if arguments.command == 'export':
+        export_library(sp, arguments.path, not arguments.no_saved_tracks, arguments.restart)
+    else:
+        track_matcher = None
+        if arguments.match:
+            from track_matching import TrackMatcher
+            track_matcher = TrackMatcher(sp)
+        import_library(sp, arguments.path, sp.me()['id'], arguments.suffix, not arguments.no_saved_tracks, arguments.restart, track_matcher)
+        if track_matcher:
+            track_matcher.print_metrics()
+    sp.print_statistics()
+    if server:
+        server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+# DESCRIPTION
+# Filters a playlist's tracks to those also in Liked Songs, and appends them (optionally shuffled) to another playlist, for example to extend playlist 1 with the liked part of whatever playlist is playing:
+# - the playlist's tracks come from its local copy in the library database (see library_database.py): one small request checks its snapshot_id, and its items are streamed page by page only if that changed
+# - Liked Songs membership comes from the in-memory set of Liked Songs track IDs (see saved_tracks_cache.py), so the filter is one set intersection, in one pass over the playlist, instead of one current_user_saved_tracks_contains request per 50 tracks
+# - tracks already in the target playlist (also from its local copy) are skipped, as are repeats, and adds are made 100 tracks per request and recorded in the library database (so the next sync of the target doesn't re-download it)
+
+# USAGE
+#    import liked_tracks_filter
+#    liked_tracks_filter.append_liked_tracks(sp, library_database, saved_tracks_cache, source_playlist_ID, PLAYLIST_ID_1, shuffle=True)
+# -- which returns a summary dictionary (tracks in the source, liked, already in the target, added, requests' worth of adds, seconds taken), or None if Liked Songs couldn't be loaded.
+
+import random
+import time
+from library_database import get_spotify_id
+
+# The add items endpoint accepts at most this many items per request, and a playlist can hold at most this many tracks:
+TRACKS_PER_ADD_REQUEST = 100
+MAX_PLAYLIST_TRACKS = 10000
+
+# Function: return the track IDs of track_ids (in order, without repeats, and without None for local files) that are in liked_track_ids (a set) and not in excluded_track_ids (a set).
+def filter_liked_tracks(track_ids, liked_track_ids, excluded_track_ids=frozenset()):
+    return [track_id for track_id in dict.fromkeys(track_ids) if track_id in liked_track_ids and track_id not in excluded_track_ids]
+
+# Function: append the tracks of source_playlist_id that are in Liked Songs (and, if skip_existing, not already in target_playlist_id) to target_playlist_id, shuffled if shuffle, else in source order. Prints and returns a summary, or None if Liked Songs couldn't be loaded.
+def append_liked_tracks(sp, library_database, saved_tracks_cache, source_playlist_id, target_playlist_id, shuffle=False, skip_existing=True):
+    start_time = time.perf_counter()
+    source_playlist_id = get_spotify_id(source_playlist_id)
+    target_playlist_id = get_spotify_id(target_playlist_id)
+    liked_track_ids = saved_tracks_cache.get_track_ids()
+    if liked_track_ids is None:
+        try:
+            saved_tracks_cache.seed()
+        except Exception as e:
+            print("~\nLiked tracks filter: could not load Liked Songs; nothing added.")
+            print(e)
+            return None
+        liked_track_ids = saved_tracks_cache.get_track_ids()
+    library_database.sync_playlist(source_playlist_id)
+    source_track_ids = library_database.get_playlist_track_ids(source_playlist_id)
+    library_database.sync_playlist(target_playlist_id)
+    target_track_ids = library_database.get_playlist_track_ids(target_playlist_id)
+    liked_source_track_ids = filter_liked_tracks(source_track_ids, liked_track_ids)
+    track_ids = filter_liked_tracks(liked_source_track_ids, liked_track_ids, set(target_track_ids) if skip_existing else frozenset())
+    already_in_target_count = len(liked_source_track_ids) - len(track_ids)
+    if shuffle:
+        random.shuffle(track_ids)
+    free_track_count = MAX_PLAYLIST_TRACKS - len(target_track_ids)
+    if len(track_ids) > free_track_count:
+        print("~\nLiked tracks filter: only", max(free_track_count, 0), "of", len(track_ids), "tracks fit in the target playlist; adding those.")
+        track_ids = track_ids[:max(free_track_count, 0)]
+    added_track_count = 0
+    # (the target was just synced, so its stored snapshot_id is its snapshot_id before the first add, and each add's result the one before the next:)
+    snapshot_id = library_database.get_snapshot_id(target_playlist_id)
+    for idx in range(0, len(track_ids), TRACKS_PER_ADD_REQUEST):
+        batch = track_ids[idx:idx + TRACKS_PER_ADD_REQUEST]
+        result = sp.playlist_add_items(target_playlist_id, ['spotify:track:' + track_id for track_id in batch])
+        library_database.record_tracks_added(target_playlist_id, batch, result['snapshot_id'], snapshot_id)
+        snapshot_id = result['snapshot_id']
+        added_track_count += len(batch)
+    summary = {
+        'source_tracks': len(source_track_ids),
+        'liked': len(liked_source_track_ids),
+        'already_in_target': already_in_target_count,
+        'added': added_track_count,
+        'add_requests': -(-added_track_count // TRACKS_PER_ADD_REQUEST),
+        'seconds': round(time.perf_counter() - start_time, 2),
+    }
+    print("~\nLiked tracks filter:", summary['liked'], "of", summary['source_tracks'], "tracks in the playlist are liked;", summary['added'], "added" + (" (shuffled)" if shuffle else "") + " to the target playlist in", summary['seconds'], "seconds.")
+    return summary
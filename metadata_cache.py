@@ -0,0 +1,62 @@
+# DESCRIPTION
+# A cache of metadata that hotkeys look up over and over: playlist name / owner by playlist ID (kept for ttl seconds, at most max_entries playlists, least recently used evicted first), and the current user's profile (kept for the session, as it doesn't change while this script runs).
+# Entries aren't keyed by snapshot_id: that changes with every track added or removed, which would refetch a playlist as busy as playlist 1 after every add, though its name and owner rarely change. After renaming a playlist, call invalidate_playlist.
+
+# USAGE
+#    from metadata_cache import MetadataCache
+#    metadata_cache = MetadataCache(sp)
+#    metadata_cache.get_playlist_name(PLAYLIST_ID_1)
+#    metadata_cache.get_playlist(playlist_ID)['owner']['id'] == metadata_cache.get_current_user()['id']
+
+import collections
+import threading
+import time
+from library_database import get_spotify_id
+
+PLAYLIST_FIELDS = 'id,name,owner(id,display_name,external_urls)'
+
+class MetadataCache:
+    def __init__(self, sp, ttl=600, max_entries=256):
+        self.sp = sp
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # playlist ID -> (time fetched, playlist), least recently used first:
+        self.playlists = collections.OrderedDict()
+        self.current_user = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Function: return a playlist's id, name and owner, from the cache if it's there and not older than ttl; otherwise from the API.
+    def get_playlist(self, playlist_id):
+        playlist_id = get_spotify_id(playlist_id)
+        with self.lock:
+            entry = self.playlists.get(playlist_id)
+            if entry and time.time() - entry[0] < self.ttl:
+                self.playlists.move_to_end(playlist_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        playlist = self.sp.playlist(playlist_id, fields=PLAYLIST_FIELDS)
+        with self.lock:
+            self.playlists[playlist_id] = (time.time(), playlist)
+            self.playlists.move_to_end(playlist_id)
+            while len(self.playlists) > self.max_entries:
+                self.playlists.popitem(last=False)
+        return playlist
+
+    def get_playlist_name(self, playlist_id):
+        return self.get_playlist(playlist_id)['name']
+
+    # Function: forget a playlist (for example after renaming it), so the next lookup fetches it again.
+    def invalidate_playlist(self, playlist_id):
+        with self.lock:
+            self.playlists.pop(get_spotify_id(playlist_id), None)
+
+    # Function: return the current user's profile (sp.me()), fetched once per session.
+    def get_current_user(self):
+        if self.current_user is None:
+            current_user = self.sp.me()
+            with self.lock:
+                self.current_user = current_user
+        return self.current_user
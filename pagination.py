@@ -0,0 +1,61 @@
+# DESCRIPTION
+# Lazy pagination of the Web API's list endpoints (spotipy paging objects: playlists, playlist items, Liked Songs, artists' albums, album tracks, search results..), for every module that pages through them:
+# - iterate_pages / iterate_items are generators, so nothing is collected into lists unless the caller does so, and a caller that stops early (break, return, or closing the generator) stops the paging: no further pages are requested
+# - while the caller processes a page, the next one is fetched on a background thread (prefetch), so long crawls overlap network and processing. Prefetched calls are attributed to the caller's operation and made at its request scheduler priority (see InstrumentedSpotify.get_context), as if the caller had made them.
+
+# USAGE
+#    import pagination
+#    for item in pagination.iterate_items(sp, sp.playlist_items(playlist_ID, limit=100)):
+#        if item['track']['id'] == track_ID:
+#            break    # no more pages are requested
+#    for page in pagination.iterate_pages(sp, sp.current_user_saved_tracks(limit=50)):
+#        print(page['offset'], len(page['items']))
+
+import threading
+
+# How many prefetches may run at once (over all paging callers):
+PREFETCH_WORKERS = 8
+prefetch_executor = None
+prefetch_executor_lock = threading.Lock()
+
+# Function: return the shared prefetch thread pool, creating it on first use (so that importing this module at startup is cheap).
+def get_prefetch_executor():
+    global prefetch_executor
+    with prefetch_executor_lock:
+        if prefetch_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='pagination')
+        return prefetch_executor
+
+# Function: return a function that fetches the page after a page (sp.next) on any thread, as if on the calling thread (when sp is an InstrumentedSpotify).
+def make_next_page_fetcher(sp):
+    context = sp.get_context() if hasattr(sp, 'get_context') else None
+    def fetch_next_page(results):
+        if context is None:
+            return sp.next(results)
+        with sp.in_context(context):
+            return sp.next(results)
+    return fetch_next_page
+
+# Function: yield every page (paging object) from results on, following next links; unless prefetch is False, each next page is requested on a background thread as soon as the page before it is yielded. If the caller stops early, a prefetch not yet started is cancelled (one already started completes, unused).
+def iterate_pages(sp, results, prefetch=True):
+    fetch_next_page = make_next_page_fetcher(sp)
+    next_page = None
+    try:
+        while results:
+            has_next_page = bool(results.get('next'))
+            if has_next_page and prefetch:
+                next_page = get_prefetch_executor().submit(fetch_next_page, results)
+            yield results
+            if not has_next_page:
+                break
+            results = next_page.result() if next_page else fetch_next_page(results)
+            next_page = None
+    finally:
+        if next_page:
+            next_page.cancel()
+
+# Function: yield every item of every page from results on (see iterate_pages).
+def iterate_items(sp, results, prefetch=True):
+    for page in iterate_pages(sp, results, prefetch):
+        yield from page['items']
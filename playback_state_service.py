@@ -0,0 +1,219 @@
+# DESCRIPTION
+# One service that owns polling of the playback state (sp.current_playback) for Ansible_for_Spotify.py, instead of several overlapping pollers. It keeps the latest playback snapshot and publishes change events to subscribers (such as the info window), with these event names:
+# - 'track'       the playing track changed
+# - 'context'     the playing context (playlist, album..) changed
+# - 'is_playing'  playback was paused or resumed
+# - 'liked'       whether the playing track is in Liked Songs changed (read from a SavedTracksCache, so no extra API call)
+# - 'refresh'     a refresh was explicitly requested (for example by a hotkey), so subscribers should redraw even if nothing changed
+# Polls are scheduled from where playback is in the track (progress_ms and the track's duration_ms): rarely in the middle of a track, once just before its expected end (to correct for drift), right after its expected end (so a natural track transition shows almost instantly), and rapidly after a skip hotkey until the new track shows up. While paused or without a playing track, it polls every active_interval seconds.
+# The latest snapshot doubles as a locally maintained playback model: get_playback() returns it with progress_ms extrapolated from when it was polled, so hotkeys that only need to read repeat_state, shuffle_state or progress_ms before a write can skip a read request, and apply_optimistic_update() applies a write this script made to it right away; the next poll replaces it with what the API says.
+# It also does what the keepalive poll used to do: if playback is found paused through several consecutive polls, polling is suspended (slowed to one poll every suspended_interval seconds, which still keeps the API client aware of the player) until playback is seen playing again or resume() is called.
+
+# USAGE
+#    from playback_state_service import PlaybackStateService
+#    playback_state_service = PlaybackStateService(sp, saved_tracks_cache)
+#    playback_state_service.subscribe(callback)    # callback(event_names, playback, is_liked, CLI_print)
+#    playback_state_service.start()
+#    playback_state_service.request_refresh()       # e.g. after a hotkey changes playback
+#    playback_state_service.get_playback()['repeat_state']
+#    playback_state_service.apply_optimistic_update(repeat_state='off')
+
+import threading
+import time
+
+class PlaybackStateService:
+    def __init__(self, sp, saved_tracks_cache=None, active_interval=6.5, suspended_interval=82, paused_checks_before_suspend=6, max_mid_track_interval=30, track_end_lead=2.0, track_end_margin=0.4, track_change_interval=0.4, track_change_timeout=4.0):
+        self.sp = sp
+        self.saved_tracks_cache = saved_tracks_cache
+        self.active_interval = active_interval
+        self.suspended_interval = suspended_interval
+        # track-end-aware schedule: while a track plays, poll at least every max_mid_track_interval seconds (to notice seeks, skips etc. done from the Spotify app), track_end_lead seconds before the track's expected end, and track_end_margin seconds after it. After a skip (and after the expected end, if the track hasn't changed yet), poll every track_change_interval seconds, for up to track_change_timeout seconds:
+        self.max_mid_track_interval = max_mid_track_interval
+        self.track_end_lead = track_end_lead
+        self.track_end_margin = track_end_margin
+        self.track_change_interval = track_change_interval
+        self.track_change_timeout = track_change_timeout
+        self.track_change_expected_until = 0
+        self.poll_count = 0
+        self.paused_checks_before_suspend = paused_checks_before_suspend
+        self.subscribers = []
+        self.playback = None
+        self.playback_time = 0
+        self.is_liked = None
+        self.paused_poll_count = 0
+        self.is_suspended = False
+        self.last_poll_time = 0
+        # when a requested refresh is due (None if none is requested), and whether that refresh should print to the CLI:
+        self.refresh_due_time = None
+        self.refresh_CLI_print = False
+        self.lock = threading.Lock()
+        self.poll_lock = threading.Lock()
+        self.wake = threading.Event()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    # Function: ask for a poll delay seconds from now (by default a little later, because it can take a bit before a change from a hotkey happens). Several requests before that poll happens are served by one poll. Pass expect_track_change=True after skipping tracks, to poll right away and then rapidly until the new track shows up.
+    def request_refresh(self, CLI_print=False, delay=0.67, expect_track_change=False):
+        with self.lock:
+            if expect_track_change:
+                delay = min(delay, self.track_change_interval)
+                self.track_change_expected_until = time.time() + self.track_change_timeout
+            due_time = time.time() + delay
+            if self.refresh_due_time is None or due_time < self.refresh_due_time:
+                self.refresh_due_time = due_time
+            self.refresh_CLI_print = self.refresh_CLI_print or CLI_print
+        self.wake.set()
+
+    # Function: end a suspension of polling (playback was resumed by this script).
+    def resume(self):
+        self.paused_poll_count = 0
+        self.is_suspended = False
+        self.wake.set()
+
+    # Function: poll playback state now, on the calling thread, and publish any changes. Returns the playback snapshot (None if there's no active player).
+    def poll(self, is_refresh=False, CLI_print=False):
+        with self.poll_lock:
+            self.last_poll_time = time.time()
+            self.poll_count += 1
+            playback = self.sp.current_playback()
+            self.update_suspension(playback)
+            previous_playback = self.playback
+            with self.lock:
+                self.playback = playback
+                # progress_ms is taken to be as of halfway through the request:
+                self.playback_time = (self.last_poll_time + time.time()) / 2
+            previous_is_liked = self.is_liked
+            self.is_liked = self.get_is_liked(playback)
+            event_names = self.get_event_names(previous_playback, playback)
+            if previous_is_liked != self.is_liked:
+                event_names.add('liked')
+            if 'track' in event_names:
+                self.track_change_expected_until = 0
+            if is_refresh:
+                event_names.add('refresh')
+            if event_names:
+                self.publish(event_names, playback, CLI_print)
+            return playback
+
+    # Function: return a copy of the latest playback snapshot, with progress_ms extrapolated to now if playing, or None if there is no snapshot.
+    def get_playback(self):
+        with self.lock:
+            if self.playback is None:
+                return None
+            playback = dict(self.playback)
+            elapsed_ms = int((time.time() - self.playback_time) * 1000)
+        if playback.get('is_playing') and playback.get('progress_ms') is not None:
+            playback['progress_ms'] += elapsed_ms
+            if playback.get('item') and playback['item'].get('duration_ms'):
+                playback['progress_ms'] = min(playback['progress_ms'], playback['item']['duration_ms'])
+        return playback
+
+    # Function: apply a change this script just made to playback (for example repeat_state='off', or progress_ms=0 after a seek) to the snapshot right away. The next poll reconciles it with what the API says.
+    def apply_optimistic_update(self, **fields):
+        with self.lock:
+            if self.playback is None:
+                return
+            if 'progress_ms' in fields:
+                self.playback_time = time.time()
+            self.playback = dict(self.playback, **fields)
+        # a seek moves the expected end of the track, so reschedule:
+        self.wake.set()
+
+    def get_is_liked(self, playback):
+        track_ID = get_track_ID(playback)
+        if track_ID is None or self.saved_tracks_cache is None:
+            return None
+        is_liked = self.saved_tracks_cache.contains(track_ID)
+        if is_liked is None:
+            # Liked Songs cache not seeded yet; ask the API:
+            is_liked = self.sp.current_user_saved_tracks_contains([track_ID])[0]
+        return is_liked
+
+    def get_event_names(self, previous_playback, playback):
+        event_names = set()
+        if get_track_ID(previous_playback) != get_track_ID(playback):
+            event_names.add('track')
+        if get_context_uri(previous_playback) != get_context_uri(playback):
+            event_names.add('context')
+        if bool(previous_playback and previous_playback.get('is_playing')) != bool(playback and playback.get('is_playing')):
+            event_names.add('is_playing')
+        return event_names
+
+    # Function: count consecutive polls that found playback paused, and suspend (slow) polling after paused_checks_before_suspend of them.
+    def update_suspension(self, playback):
+        if playback and playback.get('is_playing'):
+            self.paused_poll_count = 0
+            self.is_suspended = False
+            return
+        self.paused_poll_count += 1
+        if self.paused_poll_count == self.paused_checks_before_suspend:
+            self.is_suspended = True
+            print("Playback found to be paused through", self.paused_checks_before_suspend, "checks; slowing playback polling until playback resumes.")
+
+    def publish(self, event_names, playback, CLI_print):
+        for callback in self.subscribers:
+            try:
+                callback(event_names, playback, self.is_liked, CLI_print)
+            except Exception as e:
+                print("Error in playback state subscriber", callback.__name__)
+                print(e)
+
+    # Function: return the time the next scheduled (not requested) poll should happen, from where playback is in the current track.
+    def get_next_poll_time(self):
+        if self.is_suspended:
+            return self.last_poll_time + self.suspended_interval
+        if time.time() < self.track_change_expected_until:
+            return self.last_poll_time + self.track_change_interval
+        playback = self.playback
+        if not playback or not playback.get('is_playing') or not playback.get('item') or not playback['item'].get('duration_ms') or playback.get('progress_ms') is None:
+            return self.last_poll_time + self.active_interval
+        expected_end_time = self.playback_time + (playback['item']['duration_ms'] - playback['progress_ms']) / 1000
+        # (comparisons allow track_change_interval of slack, so a poll made just before the expected end doesn't count as mid-track again) :
+        if expected_end_time - self.track_end_lead > self.last_poll_time + self.track_change_interval:
+            # mid-track: next poll just before the expected end (or sooner, if that's far off) :
+            return min(self.last_poll_time + self.max_mid_track_interval, expected_end_time - self.track_end_lead)
+        if expected_end_time + self.track_end_margin > self.last_poll_time:
+            # polled just before the expected end; next poll just after it:
+            return expected_end_time + self.track_end_margin
+        # past the expected end and the track hasn't changed yet:
+        return self.last_poll_time + self.track_change_interval
+
+    # Function: start polling on a daemon thread.
+    def start(self):
+        thread = threading.Thread(target=self.run, name='playback_state_service', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        while True:
+            with self.lock:
+                next_poll_time = self.get_next_poll_time()
+                if self.refresh_due_time is not None:
+                    next_poll_time = min(next_poll_time, self.refresh_due_time)
+            wait_seconds = next_poll_time - time.time()
+            if wait_seconds > 0:
+                # woken early if a refresh is requested (which may be sooner than this):
+                self.wake.wait(wait_seconds)
+                self.wake.clear()
+                continue
+            with self.lock:
+                is_refresh = self.refresh_due_time is not None
+                CLI_print = self.refresh_CLI_print
+                self.refresh_due_time = None
+                self.refresh_CLI_print = False
+            try:
+                self.poll(is_refresh, CLI_print)
+            except Exception as e:
+                print("~\nError polling playback state. If you have an active player, maybe play and pause the player manually, then retry control from this script. OR There was some other error. Printing the error response:")
+                print(e)
+
+def get_track_ID(playback):
+    if playback and playback.get('item'):
+        return playback['item'].get('id')
+    return None
+
+def get_context_uri(playback):
+    if playback and playback.get('context'):
+        return playback['context'].get('uri')
+    return None
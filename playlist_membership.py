@@ -0,0 +1,106 @@
+# DESCRIPTION
+# An in-memory index of which of the user's own playlists contain each track, so that the info window can show "also in playlists X, Y, Z" for every track it draws with no API call (and no database query).
+# The index is built from the local library database (see library_database.py) in one query, then kept current incrementally: the database calls it back whenever a playlist's local copy changes (re-downloaded by a sync, or changed by a hotkey through a record_* method, or removed), and only that playlist is re-read. A background thread re-syncs the user's playlists every refresh_interval seconds (which re-downloads only playlists whose snapshot_id changed, for example by edits from the Spotify app).
+
+# USAGE
+#    from playlist_membership import PlaylistMembershipIndex
+#    playlist_membership = PlaylistMembershipIndex(library_database)
+#    playlist_membership.start_background_refresh(lambda: metadata_cache.get_current_user()['id'])
+#    playlist_membership.get_playlist_names(track_ID)    # sorted names, or None if not built yet
+
+import threading
+import time
+from library_database import get_spotify_id
+
+class PlaylistMembershipIndex:
+    def __init__(self, library_database, refresh_interval=600):
+        self.library_database = library_database
+        self.refresh_interval = refresh_interval
+        self.owner_id = None
+        # track ID -> set of playlist IDs, and the reverse (to update one playlist's tracks in place):
+        self.track_playlists = {}
+        self.playlist_tracks = {}
+        self.playlist_names = {}
+        self.is_built = False
+        self.lock = threading.Lock()
+        # playlists changed while a build is reading the database, which are re-read after it so their changes aren't lost:
+        self.changes_during_build = None
+        library_database.subscribe(self.update_playlist)
+
+    # Function: build the index of the playlists owned by owner_id from the local library database.
+    def build(self, owner_id):
+        with self.lock:
+            self.owner_id = owner_id
+            self.changes_during_build = set()
+        track_playlists = {}
+        playlist_tracks = {}
+        playlist_names = {}
+        for playlist_id, name, track_id in self.library_database.query('SELECT playlists.playlist_id, playlists.name, playlist_tracks.track_id FROM playlists LEFT JOIN playlist_tracks ON playlist_tracks.playlist_id = playlists.playlist_id WHERE playlists.owner_id = ?', (owner_id,)):
+            playlist_names[playlist_id] = name
+            playlist_tracks.setdefault(playlist_id, set())
+            if track_id:
+                track_playlists.setdefault(track_id, set()).add(playlist_id)
+                playlist_tracks[playlist_id].add(track_id)
+        with self.lock:
+            self.track_playlists = track_playlists
+            self.playlist_tracks = playlist_tracks
+            self.playlist_names = playlist_names
+            changed_playlist_ids = self.changes_during_build
+            self.changes_during_build = None
+            self.is_built = True
+        for playlist_id in changed_playlist_ids:
+            self.update_playlist(playlist_id)
+        return len(playlist_names)
+
+    # Function: re-read one playlist from the local library database into the index (dropping it if it's gone or not the user's). Called back by the library database on every change to a playlist.
+    def update_playlist(self, playlist_id):
+        playlist_id = get_spotify_id(playlist_id)
+        with self.lock:
+            if self.changes_during_build is not None:
+                self.changes_during_build.add(playlist_id)
+                return
+            if not self.is_built:
+                return
+            owner_id = self.owner_id
+        rows = self.library_database.query('SELECT name FROM playlists WHERE playlist_id = ? AND owner_id = ?', (playlist_id, owner_id))
+        track_ids = set(row[0] for row in self.library_database.query('SELECT DISTINCT track_id FROM playlist_tracks WHERE playlist_id = ? AND track_id IS NOT NULL', (playlist_id,))) if rows else set()
+        with self.lock:
+            for track_id in self.playlist_tracks.pop(playlist_id, set()) - track_ids:
+                playlists = self.track_playlists.get(track_id)
+                if playlists:
+                    playlists.discard(playlist_id)
+                    if not playlists:
+                        del self.track_playlists[track_id]
+            self.playlist_names.pop(playlist_id, None)
+            if not rows:
+                return
+            self.playlist_names[playlist_id] = rows[0][0]
+            self.playlist_tracks[playlist_id] = track_ids
+            for track_id in track_ids:
+                self.track_playlists.setdefault(track_id, set()).add(playlist_id)
+
+    # Function: return the sorted names of the user's playlists containing a track (ID, URI or URL), or None if the index hasn't been built yet.
+    def get_playlist_names(self, track_id):
+        with self.lock:
+            if not self.is_built:
+                return None
+            return sorted((self.playlist_names.get(playlist_id) or '' for playlist_id in self.track_playlists.get(get_spotify_id(track_id), ())), key=str.lower)
+
+    # Function: build the index (get_owner_id is called for the user's ID, on the thread), then re-sync the user's playlists every refresh_interval seconds, on a daemon thread.
+    def start_background_refresh(self, get_owner_id):
+        thread = threading.Thread(target=self.run_refresh, args=(get_owner_id,), name='playlist_membership', daemon=True)
+        thread.start()
+        return thread
+
+    def run_refresh(self, get_owner_id):
+        while True:
+            try:
+                if self.is_built:
+                    self.library_database.sync_playlists()
+                else:
+                    playlist_count = self.build(get_owner_id())
+                    print("~\nIndexed the tracks of", playlist_count, "of your playlists for the info window.")
+            except Exception as e:
+                print("~\nError building or refreshing the playlist membership index; will retry.")
+                print(e)
+            time.sleep(self.refresh_interval)
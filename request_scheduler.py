@@ -0,0 +1,159 @@
+# DESCRIPTION
+# A shared scheduler that every Web API call goes through (see InstrumentedSpotify), so that bulk jobs (discography builds, library syncs..) run at the fastest rate the API tolerates without getting rate limited (HTTP 429) into failure, and without starving the playback hotkeys:
+# - a token bucket limits the sustained request rate (rate per second, with bursts up to burst requests)
+# - calls wait in a priority queue: INTERACTIVE (hotkeys) before BACKGROUND (playback polling and other upkeep) before BULK (big jobs). A few tokens are reserved for interactive calls, and interactive calls aren't subject to the concurrency limit, so a bulk job can't take every slot.
+# - adaptive concurrency: the number of BACKGROUND / BULK calls in flight at once grows by one after every concurrency_limit successful calls, and halves on every 429 (additive increase, multiplicative decrease)
+# - on a 429 every call waits as long as the API's Retry-After header says (in seconds or as an HTTP date; or a backoff, if it doesn't say or can't be parsed), and the call is retried. Other transient failures (server errors, network errors) are retried with exponential backoff, but only for idempotent calls: a call that isn't (such as adding tracks to a playlist, or creating one) may have been applied before it failed, so retrying it could apply it twice. Those are only retried on 429s (which are refused, not applied); callers that can check whether a failed call was applied may retry it themselves (see discography.add_items_with_retry).
+# For 429s to reach this scheduler (with their Retry-After header) the spotipy client must not retry them itself: create it with status_forcelist=(500, 502, 503, 504), and pass it to stop_client_rate_limit_retries (as urllib3, under spotipy, otherwise retries any 429 that has a Retry-After header, whatever status_forcelist says, and retries POSTs, PUTs and DELETEs on server errors).
+
+# USAGE
+#    from request_scheduler import RequestScheduler, INTERACTIVE
+#    request_scheduler = RequestScheduler()
+#    request_scheduler.run(INTERACTIVE, sp.current_playback)
+#    request_scheduler.run(INTERACTIVE, sp.next_track, idempotent=False)
+#    stop_client_rate_limit_retries(client)
+
+import datetime
+import email.utils
+import heapq
+import itertools
+import threading
+import time
+
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background', BULK: 'bulk'}
+TRANSIENT_HTTP_STATUSES = (429, 500, 502, 503, 504)
+
+# Function: return True if an exception from an API call is worth retrying: rate limiting, or, if the call is idempotent, a server error or a network error (requests' exceptions are OSErrors).
+def is_transient_error(e, idempotent=True):
+    if getattr(e, 'http_status', None) == 429:
+        return True
+    return idempotent and (getattr(e, 'http_status', None) in TRANSIENT_HTTP_STATUSES or isinstance(e, OSError))
+
+# Function: return the seconds a Retry-After header value asks to wait: either a number of seconds or an HTTP date. Returns None if the value is neither.
+def parse_retry_after(retry_after):
+    try:
+        return max(float(retry_after), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_time = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_time is None:
+        return None
+    if retry_time.tzinfo is None:
+        # (a date with a -0000 zone parses as naive; HTTP dates are in UTC:)
+        retry_time = retry_time.replace(tzinfo=datetime.timezone.utc)
+    return max(retry_time.timestamp() - time.time(), 0.0)
+
+# Function: make a spotipy client's HTTP layer (urllib3 Retry, under its requests session) stop retrying responses that have a Retry-After header, so that 429s reach the scheduler, and stop retrying anything but GETs on server errors (POSTs aren't idempotent, nor are PUTs and DELETEs that reorder or remove playlist items by position). Returns the client.
+def stop_client_rate_limit_retries(client):
+    session = getattr(client, '_session', None)
+    for adapter in (session.adapters.values() if session else ()):
+        retry = getattr(adapter, 'max_retries', None)
+        if retry is not None:
+            retry.respect_retry_after_header = False
+            retry.allowed_methods = frozenset(['GET'])
+    return client
+
+class RequestScheduler:
+    def __init__(self, rate=10.0, burst=20, max_concurrency=16, initial_concurrency=4, interactive_token_reserve=3, max_retries=5, backoff_seconds=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.concurrency_limit = initial_concurrency
+        self.interactive_token_reserve = interactive_token_reserve
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.tokens = float(burst)
+        self.last_refill_time = time.monotonic()
+        self.paused_until = 0
+        self.in_flight = 0
+        self.successes_since_increase = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.rate_limited_count = 0
+        self.retry_count = 0
+
+    # Function: call function(*args, **kwargs) when the scheduler admits it at priority, retrying transient failures (only 429s, unless idempotent). on_retry (if passed) is called before every retry, for statistics.
+    def run(self, priority, function, *args, on_retry=None, idempotent=True, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.acquire(priority)
+            try:
+                result = function(*args, **kwargs)
+            except Exception as e:
+                is_rate_limited = getattr(e, 'http_status', None) == 429
+                self.release(priority, is_rate_limited)
+                if attempt == self.max_retries or not is_transient_error(e, idempotent):
+                    raise
+                self.wait_before_retry(e, attempt, is_rate_limited)
+                if on_retry:
+                    on_retry()
+                continue
+            self.release(priority, False)
+            return result
+
+    def wait_before_retry(self, e, attempt, is_rate_limited):
+        retry_after = (getattr(e, 'headers', None) or {}).get('Retry-After')
+        wait_seconds = parse_retry_after(retry_after) if retry_after else None
+        if wait_seconds is None:
+            wait_seconds = self.backoff_seconds * (2 ** attempt)
+        with self.condition:
+            self.retry_count += 1
+            if is_rate_limited:
+                # everyone waits out a rate limit, not just this call:
+                self.rate_limited_count += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + wait_seconds)
+                print("~\nRate limited by the API (HTTP 429); pausing API calls for", wait_seconds, "seconds and limiting concurrent background calls to", self.concurrency_limit)
+                self.condition.notify_all()
+                return
+        time.sleep(wait_seconds)
+
+    # Function: wait until a call at priority may start: it's the highest priority (then oldest) waiting call, any Retry-After pause is over, there's a token for it (beyond the interactive reserve, for non-interactive calls), and (for non-interactive calls) fewer than concurrency_limit are in flight.
+    def acquire(self, priority):
+        with self.condition:
+            entry = (priority, next(self.sequence))
+            heapq.heappush(self.waiting, entry)
+            while True:
+                now = time.monotonic()
+                self.refill(now)
+                wait_seconds = None
+                if self.waiting[0] == entry:
+                    required_tokens = 1 if priority == INTERACTIVE else 1 + self.interactive_token_reserve
+                    if now < self.paused_until:
+                        wait_seconds = self.paused_until - now
+                    elif self.tokens < required_tokens:
+                        wait_seconds = (required_tokens - self.tokens) / self.rate
+                    elif priority == INTERACTIVE or self.in_flight < self.concurrency_limit:
+                        heapq.heappop(self.waiting)
+                        self.tokens -= 1
+                        self.in_flight += 1
+                        # the next waiting call may be able to start too:
+                        self.condition.notify_all()
+                        return
+                self.condition.wait(wait_seconds)
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill_time) * self.rate)
+        self.last_refill_time = now
+
+    def release(self, priority, is_rate_limited):
+        with self.condition:
+            self.in_flight -= 1
+            if is_rate_limited:
+                self.concurrency_limit = max(1, self.concurrency_limit // 2)
+                self.successes_since_increase = 0
+            elif priority != INTERACTIVE:
+                self.successes_since_increase += 1
+                if self.successes_since_increase >= self.concurrency_limit:
+                    self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1)
+                    self.successes_since_increase = 0
+            self.condition.notify_all()
+
+    def get_status(self):
+        with self.condition:
+            return {'concurrency_limit': self.concurrency_limit, 'in_flight': self.in_flight, 'waiting': len(self.waiting), 'tokens': round(self.tokens, 1), 'rate_limited': self.rate_limited_count, 'retries': self.retry_count}
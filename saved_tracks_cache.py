@@ -0,0 +1,121 @@
+# DESCRIPTION
+# An in-memory set of the IDs of every track in the user's Liked Songs (saved tracks), so that "is the current track liked?" (the heart glyph in the info window) is answered with no API call.
+# The set is seeded once by paging through current_user_saved_tracks, updated in place by the hotkeys that save/unsave tracks, and reconciled in the background now and then with one cheap request (the first page of saved tracks), re-seeding only if that shows the set is out of date (for example because tracks were liked/unliked from the Spotify app).
+# If a library database is passed (see library_database.py), the set is seeded from its copy of Liked Songs instead, after syncing that (which only re-downloads them if they changed), so Liked Songs are paged through once at startup, not once for each.
+
+# USAGE
+#    from saved_tracks_cache import SavedTracksCache
+#    saved_tracks_cache = SavedTracksCache(sp, library_database)
+#    saved_tracks_cache.start_background_reconciliation()
+#    saved_tracks_cache.contains(track_ID)    # True, False, or None if not seeded yet
+
+import threading
+import time
+import pagination
+from library_database import get_spotify_id
+
+class SavedTracksCache:
+    def __init__(self, sp, library_database=None, reconcile_interval=300):
+        self.sp = sp
+        self.library_database = library_database
+        self.reconcile_interval = reconcile_interval
+        self.track_ids = set()
+        # the number of Liked Songs items, including those without a track ID (unavailable tracks..), which aren't in track_ids, to compare with the API's total:
+        self.total = None
+        self.is_seeded = False
+        self.lock = threading.Lock()
+        # changes made (by add / discard) while a seed is paging through saved tracks, which are re-applied to the seeded set so they aren't lost:
+        self.changes_during_seed = None
+
+    # Function: replace the set with all saved tracks: from the library database (synced first), if there is one, else paged through from the API. Returns the number of track IDs; raises (leaving the set as it was) if they couldn't be loaded.
+    def seed(self):
+        with self.lock:
+            self.changes_during_seed = []
+        try:
+            if self.library_database:
+                self.library_database.sync_saved_tracks()
+                track_ids, total = self.library_database.get_saved_tracks()
+            else:
+                items = list(pagination.iterate_items(self.sp, self.sp.current_user_saved_tracks(limit=50)))
+                track_ids = set(item['track']['id'] for item in items if item.get('track') and item['track'].get('id'))
+                total = len(items)
+        except:
+            with self.lock:
+                self.changes_during_seed = None
+            raise
+        with self.lock:
+            for is_add, track_id in self.changes_during_seed:
+                if is_add and track_id not in track_ids:
+                    track_ids.add(track_id)
+                    total += 1
+                elif not is_add and track_id in track_ids:
+                    track_ids.discard(track_id)
+                    total -= 1
+            self.changes_during_seed = None
+            self.track_ids = track_ids
+            self.total = total
+            self.is_seeded = True
+        return len(track_ids)
+
+    # Function: check the set against the first page of saved tracks (one request); re-seed if the total count differs or any recently saved track is missing from the set. Returns True if it had to re-seed.
+    def reconcile(self):
+        results = self.sp.current_user_saved_tracks(limit=50)
+        recent_track_ids = [item['track']['id'] for item in results['items'] if item.get('track') and item['track'].get('id')]
+        with self.lock:
+            is_current = self.is_seeded and results['total'] == self.total and all(track_id in self.track_ids for track_id in recent_track_ids)
+        if is_current:
+            return False
+        self.seed()
+        return True
+
+    # Function: return True or False for whether a track (ID, URI or URL) is in Liked Songs, or None if the set hasn't been seeded yet (the caller should then ask the API).
+    def contains(self, track_id):
+        with self.lock:
+            if not self.is_seeded:
+                return None
+            return get_spotify_id(track_id) in self.track_ids
+
+    # Function: return a copy of the set of Liked Songs track IDs, or None if it hasn't been seeded yet.
+    def get_track_ids(self):
+        with self.lock:
+            if not self.is_seeded:
+                return None
+            return set(self.track_ids)
+
+    def add(self, track_ids):
+        self.apply_changes(True, track_ids)
+
+    def discard(self, track_ids):
+        self.apply_changes(False, track_ids)
+
+    def apply_changes(self, is_add, track_ids):
+        with self.lock:
+            for track_id in track_ids:
+                track_id = get_spotify_id(track_id)
+                if is_add and track_id not in self.track_ids:
+                    self.track_ids.add(track_id)
+                    self.total = self.total + 1 if self.total is not None else None
+                elif not is_add and track_id in self.track_ids:
+                    self.track_ids.discard(track_id)
+                    self.total = self.total - 1 if self.total is not None else None
+                if self.changes_during_seed is not None:
+                    self.changes_during_seed.append((is_add, track_id))
+
+    # Function: seed the set, then reconcile it every reconcile_interval seconds, on a daemon thread.
+    def start_background_reconciliation(self):
+        thread = threading.Thread(target=self.run_reconciliation, name='saved_tracks_cache', daemon=True)
+        thread.start()
+        return thread
+
+    def run_reconciliation(self):
+        while True:
+            try:
+                if self.is_seeded:
+                    self.reconcile()
+                else:
+                    track_count = self.seed()
+                    print("~\nCached", track_count, "Liked Songs track IDs for the info window.")
+            except Exception as e:
+                print("~\nError seeding or reconciling cached Liked Songs track IDs; will retry.")
+                print(e)
+            time.sleep(self.reconcile_interval)
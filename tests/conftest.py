@@ -0,0 +1,23 @@
+# DESCRIPTION
+# Shared pytest fixtures: a local fake Spotify Web API (see fake_spotify_api.py) with a small generated library, and a spotipy client pointed at it, so tests run without a Spotify account or network access.
+
+# USAGE
+#    python -m pytest -q
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_spotify_api import FakeSpotifyAPIServer, FakeSpotifyLibrary
+
+@pytest.fixture
+def server():
+    server = FakeSpotifyAPIServer(FakeSpotifyLibrary(main_artist_count=1, albums_per_artist=2, playlist_sizes=(120, 30), saved_track_count=50, filler_artist_count=10)).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def sp(server):
+    return server.create_client()
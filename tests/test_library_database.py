@@ -0,0 +1,115 @@
+import os
+import pytest
+from library_database import LibraryDatabase
+
+@pytest.fixture
+def library_database(sp, tmp_path):
+    library_database = LibraryDatabase(sp, os.path.join(str(tmp_path), 'library.db'))
+    yield library_database
+    library_database.connection.close()
+
+@pytest.fixture
+def playlist_id(server):
+    return list(server.library.playlists)[0]
+
+def get_server_track_ids(server, playlist_id):
+    return [item['track_id'] for item in server.library.playlist_items[playlist_id]]
+
+def get_unused_track_ids(server, playlist_id, count):
+    used_track_ids = set(get_server_track_ids(server, playlist_id))
+    return [track_id for track_id in server.library.tracks if track_id not in used_track_ids][:count]
+
+def test_sync_playlist_skips_unchanged_snapshot(server, library_database, playlist_id):
+    assert library_database.sync_playlist(playlist_id)
+    request_count = server.request_count
+    assert not library_database.sync_playlist(playlist_id)
+    # (only the snapshot_id was fetched:)
+    assert server.request_count - request_count == 1
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+
+def test_sync_playlists_downloads_only_changed_playlists(sp, server, library_database, playlist_id):
+    assert library_database.sync_playlists()['playlists_downloaded'] == len(server.library.playlists)
+    assert library_database.sync_playlists()['playlists_downloaded'] == 0
+    sp.playlist_add_items(playlist_id, get_unused_track_ids(server, playlist_id, 1))
+    assert library_database.sync_playlists()['playlists_downloaded'] == 1
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+
+def test_sync_playlist_downloads_again_after_outside_change(sp, server, library_database, playlist_id):
+    library_database.sync_playlist(playlist_id)
+    track_id = get_unused_track_ids(server, playlist_id, 1)[0]
+    # (a change made elsewhere, such as in the Spotify app, isn't recorded:)
+    sp.playlist_add_items(playlist_id, [track_id])
+    assert library_database.playlist_contains(playlist_id, track_id) is False
+    assert library_database.sync_playlist(playlist_id)
+    assert library_database.playlist_contains(playlist_id, track_id) is True
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+
+def test_record_tracks_added_with_matching_snapshot(sp, server, library_database, playlist_id):
+    library_database.sync_playlist(playlist_id)
+    track_ids = get_unused_track_ids(server, playlist_id, 2)
+    expected_snapshot_id = library_database.get_snapshot_id(playlist_id)
+    result = sp.playlist_add_items(playlist_id, track_ids)
+    library_database.record_tracks_added(playlist_id, track_ids, result['snapshot_id'], expected_snapshot_id)
+    assert library_database.get_snapshot_id(playlist_id) == result['snapshot_id']
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+    assert not library_database.sync_playlist(playlist_id)
+
+def test_record_tracks_added_with_mismatched_snapshot(sp, server, library_database, playlist_id):
+    library_database.sync_playlist(playlist_id)
+    outside_track_id, track_id = get_unused_track_ids(server, playlist_id, 2)
+    sp.playlist_add_items(playlist_id, [outside_track_id])
+    # (the playlist's snapshot_id just before the change, as the hotkeys fetch it:)
+    expected_snapshot_id = library_database.fetch_snapshot_id(playlist_id)
+    result = sp.playlist_add_items(playlist_id, [track_id])
+    library_database.record_tracks_added(playlist_id, [track_id], result['snapshot_id'], expected_snapshot_id)
+    # the local copy missed the outside add, so the change isn't mirrored onto it, and it's forgotten:
+    assert library_database.get_snapshot_id(playlist_id) is None
+    assert library_database.playlist_contains(playlist_id, track_id) is None
+    assert library_database.sync_playlist(playlist_id)
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+
+def test_record_tracks_added_without_expected_snapshot(sp, server, library_database, playlist_id):
+    library_database.sync_playlist(playlist_id)
+    track_id = get_unused_track_ids(server, playlist_id, 1)[0]
+    result = sp.playlist_add_items(playlist_id, [track_id])
+    library_database.record_tracks_added(playlist_id, [track_id], result['snapshot_id'])
+    assert library_database.get_snapshot_id(playlist_id) is None
+
+def test_record_tracks_removed_with_matching_snapshot(sp, server, library_database, playlist_id):
+    library_database.sync_playlist(playlist_id)
+    track_id = get_server_track_ids(server, playlist_id)[3]
+    expected_snapshot_id = library_database.get_snapshot_id(playlist_id)
+    result = sp.playlist_remove_all_occurrences_of_items(playlist_id, [track_id])
+    library_database.record_tracks_removed(playlist_id, [track_id], result['snapshot_id'], expected_snapshot_id)
+    assert library_database.get_snapshot_id(playlist_id) == result['snapshot_id']
+    assert library_database.playlist_contains(playlist_id, track_id) is False
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+    assert not library_database.sync_playlist(playlist_id)
+
+def test_record_tracks_removed_with_mismatched_snapshot(sp, server, library_database, playlist_id):
+    library_database.sync_playlist(playlist_id)
+    outside_track_id, track_id = get_server_track_ids(server, playlist_id)[:2]
+    sp.playlist_remove_all_occurrences_of_items(playlist_id, [outside_track_id])
+    expected_snapshot_id = library_database.fetch_snapshot_id(playlist_id)
+    result = sp.playlist_remove_all_occurrences_of_items(playlist_id, [track_id])
+    library_database.record_tracks_removed(playlist_id, [track_id], result['snapshot_id'], expected_snapshot_id)
+    assert library_database.get_snapshot_id(playlist_id) is None
+    assert library_database.sync_playlist(playlist_id)
+    assert library_database.get_playlist_track_ids(playlist_id) == get_server_track_ids(server, playlist_id)
+
+def test_recorded_saves_and_unsaves_keep_saved_tracks_current(sp, server, library_database):
+    assert library_database.sync_saved_tracks()
+    saved_track_ids = [track_id for track_id, added_at in server.library.saved_tracks]
+    track_id = next(track_id for track_id in server.library.tracks if track_id not in set(saved_track_ids))
+    sp.current_user_saved_tracks_add([track_id])
+    library_database.record_saved_tracks_added([track_id])
+    sp.current_user_saved_tracks_delete([saved_track_ids[0]])
+    library_database.record_saved_tracks_removed([saved_track_ids[0]])
+    assert not library_database.sync_saved_tracks()
+    track_ids, total = library_database.get_saved_tracks()
+    assert track_ids == set(track_id for track_id, added_at in server.library.saved_tracks)
+    assert total == len(server.library.saved_tracks)
+    # a recorded save undone elsewhere leaves the marker different from the first page:
+    sp.current_user_saved_tracks_delete([track_id])
+    assert library_database.sync_saved_tracks()
+    assert track_id not in library_database.get_saved_tracks()[0]
@@ -0,0 +1,84 @@
+import json
+import os
+import time
+import pytest
+from spotipy.oauth2 import SpotifyOAuth
+from token_lifecycle import AtomicTokenCacheHandler, TokenLifecycleManager
+
+OLD_TOKEN_INFO = {'access_token': 'old_access_token', 'token_type': 'Bearer', 'expires_in': 3600, 'refresh_token': 'fake_refresh_token', 'scope': ''}
+
+@pytest.fixture
+def cache_path(tmp_path):
+    cache_path = os.path.join(str(tmp_path), '.cache-test')
+    AtomicTokenCacheHandler(cache_path=cache_path).save_token_to_cache(dict(OLD_TOKEN_INFO, expires_at=int(time.time()) + 3600))
+    return cache_path
+
+# Function: return a TokenLifecycleManager with its token loaded from cache_path, refreshing at server's token endpoint.
+def make_token_manager(server, cache_path, **options):
+    auth_manager = SpotifyOAuth(client_id='fake_client_id', client_secret='fake_client_secret', redirect_uri='http://127.0.0.1/callback', cache_handler=AtomicTokenCacheHandler(cache_path=cache_path), requests_timeout=0.5, open_browser=False)
+    token_manager = TokenLifecycleManager(auth_manager, token_url=server.token_url, **options)
+    assert token_manager.get_access_token() == 'old_access_token'
+    return token_manager
+
+def read_cached_token_info(cache_path):
+    with open(cache_path, encoding='UTF-8') as cache_file:
+        return json.load(cache_file)
+
+def list_temporary_files(cache_path):
+    return [name for name in os.listdir(os.path.dirname(cache_path)) if name.endswith('.tmp')]
+
+@pytest.mark.parametrize('failure', ['error', 'timeout'])
+def test_failed_refresh_keeps_old_token(server, cache_path, failure):
+    token_manager = make_token_manager(server, cache_path)
+    if failure == 'error':
+        server.token_error_status = 500
+    else:
+        server.token_latency = 2
+    with pytest.raises(Exception):
+        token_manager.refresh()
+    assert token_manager.get_access_token() == 'old_access_token'
+    assert read_cached_token_info(cache_path)['access_token'] == 'old_access_token'
+    assert token_manager.get_metrics()['failures'] == 1
+    server.token_error_status = None
+    server.token_latency = 0
+    token_manager.refresh()
+    assert token_manager.get_access_token().startswith('fake_access_token')
+    assert read_cached_token_info(cache_path)['access_token'] == token_manager.get_access_token()
+    assert token_manager.get_metrics()['consecutive_failures'] == 0
+
+def test_background_refresh_backs_off_while_endpoint_fails(server, cache_path):
+    # (refresh_margin longer than the token lasts, so the background thread refreshes right away:)
+    token_manager = make_token_manager(server, cache_path, refresh_margin=7200, retry_interval=0.05, max_retry_interval=0.4)
+    server.token_error_status = 503
+    token_manager.start()
+    time.sleep(1.2)
+    failed_request_count = server.token_request_count
+    # waits of 0.05, 0.1, 0.2, 0.4, 0.4.. seconds between attempts, rather than an attempt every 0.05 seconds:
+    assert 3 <= failed_request_count <= 8
+    assert token_manager.get_retry_interval() == 0.4
+    assert token_manager.get_access_token() == 'old_access_token'
+    server.token_error_status = None
+    deadline = time.time() + 3
+    while token_manager.get_access_token() == 'old_access_token' and time.time() < deadline:
+        time.sleep(0.05)
+    assert token_manager.get_access_token().startswith('fake_access_token')
+    assert token_manager.get_retry_interval() == 0.05
+
+def test_failed_cache_write_leaves_cache_file_whole(cache_path, monkeypatch):
+    cache_handler = AtomicTokenCacheHandler(cache_path=cache_path)
+    # a write that fails partway (the new token written to the temporary file, but not flushed to disk):
+    def fail_fsync(file_descriptor):
+        raise OSError('No space left on device')
+    monkeypatch.setattr(os, 'fsync', fail_fsync)
+    with pytest.raises(OSError):
+        cache_handler.save_token_to_cache(dict(OLD_TOKEN_INFO, access_token='new_access_token'))
+    assert read_cached_token_info(cache_path)['access_token'] == 'old_access_token'
+    assert list_temporary_files(cache_path) == []
+    # a token that can't be serialized:
+    with pytest.raises(TypeError):
+        cache_handler.save_token_to_cache({'access_token': 'new_access_token', 'not_serializable': object()})
+    assert read_cached_token_info(cache_path)['access_token'] == 'old_access_token'
+    monkeypatch.undo()
+    cache_handler.save_token_to_cache(dict(OLD_TOKEN_INFO, access_token='new_access_token'))
+    assert read_cached_token_info(cache_path)['access_token'] == 'new_access_token'
+    assert list_temporary_files(cache_path) == []
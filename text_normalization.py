@@ -0,0 +1,17 @@
+# DESCRIPTION
+# Normalization of track titles and artist names, for comparing them across albums, services and exports (see track_matching.py and discography.py): lowercased, without accents, bracketed parts ("(feat. X)", "[Remastered]"), " - Remastered 2011" style suffixes and punctuation.
+
+# USAGE
+#    from text_normalization import normalize_text
+#    normalize_text('Café del Mar (feat. X) - Remastered 2011')    # 'cafe del mar'
+
+import re
+import unicodedata
+
+# Function: return text lowercased, without accents, bracketed parts ("(feat. X)", "[Remastered]"), " - Remastered 2011" style suffixes and punctuation, for comparing titles and artist names.
+def normalize_text(text):
+    text = ''.join(character for character in unicodedata.normalize('NFKD', text or '') if not unicodedata.combining(character)).casefold()
+    text = re.sub(r'\s*[\(\[][^\)\]]*[\)\]]', ' ', text)
+    text = re.sub(r'\s+-\s+.*\b(remaster|remastered|version|live|edit|mix|mono|stereo|single|demo)\b.*$', '', text)
+    text = text.replace('&', ' and ')
+    return ' '.join(re.sub(r'[^\w\s]', ' ', text).split())
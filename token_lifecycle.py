@@ -0,0 +1,178 @@
+# DESCRIPTION
+# Keeps a valid Spotify access token ready in memory, so that no hotkey waits on (or fails at) an OAuth token refresh after the script has been idle for hours:
+# - TokenLifecycleManager wraps a spotipy auth manager (SpotifyOAuth) and is passed to spotipy.Spotify as its auth_manager. Its get_access_token returns the in-memory token; only if that has (nearly) expired, for example after the computer slept, does the caller refresh it, synchronously. A caller never waits on a refresh the background thread is making while the current token is still valid: refreshes (and loads) run outside the lock guarding the token, which is only held to read or swap it.
+# - a background thread loads the token (retrying until it can, for example if the network was down at startup), then refreshes it refresh_margin seconds before it expires. If loading or refreshing fails, the token in memory (and the cache file) is kept, and the thread retries after retry_interval seconds, doubling the wait after each further consecutive failure, up to max_retry_interval, so an endpoint that's down isn't hammered. Waits are capped at check_interval seconds and measured against the wall clock, so a refresh that came due during sleep is done soon after waking.
+# - AtomicTokenCacheHandler is spotipy's CacheFileHandler (same file, .cache-<username> by default), but persists tokens atomically: to a temporary file next to the cache file, which then replaces it (see atomic_file.py), so a crash mid-write can't lose the refresh token.
+# Refresh timing (count, failures, consecutive failures, refreshes callers had to wait on, durations) is available from get_metrics / print_metrics.
+# The token endpoint can be overridden (token_url) to test against a local fake endpoint (see fake_spotify_api.py, and tests/test_token_lifecycle.py).
+
+# USAGE
+#    from token_lifecycle import TokenLifecycleManager, AtomicTokenCacheHandler
+#    AUTH_MANAGER = SpotifyOAuth(client_id=CLIENT_ID, client_secret=CLIENT_SECRET, redirect_uri=REDIRECT_URI, scope=API_SCOPE, cache_handler=AtomicTokenCacheHandler(username=USERNAME))
+#    token_manager = TokenLifecycleManager(AUTH_MANAGER)
+#    sp = spotipy.Spotify(auth_manager=token_manager)
+#    token_manager.start()
+#    token_manager.print_metrics()
+
+import collections
+import threading
+import time
+from spotipy.cache_handler import CacheFileHandler
+import atomic_file
+
+class AtomicTokenCacheHandler(CacheFileHandler):
+    def save_token_to_cache(self, token_info):
+        atomic_file.write_json_atomically(self.cache_path, token_info, cls=self.encoder_cls)
+
+class TokenLifecycleManager:
+    def __init__(self, auth_manager, refresh_margin=300, minimum_validity=60, retry_interval=30, max_retry_interval=600, check_interval=60, token_url=None):
+        self.auth_manager = auth_manager
+        self.refresh_margin = refresh_margin
+        self.minimum_validity = minimum_validity
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.check_interval = check_interval
+        if token_url:
+            self.auth_manager.OAUTH_TOKEN_URL = token_url
+        self.token_info = None
+        # lock guards token_info and the counts (held only briefly); refresh_lock lets only one load or refresh talk to the token endpoint at a time:
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.thread = None
+        self.refresh_count = 0
+        self.failure_count = 0
+        # loads or refreshes that failed since the last that succeeded (for the background thread's backoff):
+        self.consecutive_failure_count = 0
+        # refreshes done by a caller that needed a token and found it expired, instead of ahead of time by the background thread:
+        self.blocking_refresh_count = 0
+        self.refresh_durations = collections.deque(maxlen=100)
+        self.last_refresh_time = None
+        self.last_error = None
+
+    # Everything but get_access_token goes to the wrapped auth manager:
+    def __getattr__(self, name):
+        return getattr(self.auth_manager, name)
+
+    # Function: return the access token (or, if as_dict, the whole token info), from memory unless it expires within minimum_validity seconds, in which case it's refreshed first (or, if there's none yet, loaded from the cache or obtained by authorizing). If the background thread is already refreshing it and it hasn't expired yet, the current token is returned without waiting.
+    def get_access_token(self, as_dict=False, check_cache=True):
+        with self.lock:
+            token_info = self.token_info
+        if token_info is None:
+            self.load()
+        else:
+            seconds_until_expiry = token_info['expires_at'] - time.time()
+            if seconds_until_expiry < self.minimum_validity and not (seconds_until_expiry > 0 and self.refresh_lock.locked()):
+                with self.lock:
+                    self.blocking_refresh_count += 1
+                self.refresh(token_info)
+        with self.lock:
+            token_info = self.token_info
+        if token_info is None:
+            raise RuntimeError('No API access token (loading it failed)')
+        return token_info if as_dict else token_info['access_token']
+
+    # Function: load the token from the cache (validate_token refreshes it if it's expired), or if there is none, go through the authorization flow. Does nothing if another thread loaded it meanwhile.
+    def load(self):
+        with self.refresh_lock:
+            if self.token_info is not None:
+                return
+            token_info = self.auth_manager.validate_token(self.auth_manager.cache_handler.get_cached_token())
+            if token_info is None:
+                self.auth_manager.get_access_token(as_dict=False)
+                token_info = self.auth_manager.cache_handler.get_cached_token()
+            with self.lock:
+                self.token_info = token_info
+                self.consecutive_failure_count = 0
+        self.wake_up.set()
+
+    # Function: refresh the token now, recording how long that took. If seen_token_info (the token the caller found needed refreshing) is passed and another thread has replaced it meanwhile, does nothing.
+    def refresh(self, seen_token_info=None):
+        with self.refresh_lock:
+            with self.lock:
+                token_info = self.token_info
+            if token_info is None or (seen_token_info is not None and token_info is not seen_token_info):
+                return
+            start_time = time.perf_counter()
+            try:
+                # (the token endpoint round trip, without holding self.lock, so callers can still read the current token:)
+                new_token_info = self.auth_manager.refresh_access_token(token_info['refresh_token'])
+            except Exception as e:
+                with self.lock:
+                    self.failure_count += 1
+                    self.consecutive_failure_count += 1
+                    self.last_error = e
+                raise
+            with self.lock:
+                self.token_info = new_token_info
+                self.refresh_durations.append(time.perf_counter() - start_time)
+                self.refresh_count += 1
+                self.last_refresh_time = time.time()
+                self.last_error = None
+                self.consecutive_failure_count = 0
+
+    def get_seconds_until_expiry(self):
+        with self.lock:
+            if self.token_info is None:
+                return None
+            return self.token_info['expires_at'] - time.time()
+
+    # Function: return how long the background thread waits before retrying a failed load or refresh: retry_interval, doubled for every consecutive failure after the first, at most max_retry_interval.
+    def get_retry_interval(self):
+        with self.lock:
+            consecutive_failure_count = self.consecutive_failure_count
+        return min(self.retry_interval * 2 ** max(consecutive_failure_count - 1, 0), self.max_retry_interval)
+
+    # Function: on a daemon thread (started once), load the token (if it isn't yet; retrying until that succeeds), then keep refreshing it ahead of expiry.
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='token_lifecycle', daemon=True)
+                self.thread.start()
+        return self.thread
+
+    def run(self):
+        while True:
+            if self.get_seconds_until_expiry() is None:
+                try:
+                    self.load()
+                except Exception as e:
+                    with self.lock:
+                        self.consecutive_failure_count += 1
+                    retry_interval = self.get_retry_interval()
+                    print("~\nError loading the API access token; will retry in", retry_interval, "seconds. Printing the error response:")
+                    print(e)
+                    time.sleep(retry_interval)
+                continue
+            seconds_until_refresh = self.get_seconds_until_expiry() - self.refresh_margin
+            if seconds_until_refresh > 0:
+                self.wake_up.wait(min(seconds_until_refresh, self.check_interval))
+                self.wake_up.clear()
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                retry_interval = self.get_retry_interval()
+                print("~\nError refreshing the API access token ahead of expiry; will retry in", retry_interval, "seconds. Printing the error response:")
+                print(e)
+                time.sleep(retry_interval)
+
+    def get_metrics(self):
+        with self.lock:
+            sorted_durations = sorted(self.refresh_durations)
+            seconds_until_expiry = self.get_seconds_until_expiry()
+            return {
+                'refreshes': self.refresh_count,
+                'failures': self.failure_count,
+                'consecutive_failures': self.consecutive_failure_count,
+                'blocking_refreshes': self.blocking_refresh_count,
+                'last_refresh_ms': round(self.refresh_durations[-1] * 1000, 1) if self.refresh_durations else None,
+                'median_refresh_ms': round(sorted_durations[len(sorted_durations) // 2] * 1000, 1) if sorted_durations else None,
+                'max_refresh_ms': round(sorted_durations[-1] * 1000, 1) if sorted_durations else None,
+                'last_refresh_time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.last_refresh_time)) if self.last_refresh_time else None,
+                'seconds_until_expiry': round(seconds_until_expiry) if seconds_until_expiry is not None else None,
+                'last_error': str(self.last_error) if self.last_error else None,
+            }
+
+    def print_metrics(self):
+        print("~\nAccess token refreshes:", self.get_metrics())
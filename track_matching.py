@@ -0,0 +1,218 @@
+# DESCRIPTION
+# Matches rows of foreign music lists (exports from other services, or any list of artist / title, optionally ISRC) to Spotify tracks, for importing them (see library_export.py):
+# - searches (sp.search) run on a bounded thread pool, streaming: rows are yielded back in their order as their matches arrive, with at most a few searches per worker in flight, so memory stays flat for any list size
+# - every search result (including "no match") is kept in a persistent cache (SQLite), keyed by ISRC if the row has one, else by normalized artist and title (lowercase, accents, bracketed and " - Remastered" style suffixes and punctuation stripped; see text_normalization.py), so re-imports and overlapping lists never search for the same track twice; rows with the same key in one run share one search
+# - rows that already have a Spotify track URI are passed through without a search
+# - a failed search leaves its row unmatched (counted as an error, and not cached) rather than stopping the run
+# Match counts, cache hit rate and throughput are available from get_metrics / print_metrics.
+
+# USAGE
+#    from track_matching import TrackMatcher
+#    track_matcher = TrackMatcher(sp)
+#    for row, track_uri in track_matcher.match_rows(rows):    # rows: dictionaries with track_name, artist_names, and optionally isrc, duration_ms, track_uri (as library_export.read_rows yields them)
+#        ...
+#    track_matcher.print_metrics()
+# -- or through library_export.py:
+#    python library_export.py import other_service_export.csv --match
+
+import collections
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from text_normalization import normalize_text
+
+DEFAULT_CACHE_PATH = 'Ansible_for_Spotify_track_matches.db'
+SEARCH_WORKERS = 8
+# searches in flight (or done, waiting for an earlier row's) per worker:
+ROWS_IN_FLIGHT_PER_WORKER = 4
+# results per text search to pick the best match from:
+SEARCH_RESULT_LIMIT = 10
+# a candidate whose duration is within this many ms of the row's is preferred:
+DURATION_TOLERANCE_MS = 3000
+
+# Function: return the normalized first artist of a list of artist names (separated by ';' as library_export.py writes them, or ',' as other exports do).
+def get_primary_artist(artist_names):
+    return normalize_text(re.split(r'[;,]', artist_names or '')[0])
+
+# Function: return the cache key of a row: its ISRC, or else its normalized artist and title (None if it has neither).
+def get_match_key(row):
+    isrc = (row.get('isrc') or '').strip().upper()
+    if isrc:
+        return 'isrc:' + isrc
+    artist = get_primary_artist(row.get('artist_names'))
+    title = normalize_text(row.get('track_name'))
+    if not title:
+        return None
+    return 'text:' + artist + '|' + title
+
+# Function: return the URI of the best matching track of candidates (track objects) for an artist and title (normalized) and duration, or None if none has both a matching title and artist. Of equally good matches, the one closest in duration wins.
+def pick_best_match(candidates, artist, title, duration_ms=None):
+    best_score = None
+    best_uri = None
+    for track in candidates:
+        if not track or not track.get('uri'):
+            continue
+        track_title = normalize_text(track.get('name'))
+        track_artists = [normalize_text(track_artist.get('name')) for track_artist in track.get('artists') or []]
+        if track_title == title:
+            score = 4
+        elif title and (title in track_title or track_title in title):
+            score = 2
+        else:
+            continue
+        if artist:
+            if artist in track_artists:
+                score += 4
+            elif any(artist in track_artist or track_artist in artist for track_artist in track_artists if track_artist):
+                score += 2
+            else:
+                continue
+        duration_difference = abs(int(duration_ms) - track['duration_ms']) if duration_ms and track.get('duration_ms') else 0
+        if duration_ms and duration_difference <= DURATION_TOLERANCE_MS:
+            score += 1
+        score = (score, -duration_difference)
+        if best_score is None or score > best_score:
+            best_score = score
+            best_uri = track['uri']
+    return best_uri
+
+class TrackMatcher:
+    def __init__(self, sp, cache_path=DEFAULT_CACHE_PATH, workers=SEARCH_WORKERS, market=None):
+        self.sp = sp
+        self.workers = workers
+        self.market = market
+        # the cache is read and written only on the thread iterating match_rows (searches run on the pool), but match may be called from others:
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS track_matches (match_key TEXT PRIMARY KEY, track_uri TEXT, matched_at REAL)')
+        self.counts = collections.Counter()
+        self.search_seconds = 0.0
+        self.match_seconds = 0.0
+
+    # Function: return the cached match of a key: (True, track URI or None for "no match"), or (False, None) if it isn't cached.
+    def get_cached(self, match_key):
+        with self.lock:
+            row = self.connection.execute('SELECT track_uri FROM track_matches WHERE match_key = ?', (match_key,)).fetchone()
+        return (True, row[0]) if row else (False, None)
+
+    def set_cached(self, match_key, track_uri):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO track_matches (match_key, track_uri, matched_at) VALUES (?, ?, ?)', (match_key, track_uri, time.time()))
+
+    # Function: search for a row's track: by ISRC first if it has one, then by artist and title. Returns the track URI or None. Runs on the worker threads.
+    def search(self, row):
+        start_time = time.perf_counter()
+        try:
+            isrc = (row.get('isrc') or '').strip().upper()
+            if isrc:
+                with self.lock:
+                    self.counts['searches'] += 1
+                items = self.sp.search(q='isrc:' + isrc, type='track', limit=1, market=self.market)['tracks']['items']
+                if items and items[0]:
+                    return items[0]['uri']
+            artist = get_primary_artist(row.get('artist_names'))
+            title = normalize_text(row.get('track_name'))
+            if not title:
+                return None
+            query = 'track:"' + title + '"' + (' artist:"' + artist + '"' if artist else '')
+            with self.lock:
+                self.counts['searches'] += 1
+            items = self.sp.search(q=query, type='track', limit=SEARCH_RESULT_LIMIT, market=self.market)['tracks']['items']
+            return pick_best_match(items, artist, title, row.get('duration_ms'))
+        finally:
+            with self.lock:
+                self.search_seconds += time.perf_counter() - start_time
+
+    # Function: return the track URI matching one row (from the cache, or by searching), or None.
+    def match(self, row):
+        return list(self.match_rows([row]))[0][1]
+
+    # Function: yield (row, track URI or None) for every row of rows (any iterable, consumed lazily), in order, searching for uncached rows on the thread pool. A row whose search failed is yielded with None (and counted under 'errors'), and its failure isn't cached, so the next run searches for it again.
+    def match_rows(self, rows):
+        start_time = time.perf_counter()
+        pending = collections.deque()
+        # searches in flight (or done, not yet cached) by key, so that rows with the same key share one:
+        searches = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='track_matching') as executor:
+                for row in rows:
+                    pending.append(self.resolve(row, executor, searches))
+                    while pending and (len(pending) > self.workers * ROWS_IN_FLIGHT_PER_WORKER or pending[0][2].done()):
+                        yield self.finish(*pending.popleft(), searches)
+                while pending:
+                    yield self.finish(*pending.popleft(), searches)
+        finally:
+            # (if the caller stopped early, searches not yet yielded aren't cached:)
+            with self.lock:
+                self.connection.commit()
+            self.match_seconds += time.perf_counter() - start_time
+
+    # Function: wait for a row's match; cache it if it was searched for. Returns (row, track URI or None), with None if the search failed.
+    def finish(self, row, match_key, future, searches):
+        try:
+            track_uri = future.result()
+        except Exception as e:
+            # (rows sharing the failed search are each counted, but the error is printed once:)
+            if match_key and searches.pop(match_key, None) is future:
+                print("~\nCould not search for track", repr(row.get('track_name')), "by", repr(row.get('artist_names')) + "; leaving it unmatched (and uncached).")
+                print(e)
+            self.counts['errors'] += 1
+            return row, None
+        if match_key and searches.pop(match_key, None) is future:
+            self.set_cached(match_key, track_uri)
+            self.counts['cache_writes'] += 1
+            if self.counts['cache_writes'] % 100 == 0:
+                with self.lock:
+                    self.connection.commit()
+        self.counts['matched' if track_uri else 'unmatched'] += 1
+        return row, track_uri
+
+    # Function: return (row, match key, future of its track URI) for a row: already resolved for rows with a track URI, cached rows and rows in the same run as a search in flight; else a search submitted to executor.
+    def resolve(self, row, executor, searches):
+        self.counts['rows'] += 1
+        future = Future()
+        track_uri = row.get('track_uri') or ''
+        if track_uri.startswith('spotify:track:'):
+            self.counts['passed_through'] += 1
+            future.set_result(track_uri)
+            return row, None, future
+        match_key = get_match_key(row)
+        if match_key is None:
+            self.counts['unmatchable'] += 1
+            future.set_result(None)
+            return row, None, future
+        if match_key in searches:
+            self.counts['deduplicated'] += 1
+            return row, None, searches[match_key]
+        is_cached, track_uri = self.get_cached(match_key)
+        if is_cached:
+            self.counts['cache_hits'] += 1
+            future.set_result(track_uri)
+            return row, None, future
+        self.counts['cache_misses'] += 1
+        searches[match_key] = executor.submit(self.search, row)
+        return row, match_key, searches[match_key]
+
+    def get_metrics(self):
+        lookups = self.counts['cache_hits'] + self.counts['deduplicated'] + self.counts['cache_misses']
+        return {
+            'rows': self.counts['rows'],
+            'matched': self.counts['matched'],
+            'unmatched': self.counts['unmatched'],
+            'errors': self.counts['errors'],
+            'passed_through': self.counts['passed_through'],
+            'cache_hits': self.counts['cache_hits'],
+            'deduplicated': self.counts['deduplicated'],
+            'searched_rows': self.counts['cache_misses'],
+            'search_requests': self.counts['searches'],
+            'cache_hit_rate': round((self.counts['cache_hits'] + self.counts['deduplicated']) / lookups, 3) if lookups else None,
+            'seconds': round(self.match_seconds, 2),
+            'rows_per_second': round(self.counts['rows'] / self.match_seconds, 1) if self.match_seconds else None,
+            'mean_search_ms': round(self.search_seconds / self.counts['cache_misses'] * 1000, 1) if self.counts['cache_misses'] else None,
+        }
+
+    def print_metrics(self):
+        print("~\nTrack matching:", self.get_metrics())
@@ -0,0 +1,93 @@
+# DESCRIPTION
+# Replaces one track with another everywhere in the user's library, for example to swap a track for a better recording or remaster of it: at the same positions in every playlist the user owns (optionally also unsaving the old track from Liked Songs).
+# Occurrences come from the local library database's track -> (playlist, position, snapshot_id) index (the playlist_tracks table and its index by track; see library_database.py), which is kept current incrementally: playlists whose snapshot_id changed are re-synced first, and every swap is recorded in it.
+# Each playlist takes one request to remove every occurrence of the old track (by position, guarded by the playlist's snapshot_id, so a playlist changed meanwhile is refused rather than edited at the wrong positions) and one request per run of consecutive positions to insert the new track; playlists are swapped concurrently on a small thread pool.
+
+# USAGE
+#    import track_swap
+#    track_swap.swap_track_everywhere(sp, library_database, old_track_ID, new_track_ID, owner_id=user_id)
+# -- which returns a summary dictionary (occurrences and playlists swapped, failed playlists, seconds taken).
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from library_database import get_spotify_id
+
+# How many playlists are swapped at once:
+SWAP_WORKERS = 8
+# The add items endpoint accepts at most this many items per request:
+TRACKS_PER_ADD_REQUEST = 100
+
+# Function: return runs of consecutive positions in ascending positions, as (start, length) pairs, split to at most TRACKS_PER_ADD_REQUEST long.
+def get_position_runs(positions):
+    runs = []
+    for position in positions:
+        if runs and runs[-1][0] + runs[-1][1] == position and runs[-1][1] < TRACKS_PER_ADD_REQUEST:
+            runs[-1][1] += 1
+        else:
+            runs.append([position, 1])
+    return [tuple(run) for run in runs]
+
+# Function: replace every occurrence of old_track_id in one playlist with new_track_id, at the same positions (as the local library database has them; sync the playlist first). Returns the number of occurrences replaced.
+def swap_track_in_playlist(sp, library_database, playlist_id, old_track_id, new_track_id):
+    occurrence = library_database.get_track_occurrences(old_track_id).get(playlist_id)
+    if not occurrence:
+        return 0
+    positions = occurrence['positions']
+    result = sp.playlist_remove_specific_occurrences_of_items(playlist_id, [{'uri': 'spotify:track:' + old_track_id, 'positions': positions}], snapshot_id=occurrence['snapshot_id'])
+    # inserting runs in ascending order puts every one back at its original position, as every earlier gap has been filled by then:
+    inserted_positions = []
+    try:
+        for start, length in get_position_runs(positions):
+            result = sp.playlist_add_items(playlist_id, ['spotify:track:' + new_track_id] * length, position=start)
+            inserted_positions.extend(range(start, start + length))
+    except:
+        # (the local copy of the playlist keeps its old snapshot_id, so the next sync re-downloads it:)
+        print("~\nSwap track: removed the old track from playlist", occurrence['name'], "(" + playlist_id + ") but could not insert the new track at positions", positions[len(inserted_positions):], "(0 is the first track).")
+        raise
+    library_database.record_track_replaced(playlist_id, positions, new_track_id, result['snapshot_id'], occurrence['snapshot_id'])
+    return len(positions)
+
+# Function: replace old_track_id with new_track_id at the same positions in every playlist (owned by owner_id, if that's passed; others can't be edited), re-syncing changed playlists first if sync_first (else only checking the snapshot_id of each playlist the local database has it in), and unsaving old_track_id from Liked Songs if unsave_old (also saving new_track_id, if the old one was saved). Prints and returns a summary.
+def swap_track_everywhere(sp, library_database, old_track_id, new_track_id, owner_id=None, unsave_old=False, saved_tracks_cache=None, sync_first=True):
+    start_time = time.perf_counter()
+    old_track_id = get_spotify_id(old_track_id)
+    new_track_id = get_spotify_id(new_track_id)
+    if old_track_id == new_track_id:
+        print("~\nSwap track: the track to swap in is the track to swap out; nothing to do.")
+        return None
+    if sync_first:
+        library_database.sync_playlists()
+    playlist_ids = list(library_database.get_track_occurrences(old_track_id, owner_id))
+    print("~\nSwap track: replacing", old_track_id, "with", new_track_id, "in", len(playlist_ids), "playlists . .")
+    def swap(playlist_id):
+        with sp.attributed_to('swap_track_everywhere'):
+            try:
+                if not sync_first:
+                    library_database.sync_playlist(playlist_id)
+                return swap_track_in_playlist(sp, library_database, playlist_id, old_track_id, new_track_id)
+            except Exception as e:
+                print("~\nSwap track: could not swap the track in playlist", playlist_id + ". Printing the error response:")
+                print(e)
+                return None
+    with ThreadPoolExecutor(max_workers=SWAP_WORKERS, thread_name_prefix='track_swap') as executor:
+        swapped_counts = dict(zip(playlist_ids, executor.map(swap, playlist_ids)))
+    summary = {
+        'occurrences': sum(count for count in swapped_counts.values() if count),
+        'playlists': sum(1 for count in swapped_counts.values() if count),
+        'failed_playlists': [playlist_id for playlist_id, count in swapped_counts.items() if count is None],
+        'unsaved_old_track': False,
+    }
+    if unsave_old and sp.current_user_saved_tracks_contains([old_track_id])[0]:
+        sp.current_user_saved_tracks_add([new_track_id])
+        sp.current_user_saved_tracks_delete([old_track_id])
+        library_database.record_saved_tracks_added([new_track_id])
+        library_database.record_saved_tracks_removed([old_track_id])
+        if saved_tracks_cache:
+            saved_tracks_cache.add([new_track_id])
+            saved_tracks_cache.discard([old_track_id])
+        summary['unsaved_old_track'] = True
+    summary['seconds'] = round(time.perf_counter() - start_time, 2)
+    print("Swap track: replaced", summary['occurrences'], "occurrences in", summary['playlists'], "playlists in", summary['seconds'], "seconds" + (", and swapped it in Liked Songs." if summary['unsaved_old_track'] else "."))
+    if summary['failed_playlists']:
+        print("Swap track: failed for playlists", summary['failed_playlists'])
+    return summary